@@ -28,12 +28,115 @@ including averaging, subtracting, and merging.
 if __name__ == "__main__" and __package__ is None:
     __package__ = "SASPub"
 
+import collections
+import os.path
+import threading
+import weakref
+
 import numpy as np
 
+import SASExceptions
+
+def intern_q(q):
+	"""
+	Returns a shared, read only copy of a q grid. Profiles measured with the
+	same setup have identical q grids, so they all end up pointing at one
+	array instead of each holding their own.
+	"""
+	q = np.asarray(q)
+	key = (q.shape, q.dtype.str, hash(q.tobytes()))
+
+	with _q_pool_lock:
+		shared = _q_pool.get(key)
+
+		if shared is not None and np.array_equal(shared, q):
+			return shared
+
+		# Copied, so the caller's own array isn't frozen
+		q = q.copy()
+		q.flags.writeable = False
+		_q_pool[key] = q
+
+	return q
+
+def set_compact_storage(compact):
+	"""
+	If compact is True, intensities and errors of profiles loaded from now on
+	are stored as float32 instead of float64, halving their memory use.
+	"""
+	global storage_dtype
+
+	if compact:
+		storage_dtype = np.float32
+	else:
+		storage_dtype = np.float64
+
+def _to_storage_dtype(array):
+	return np.asarray(array, dtype=storage_dtype)
+
+class _LazyArray(object):
+	"""
+	Array attribute of a data object that is loaded from the object's source
+	the first time it is used. Values are passed through convert when set.
+	"""
+
+	def __init__(self, name, convert=None):
+		self.name = '_' + name
+		self.convert = convert
+
+	def __get__(self, obj, objtype=None):
+		if obj is None:
+			return self
+
+		if obj.source is None and obj.arrays_loaded:
+			return getattr(obj, self.name)
+
+		# Held until the array is read, so another thread can't evict it
+		# in between
+		with memory_manager.lock:
+			if not obj.arrays_loaded:
+				obj.load_arrays()
+			else:
+				memory_manager.touch(obj)
+
+			return getattr(obj, self.name)
+
+	def __set__(self, obj, value):
+		if value is not None and self.convert is not None:
+			value = self.convert(value)
+
+		setattr(obj, self.name, value)
+
 class ProfileData(object):
-	
+
+	metadata_keys = ('rg', 'rg_err', 'i0', 'i0_err', 'guinier_qmin',
+		'guinier_qmax', 'parameters')
+
+	array_keys = ('q', 'i', 'err', 'fit_q', 'fit_i', 'fit_err')
+
+	__slots__ = ('_q', '_i', '_err', '_fit_q', '_fit_i', '_fit_err',
+		'arrays_loaded', 'source', 'has_fit', 'rg', 'rg_err', 'i0', 'i0_err',
+		'guinier_qmin', 'guinier_qmax', 'parameters', 'filename',
+		'short_filename', 'id', 'item_panel', 'guinier_fit',
+		'guinier_residual', 'q_idx_min', 'q_idx_max', '_pins', '__weakref__')
+
+	q = _LazyArray('q', intern_q)
+	i = _LazyArray('i', _to_storage_dtype)
+	err = _LazyArray('err', _to_storage_dtype)
+	fit_q = _LazyArray('fit_q', intern_q)
+	fit_i = _LazyArray('fit_i', _to_storage_dtype)
+	fit_err = _LazyArray('fit_err', _to_storage_dtype)
+
 	def __init__(self, q, i, err, fit_q=None, fit_i=None, fit_err=None):
 
+		self.arrays_loaded = True
+		self.source = None
+
+		self.filename = None
+		self.short_filename = None
+		self.id = None
+		self.item_panel = None
+
 		self.q = q
 		self.i = i
 		self.err = err
@@ -54,6 +157,385 @@ class ProfileData(object):
 		self.guinier_qmin = None
 		self.guinier_qmax = None
 
+		self.parameters = {}
+
+		self.guinier_fit = None
+		self.guinier_residual = None
+		self.q_idx_min = None
+		self.q_idx_max = None
+
+		self._pins = 0
+
+	@classmethod
+	def stub(cls, source, has_fit=False):
+		"""
+		Makes a profile without any arrays loaded. The arrays are loaded
+		the first time they're accessed by calling source, which should
+		return a fully loaded ProfileData.
+		"""
+		data = cls(None, None, None)
+		data.has_fit = has_fit
+		data.source = source
+		data.arrays_loaded = False
+
+		return data
+
+	def load_arrays(self):
+		if self.arrays_loaded:
+			return
+
+		loaded = self.source()
+
+		if loaded is None:
+			raise SASExceptions.UnrecognizedDataFormat('Could not load the data arrays.')
+
+		for key in self.array_keys:
+			setattr(self, key, getattr(loaded, key))
+
+		self.arrays_loaded = True
+
+		memory_manager.add(self)
+
+	def set_source(self, source):
+		"""
+		Sets the function used to reload the arrays if they're evicted to
+		stay under the memory budget. Profiles without a source are never
+		evicted.
+		"""
+		self.source = source
+
+		if self.arrays_loaded:
+			memory_manager.add(self)
+
+	def evict_arrays(self):
+		if self.source is None or not self.arrays_loaded:
+			return
+
+		for key in self.array_keys:
+			setattr(self, key, None)
+
+		self.arrays_loaded = False
+
+	def pin(self):
+		"""Keeps the arrays in memory, e.g. while the profile is plotted."""
+		self._pins = self._pins + 1
+
+	def unpin(self):
+		self._pins = max(self._pins - 1, 0)
+
+	@property
+	def pinned(self):
+		return self._pins > 0
+
+	@property
+	def nbytes(self):
+		"""
+		Memory used by the loaded arrays. The q grids are shared between
+		profiles, so aren't counted.
+		"""
+		if not self.arrays_loaded:
+			return 0
+
+		arrays = {}
+		for key in ('i', 'err', 'fit_i', 'fit_err'):
+			array = getattr(self, '_' + key)
+			if array is not None:
+				arrays[id(array)] = array
+
+		return sum(array.nbytes for array in arrays.values())
+
+	def get_metadata(self):
+		"""Returns the analysis values and header parameters as a json
+		serializable dict."""
+		metadata = {key : getattr(self, key) for key in self.metadata_keys}
+
+		return metadata
+
+	def set_metadata(self, metadata):
+		for key in self.metadata_keys:
+			if key in metadata:
+				setattr(self, key, metadata[key])
+
+class ProfileStack(object):
+	"""
+	A batch of profiles on a common q grid, stored as contiguous (N, nq)
+	intensity and error arrays plus one metadata column per scalar value.
+	Operations act on all rows at once and return new stacks, with errors
+	propagated in quadrature. Unknown metadata values are stored as NaN.
+	"""
+
+	column_keys = ('rg', 'rg_err', 'i0', 'i0_err', 'guinier_qmin',
+		'guinier_qmax')
+
+	def __init__(self, q, i, err, filenames=None, **columns):
+		self.q = intern_q(q)
+		self.i = np.atleast_2d(np.asarray(i, dtype=storage_dtype))
+		self.err = np.atleast_2d(np.asarray(err, dtype=storage_dtype))
+
+		nprofiles, nq = self.i.shape
+
+		if self.err.shape != self.i.shape or nq != self.q.size:
+			raise SASExceptions.DataNotCompatible('The intensity, error, and q arrays have different sizes.')
+
+		if filenames is None:
+			filenames = ['' for j in range(nprofiles)]
+
+		self.filenames = list(filenames)
+
+		for key in self.column_keys:
+			values = columns.get(key)
+
+			if values is None:
+				values = np.full(nprofiles, np.nan)
+			else:
+				values = np.array([np.nan if val is None else val for val in values],
+					dtype=float)
+
+			setattr(self, key, values)
+
+	def __len__(self):
+		return self.i.shape[0]
+
+	@classmethod
+	def from_profiles(cls, profiles):
+		"""Stacks a list of ProfileData that share a q grid."""
+		if len(profiles) == 0:
+			raise SASExceptions.DataNotCompatible('No profiles to stack.')
+
+		q = profiles[0].q
+
+		if not share_q_grid(profiles):
+			raise SASExceptions.DataNotCompatible('The profiles are not on a common q grid.')
+
+		i = np.stack([data.i for data in profiles])
+		err = np.stack([data.err for data in profiles])
+
+		filenames = [data.filename if data.filename is not None else ''
+			for data in profiles]
+
+		columns = {key : [getattr(data, key) for data in profiles]
+			for key in cls.column_keys}
+
+		return cls(q, i, err, filenames, **columns)
+
+	def to_profiles(self):
+		"""Returns a ProfileData for each row. The arrays are views of the stack."""
+		profiles = []
+
+		for j in range(len(self)):
+			data = ProfileData(self.q, self.i[j], self.err[j])
+
+			for key in self.column_keys:
+				value = getattr(self, key)[j]
+
+				if not np.isnan(value):
+					setattr(data, key, float(value))
+
+			if self.filenames[j]:
+				data.filename = self.filenames[j]
+				data.short_filename = os.path.basename(self.filenames[j])
+
+			profiles.append(data)
+
+		return profiles
+
+	def average(self):
+		"""Averages all the rows into a single ProfileData."""
+		nprofiles = len(self)
+
+		i = self.i.mean(axis=0)
+		err = np.sqrt(np.sum(self.err**2, axis=0))/nprofiles
+
+		return ProfileData(self.q, i, err)
+
+	def subtract(self, other):
+		"""
+		Subtracts other from every row. Other can be a ProfileData, a one
+		row stack, or a stack with the same number of rows.
+		"""
+		other_i, other_err = self._get_operand_arrays(other)
+
+		i = self.i - other_i
+		err = np.sqrt(self.err**2 + other_err**2)
+
+		return self._copy_with(i, err, keep_columns=False)
+
+	def scale(self, factors):
+		"""Scales each row by factors, a single value or one per row."""
+		factors = self._get_row_values(factors)
+
+		i = self.i*factors
+		err = self.err*np.abs(factors)
+
+		stack = self._copy_with(i, err)
+		stack.i0 = self.i0*factors[:, 0]
+		stack.i0_err = self.i0_err*np.abs(factors[:, 0])
+
+		return stack
+
+	def normalize(self, values=None, value_errors=None):
+		"""
+		Divides each row by a value, by default the row's I(0). If errors of
+		the values are given they're propagated into the profile errors.
+		"""
+		if values is None:
+			values = self.i0
+			if value_errors is None:
+				value_errors = np.where(np.isnan(self.i0_err), 0, self.i0_err)
+
+		values = self._get_row_values(values)
+
+		if value_errors is None:
+			value_errors = np.zeros_like(values)
+		else:
+			value_errors = self._get_row_values(value_errors)
+
+		i = self.i/values
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			rel_err = np.sqrt((self.err/self.i)**2 + (value_errors/values)**2)
+			err = np.where(self.i != 0, np.abs(i)*rel_err, self.err/np.abs(values))
+
+		stack = self._copy_with(i, err)
+		stack.i0 = self.i0/values[:, 0]
+		stack.i0_err = self.i0_err/np.abs(values[:, 0])
+
+		return stack
+
+	def _get_row_values(self, values):
+		values = np.asarray(values, dtype=float)
+
+		if values.ndim == 0:
+			values = np.full(len(self), float(values))
+
+		if values.shape != (len(self),):
+			raise SASExceptions.DataNotCompatible('Need one value per profile.')
+
+		return values[:, np.newaxis]
+
+	def _get_operand_arrays(self, other):
+		if isinstance(other, ProfileData):
+			other_q = other.q
+			other_i = other.i[np.newaxis, :]
+			other_err = other.err[np.newaxis, :]
+		else:
+			other_q = other.q
+			other_i = other.i
+			other_err = other.err
+
+		if other_q is not self.q and not np.array_equal(other_q, self.q):
+			raise SASExceptions.DataNotCompatible('The profiles are not on a common q grid.')
+
+		if other_i.shape[0] != 1 and other_i.shape[0] != len(self):
+			raise SASExceptions.DataNotCompatible('The number of profiles does not match.')
+
+		return other_i, other_err
+
+	def _copy_with(self, i, err, keep_columns=True):
+		if keep_columns:
+			columns = {key : getattr(self, key).copy() for key in self.column_keys}
+		else:
+			columns = {}
+
+		return ProfileStack(self.q, i, err, self.filenames, **columns)
+
+def share_q_grid(profiles):
+	"""Returns True if all the profiles have the same q grid."""
+	if len(profiles) == 0:
+		return True
+
+	q = profiles[0].q
+
+	for data in profiles[1:]:
+		if data.q is not q and not np.array_equal(data.q, q):
+			return False
+
+	return True
+
+class ArrayMemoryManager(object):
+	"""
+	Keeps the arrays of reloadable profiles under a memory budget. When the
+	budget is exceeded, the arrays of the least recently used profiles that
+	aren't pinned are evicted, and are reloaded from their source the next
+	time they're used. Profiles are added from the loading thread too, so
+	``lock`` must be held to read arrays that could be evicted.
+	"""
+
+	def __init__(self, budget=None):
+		self.budget = budget
+		self.used = 0
+
+		self._profiles = collections.OrderedDict()
+		self.lock = threading.RLock()
+
+	def add(self, data):
+		with self.lock:
+			key = id(data)
+
+			if key in self._profiles:
+				self.used = self.used - self._profiles[key][1]
+
+			nbytes = data.nbytes
+			self._profiles[key] = (weakref.ref(data, self._make_callback(key)), nbytes)
+			self.used = self.used + nbytes
+
+			self._evict(data)
+
+	def touch(self, data):
+		with self.lock:
+			key = id(data)
+
+			if key in self._profiles:
+				self._profiles.move_to_end(key)
+
+	def remove(self, data):
+		with self.lock:
+			self._remove(id(data))
+
+	def set_budget(self, budget):
+		"""Sets the budget in bytes. None turns eviction off."""
+		with self.lock:
+			self.budget = budget
+			self._evict()
+
+	def _evict(self, keep=None):
+		if self.budget is None or self.used <= self.budget:
+			return
+
+		for key, (ref, nbytes) in list(self._profiles.items()):
+			if self.used <= self.budget:
+				break
+
+			data = ref()
+
+			if data is None or data is keep or data.pinned:
+				continue
+
+			data.evict_arrays()
+			self._remove(key)
+
+	def _remove(self, key):
+		if key in self._profiles:
+			ref, nbytes = self._profiles.pop(key)
+			self.used = self.used - nbytes
+
+	def _make_callback(self, key):
+		def callback(ref):
+			with self.lock:
+				if key in self._profiles and self._profiles[key][0] is ref:
+					self._remove(key)
+
+		return callback
+
+#: Shared by all profiles. The default budget is 2 GiB.
+memory_manager = ArrayMemoryManager(2*1024**3)
+
+#: dtype used to store intensities and errors, see set_compact_storage.
+storage_dtype = np.float64
+
+_q_pool = weakref.WeakValueDictionary()
+_q_pool_lock = threading.Lock()
+
 class SeriesData(object):
 	pass
 
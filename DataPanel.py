@@ -29,14 +29,18 @@ if __name__ == "__main__" and __package__ is None:
     __package__ = "SASPub"
 
 import os.path
+import bisect
 import collections
-import platform
+import threading
 
 import wx
 import wx.lib.agw.ultimatelistctrl as ULC
-import wx.lib.scrolledpanel as scrolled
 
+import Data
+import SASCalc
+import SASExceptions
 import SASFileIO
+import SASSearch
 
 
 class DataPanel(wx.Panel):
@@ -53,13 +57,22 @@ class DataPanel(wx.Panel):
         ctrl_sizer = wx.StaticBoxSizer(wx.VERTICAL, self, "Data")
         static_box = ctrl_sizer.GetStaticBox()
 
-        self.list_panel = scrolled.ScrolledPanel(static_box, -1, style=wx.BORDER_SUNKEN)
-        self.list_panel.SetVirtualSize((200, 200))
-        self.list_panel.SetScrollRate(20,20)
-        self.list_panel.SetBackgroundColour(wx.Colour(250,250,250))
+        # Rows are read from the model as they're shown, so only the visible
+        # rows cost anything.
+        self.list_model = DataListModel()
+        self.selection = SelectionModel(self.list_model)
+        self.list_ctrl = DataListCtrl(static_box, self.list_model, self.selection)
 
-        self.list_sizer = wx.BoxSizer(wx.VERTICAL)
-        self.list_panel.SetSizer(self.list_sizer)
+        self.list_ctrl.Bind(wx.EVT_LIST_COL_CLICK, self._on_column_click)
+        self.list_ctrl.Bind(wx.EVT_LEFT_DOWN, self._on_left_click)
+        self.list_ctrl.Bind(wx.EVT_RIGHT_DOWN, self._on_right_click)
+        self.list_ctrl.Bind(wx.EVT_KEY_DOWN, self._on_key_press)
+
+        self.filter_ctrl = wx.SearchCtrl(static_box)
+        self.filter_ctrl.ShowCancelButton(True)
+        self.filter_ctrl.SetDescriptiveText('Filter, e.g. rg > 30 and file ~ "buffer"')
+        self.filter_ctrl.Bind(wx.EVT_TEXT, self._on_filter_text)
+        self.filter_ctrl.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self._on_filter_cancel)
 
         load = wx.Button(static_box, label='Load Data')
         remove = wx.Button(static_box, label='Remove Data')
@@ -71,19 +84,49 @@ class DataPanel(wx.Panel):
         button_ctrl.Add(load, border=5, flag=wx.RIGHT|wx.LEFT)
         button_ctrl.Add(remove, border=5, flag=wx.RIGHT)
 
-        ctrl_sizer.Add(self.list_panel, border=5, flag=wx.ALL|wx.EXPAND, proportion=1)
+        self.load_button = load
+
+        self.load_status = wx.StaticText(static_box, label='')
+        self.load_gauge = wx.Gauge(static_box, range=100, size=(150, -1))
+        self.load_cancel = wx.Button(static_box, label='Cancel')
+        self.load_cancel.Bind(wx.EVT_BUTTON, self._on_cancel_load)
+
+        self.progress_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.progress_sizer.Add(self.load_status, border=5, flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL)
+        self.progress_sizer.Add(self.load_gauge, border=5, flag=wx.RIGHT|wx.ALIGN_CENTER_VERTICAL,
+            proportion=1)
+        self.progress_sizer.Add(self.load_cancel, flag=wx.ALIGN_CENTER_VERTICAL)
+
+        ctrl_sizer.Add(self.filter_ctrl, border=5, flag=wx.LEFT|wx.RIGHT|wx.TOP|wx.EXPAND)
+        ctrl_sizer.Add(self.list_ctrl, border=5, flag=wx.ALL|wx.EXPAND, proportion=1)
+        ctrl_sizer.Add(self.progress_sizer, border=5, flag=wx.LEFT|wx.RIGHT|wx.EXPAND)
         ctrl_sizer.Add(button_ctrl, border=5, flag=wx.BOTTOM|wx.TOP|wx.ALIGN_CENTER_HORIZONTAL)
 
+        ctrl_sizer.Hide(self.progress_sizer, recursive=True)
+
+        self.ctrl_sizer = ctrl_sizer
+
         self.SetSizer(ctrl_sizer)
 
     def _initialize(self):
         self.loaded_files = collections.OrderedDict()
 
+        # Metadata index for the filter box, kept up to date as data is
+        # added and removed.
+        self.index = SASSearch.DataIndex()
+        self.filter_query = ''
+
         standard_paths = wx.StandardPaths.Get()
         self.current_directory = standard_paths.GetUserLocalDataDir()
 
         self.top_window = self.GetParent()
 
+        # Files load on a background thread, and are added to the list and
+        # plots in chunks as they finish.
+        self.load_chunk_size = 64
+        self._load_thread = None
+        self._cancel_load = None
+
     def _on_load(self, evt):
 
         wx.CallAfter(self._load_files)
@@ -106,206 +149,693 @@ class DataPanel(wx.Panel):
             if not isinstance(files, list):
                 files = [files,]
 
-            data = SASFileIO.load_files(files)
             self.current_directory = os.path.dirname(files[0])
 
-        self.add_items(data)
+            self.start_loading(files)
 
-    def add_items(self, data_list):
-        self.list_panel.Freeze()
+    def start_loading(self, files):
+        """
+        Loads files on a background thread. Chunks of loaded data are added
+        as they finish, and the load can be cancelled from the progress bar.
+        """
+        if self._load_thread is not None and self._load_thread.is_alive():
+            return
 
-        for data in data_list:
-            new_data_item = DataItemPanel(self.list_panel, data)
+        self._cancel_load = threading.Event()
+
+        self.load_button.Disable()
+        self.load_cancel.Enable()
+        self.load_gauge.SetRange(max(len(files), 1))
+        self.load_gauge.SetValue(0)
+        self.load_status.SetLabel('Loading 0 of {}'.format(len(files)))
+
+        self.ctrl_sizer.Show(self.progress_sizer, recursive=True)
+        self.Layout()
+
+        self._load_thread = threading.Thread(target=self._load_worker,
+            args=(files, self._cancel_load))
+        self._load_thread.daemon = True
+        self._load_thread.start()
+
+    def _load_worker(self, files, cancel):
+        # Errors are reported by the thread excepthook set up in SASPub
+        try:
+            num_loaded = 0
+
+            for chunk, data_list in SASFileIO.iter_load_files(files,
+                self.load_chunk_size, cancel=cancel, find_rg=True):
+                num_loaded = num_loaded + len(chunk)
+
+                wx.CallAfter(self._on_chunk_loaded, data_list, num_loaded, len(files))
+
+        finally:
+            wx.CallAfter(self._on_load_finished)
+
+    def _on_chunk_loaded(self, data_list, num_loaded, num_files):
+        if len(data_list) > 0:
+            self.add_items(data_list, find_rg=False)
+
+        self.load_gauge.SetValue(num_loaded)
+        self.load_status.SetLabel('Loading {} of {}'.format(num_loaded, num_files))
+
+    def _on_load_finished(self):
+        self.ctrl_sizer.Hide(self.progress_sizer, recursive=True)
+        self.Layout()
 
+        self.load_button.Enable()
+
+    def _on_cancel_load(self, evt):
+        if self._cancel_load is not None:
+            self._cancel_load.set()
+
+        self.load_cancel.Disable()
+        self.load_status.SetLabel('Cancelling')
+
+    def add_items(self, data_list, find_rg=True):
+        """
+        Adds loaded data to the list and the plots.
+
+        :param bool find_rg: Whether to find the Guinier range of profiles
+            that don't have one. The background loader already does this.
+        """
+        if find_rg:
+            _find_rg(data_list)
+
+        for data in data_list:
             item_id = self.top_window.NewControlId()
             data.id = item_id
 
-            self.list_sizer.Add(new_data_item, flag=wx.EXPAND)
-            self.loaded_files[item_id] = (data, new_data_item)
+            self.loaded_files[item_id] = data
 
-            data.item_panel = new_data_item
+        self.index.add(data_list)
+        self.list_model.add(data_list)
 
-        self.top_window.plot_panel.load_data(data_list)
+        if self.filter_query != '':
+            self._apply_filter()
 
-        self.list_panel.SetVirtualSize(self.list_panel.GetBestVirtualSize())
-        self.list_panel.Layout()
-        self.list_panel.Refresh()
+        self.list_ctrl.refresh_items()
 
-        self.list_panel.Thaw()
+        self.top_window.plot_panel.load_data(data_list)
 
     def _on_remove(self, evt):
         selected_items = self.get_selected_item_ids()
         wx.CallAfter(self.remove_items, selected_items)
 
     def remove_items(self, item_ids):
-        self.list_panel.Freeze()
-
         for item_id in item_ids:
-            data = self.loaded_files[item_id]
+            del self.loaded_files[item_id]
 
-            data[1].Destroy()
+        self.index.remove(item_ids)
+        self.list_model.remove(item_ids)
+        self.selection.remove(item_ids)
+        self.list_ctrl.refresh_items()
 
-            del self.loaded_files[item_id]
+        self.top_window.plot_panel.remove_data(item_ids)
 
-        self.list_panel.SetVirtualSize(self.list_panel.GetBestVirtualSize())
-        self.list_panel.Layout()
-        self.list_panel.Refresh()
+    def update_items(self, data_list):
+        """Updates the list and the index after the metadata of data changed."""
+        self.index.update(data_list)
 
-        self.list_panel.Thaw()
+        if self.list_model.sort_column is not None:
+            self.list_model.sort(self.list_model.sort_column, self.list_model.sort_ascending)
 
-    def deselect_all_except_one(self, data_id):
-        self.list_panel.Freeze()
+        if self.filter_query != '':
+            self._apply_filter()
 
-        for item_id, data in self.loaded_files.items():
-            if item_id != data_id:
-                if data[1].selected:
-                    data[1].toggle_select()
+        self.list_ctrl.refresh_items()
 
-        self.list_panel.Thaw()
+    def _on_filter_text(self, evt):
+        self.set_filter(self.filter_ctrl.GetValue())
 
-    def select_all(self):
-        self.list_panel.Freeze()
+    def _on_filter_cancel(self, evt):
+        self.filter_ctrl.ChangeValue('')
+        self.set_filter('')
 
-        for item_id, data in self.loaded_files.items():
-            if not data[1].selected:
-                data[1].toggle_select()
+    def set_filter(self, query):
+        """
+        Shows only the data matching a filter query, see :mod:`SASSearch`
+        for the syntax. An invalid query leaves the current filter in place
+        and marks the filter box.
+        """
+        query = query.strip()
 
-        self.list_panel.Thaw()
+        try:
+            ids = self.index.query(query)
+        except SASExceptions.InvalidQuery as e:
+            self.filter_ctrl.SetBackgroundColour(wx.Colour(255, 220, 220))
+            self.filter_ctrl.SetToolTip(str(e.parameter))
+            self.filter_ctrl.Refresh()
+            return
 
-    def get_selected_items(self):
-        selected_items = []
+        self.filter_ctrl.SetBackgroundColour(wx.NullColour)
+        self.filter_ctrl.UnsetToolTip()
+        self.filter_ctrl.Refresh()
 
-        for each in self.loaded_files.values():
-            if each[1].selected:
-                selected_items.append(each[1])
+        self.filter_query = query
+        self._apply_filter(ids)
+        self.list_ctrl.refresh_items()
 
-        return selected_items
+    def _apply_filter(self, ids=None):
+        if self.filter_query == '':
+            ids = None
+        elif ids is None:
+            ids = self.index.query(self.filter_query)
 
-    def get_selected_item_ids(self):
-        selected_items = []
+        self.list_model.set_filter(ids)
 
-        for key, data in self.loaded_files.items():
-            if data[1].selected:
-                selected_items.append(key)
+        if ids is not None:
+            hidden = [item_id for item_id in self.selection.selected if item_id not in ids]
 
-        return selected_items
+            if len(hidden) > 0:
+                self.selection.deselect(hidden)
 
-    def get_data_item_panels(self):
-        data_item_panels = [item[1] for item in self.loaded_files.values()]
+    def _on_column_click(self, evt):
+        column = evt.GetColumn()
 
-        return data_item_panels
+        if column == self.list_model.sort_column:
+            ascending = not self.list_model.sort_ascending
+        else:
+            ascending = True
 
-class DataItemPanel(wx.Panel):
+        self.list_model.sort(column, ascending)
+        self.list_ctrl.show_sort(column, ascending)
+        self.list_ctrl.refresh_items()
 
-    def __init__(self, parent, data, *args, **kwargs):
+    def _on_left_click(self, evt):
+        # Selection is handled by the selection model rather than the
+        # control, so the event isn't skipped.
+        row = self.list_ctrl.get_row_at(evt.GetPosition())
+        self.list_ctrl.SetFocus()
 
-        wx.Panel.__init__(self, parent, *args, style=wx.BORDER_RAISED, **kwargs)
+        if row is None:
+            if not evt.CmdDown() and not evt.ShiftDown():
+                self.selection.clear()
+            return
 
-        self.data = data
-        self.data_panel = parent.GetParent().GetParent()
+        item_id = self.list_model.get_id(row)
 
-        self._create_layout()
+        if evt.ShiftDown():
+            self.selection.select_range(item_id, add=evt.CmdDown())
+        elif evt.CmdDown():
+            self.selection.toggle(item_id)
+        else:
+            self.selection.select([item_id])
 
-        self.Bind(wx.EVT_LEFT_DOWN, self._on_left_mouse_button)
-        self.Bind(wx.EVT_RIGHT_DOWN, self._on_right_mouse_button)
-        self.Bind(wx.EVT_KEY_DOWN, self._on_key_press)
+    def _on_right_click(self, evt):
+        row = self.list_ctrl.get_row_at(evt.GetPosition())
 
-        opsys = platform.system()
+        if row is not None:
+            item_id = self.list_model.get_id(row)
 
-        if opsys != 'Darwin':
-            self.name.Bind(wx.EVT_LEFT_DOWN, self._on_left_mouse_button)
-            self.name.Bind(wx.EVT_RIGHT_DOWN, self._on_right_mouse_button)
-            self.name.Bind(wx.EVT_KEY_DOWN, self._on_key_press)
+            if not self.selection.is_selected(item_id):
+                self.selection.select([item_id])
 
-        self._initialize()
+        evt.Skip()
 
-    def _create_layout(self):
+    def _on_key_press(self, evt):
+        key = evt.GetKeyCode()
+
+        if key == wx.WXK_DELETE or (key == wx.WXK_BACK and evt.CmdDown()):
+            self._on_remove(evt)
+        elif key == ord('A') and evt.CmdDown():
+            self.select_all()
+        elif key in _move_keys and len(self.list_model) > 0:
+            self._move_selection(self._get_move_step(_move_keys[key]), evt.ShiftDown())
+        elif key == wx.WXK_SPACE and len(self.list_model) > 0:
+            self._select_current(evt.CmdDown())
+        else:
+            evt.Skip()
 
-        self.name = wx.StaticText(self, label=self.data.short_filename)
-        top_sizer = wx.BoxSizer()
-        top_sizer.Add(self.name, border=5, flag=wx.ALL)
+    def _get_move_step(self, key):
+        page = max(self.list_ctrl.GetCountPerPage()-1, 1)
 
-        self.SetSizer(top_sizer)
-        self.SetBackgroundColour(wx.Colour(250,250,250))
+        steps = {
+            wx.WXK_UP       : -1,
+            wx.WXK_DOWN     : 1,
+            wx.WXK_PAGEUP   : -page,
+            wx.WXK_PAGEDOWN : page,
+            wx.WXK_HOME     : -len(self.list_model),
+            wx.WXK_END      : len(self.list_model),
+            }
 
-    def _initialize(self):
-        self.selected = False
+        return steps[key]
 
-        self.highlight_bkg_color = wx.SystemSettings.GetColour(wx.SYS_COLOUR_HIGHLIGHT)
+    def _move_selection(self, step, extend=False):
+        current = self.selection.current
 
-    def _on_key_press(self, evt):
+        if current is None or self.list_model.get_row(current) is None:
+            # Moving down starts from before the first row
+            row = step - 1 if step > 0 else 0
+        else:
+            row = self.list_model.get_row(current) + step
 
-        key = evt.GetKeyCode()
+        row = min(max(row, 0), len(self.list_model)-1)
+
+        item_id = self.list_model.get_id(row)
+
+        if extend:
+            self.selection.select_range(item_id)
+        else:
+            self.selection.select([item_id])
+
+        self.list_ctrl.EnsureVisible(row)
+
+    def _select_current(self, toggle=False):
+        """Selects only the current row, or toggles it if toggle is set, like a click on it."""
+        current = self.selection.current
+
+        if current is None or self.list_model.get_row(current) is None:
+            current = self.list_model.get_id(0)
+
+        if toggle:
+            self.selection.toggle(current)
+        else:
+            self.selection.select([current])
+
+        self.list_ctrl.EnsureVisible(self.list_model.get_row(current))
 
-        if ((key == wx.WXK_DELETE) or (key == wx.WXK_BACK and evt.CmdDown())) and self.selected == True:
-            self.removeSelf()
-        elif key == 65 and evt.CmdDown(): #A
-            self.data_panel.select_all()
+    def select_item(self, item_id):
+        """Selects only the given item, and scrolls it into view."""
+        row = self.list_model.get_row(item_id)
 
-    def _on_right_mouse_button(self, evt):
-        if not self.selected:
-            self.toggle_select()
-            self.data_panel.deselect_all_except_one(self.data.id)
+        if row is None:
+            return
 
-        # if int(wx.__version__.split('.')[0]) >= 3 and platform.system() == 'Darwin':
-        #     wx.CallAfter(self._showPopupMenu)
-        # else:
-        #     self._showPopupMenu()
+        self.selection.select([item_id])
+        self.list_ctrl.EnsureVisible(row)
 
-    def _on_left_mouse_button(self, evt):
+    def deselect_all_except_one(self, data_id):
+        self.selection.select([data_id])
+
+    def select_all(self):
+        self.selection.select_all()
+
+    def get_selected_items(self):
+        return [self.loaded_files[item_id] for item_id in self.get_selected_item_ids()]
 
-        ctrl_is_down = evt.CmdDown()
-        shift_is_down = evt.ShiftDown()
+    def get_selected_item_ids(self):
+        return self.selection.get_selected_ids()
+
+#: Keys that move the selection, and the key each one is treated as.
+_move_keys = {
+    wx.WXK_UP           : wx.WXK_UP,
+    wx.WXK_DOWN         : wx.WXK_DOWN,
+    wx.WXK_PAGEUP       : wx.WXK_PAGEUP,
+    wx.WXK_PAGEDOWN     : wx.WXK_PAGEDOWN,
+    wx.WXK_HOME         : wx.WXK_HOME,
+    wx.WXK_END          : wx.WXK_END,
+    wx.WXK_NUMPAD_UP    : wx.WXK_UP,
+    wx.WXK_NUMPAD_DOWN  : wx.WXK_DOWN,
+    wx.WXK_NUMPAD_PAGEUP    : wx.WXK_PAGEUP,
+    wx.WXK_NUMPAD_PAGEDOWN  : wx.WXK_PAGEDOWN,
+    wx.WXK_NUMPAD_HOME  : wx.WXK_HOME,
+    wx.WXK_NUMPAD_END   : wx.WXK_END,
+    }
+
+def _find_rg(data_list):
+    needs_rg = [data for data in data_list if isinstance(data, Data.ProfileData)
+        and (data.rg is None or data.i0 is None) and data.guinier_qmin is None]
+
+    if len(needs_rg) > 0:
+        # Only a few profiles are added outside the loader, not enough to
+        # be worth starting worker processes for
+        SASCalc.autorg_profiles(needs_rg, workers=0)
+
+
+class DataListModel(object):
+    """
+    The rows of the data list: the ids of the loaded data in display order,
+    and the text of each column. Rg and I0 are read from the data when a
+    row is shown, the q range is stored when the data is added so the
+    arrays don't have to be loaded to show or sort it. If a filter is set
+    only the ids in it are shown.
+    """
+
+    columns = ('File', 'Rg', 'I0', 'q range')
+
+    def __init__(self):
+        #: The shown ids, in display order.
+        self.order = []
+        self.filter_ids = None
+
+        self._all_order = []
+
+        self.sort_column = None
+        self.sort_ascending = True
+
+        # While sorted: the ids with a value for the sort column, in
+        # ascending order with their values, and the ids without one
+        self._sort_keys = []
+        self._sorted_ids = []
+        self._missing = []
+
+        self._data = {}
+        self._q_ranges = {}
+        self._rows = None
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, data_list):
+        new_ids = []
 
-        if shift_is_down:
-            self.data_panel.list_panel.Freeze()
+        for data in data_list:
+            self._data[data.id] = data
 
             try:
-                selected_items = self.data_panel.get_selected_items()
-                data_item_panels = self.data_panel.get_data_item_panels()
+                q = data.q
+                self._q_ranges[data.id] = (float(q[0]), float(q[-1]))
+            except (AttributeError, IndexError, TypeError):
+                self._q_ranges[data.id] = (None, None)
+
+            new_ids.append(data.id)
 
-                first_item = selected_items[0]
-                first_item_idx = data_item_panels.index(first_item)
+        if self.sort_column is not None:
+            # Only the new rows are sorted, by inserting them into the sorted rows
+            keyed, missing = self._get_sort_keys(new_ids)
 
-                last_item = selected_items[-1]
-                last_item_idx = data_item_panels.index(last_item)
+            for value, data_id in keyed:
+                idx = bisect.bisect_right(self._sort_keys, value)
+                self._sort_keys.insert(idx, value)
+                self._sorted_ids.insert(idx, data_id)
 
-                this_item_idx = data_item_panels.index(self)
+            self._missing.extend(missing)
+            self._set_sorted_order()
+
+        else:
+            self._all_order.extend(new_ids)
+            self._update_order()
 
-                if last_item_idx > this_item_idx:
-                    adj = 0
-                    idxs = [first_item_idx, this_item_idx]
-                else:
-                    idxs = [last_item_idx, this_item_idx]
-                    adj = 1
+    def remove(self, ids):
+        ids = set(ids)
 
-                top_item = max(idxs)
-                bottom_item = min(idxs)
+        for data_id in ids:
+            self._data.pop(data_id, None)
+            self._q_ranges.pop(data_id, None)
 
-                item_list = data_item_panels[bottom_item+adj:top_item+adj]
-                for each in item_list:
-                    each.toggle_select()
-            except IndexError:
-                pass
+        if self.sort_column is not None:
+            keyed = [(value, data_id) for value, data_id
+                in zip(self._sort_keys, self._sorted_ids) if data_id not in ids]
 
-            self.data_panel.list_panel.Thaw()
+            self._sort_keys = [value for value, data_id in keyed]
+            self._sorted_ids = [data_id for value, data_id in keyed]
+            self._missing = [data_id for data_id in self._missing if data_id not in ids]
+            self._set_sorted_order()
 
-        elif ctrl_is_down:
-            self.toggle_select()
         else:
-            self.data_panel.deselect_all_except_one(self.data.id)
-            self.toggle_select()
+            self._all_order = [data_id for data_id in self._all_order if data_id not in ids]
+            self._update_order()
 
-        evt.Skip()
+    def set_filter(self, ids):
+        """Shows only the given ids, or everything if ids is None."""
+        self.filter_ids = ids
+        self._update_order()
+
+    def sort(self, column, ascending=True):
+        """Sorts the rows by a column. Rows without a value go last."""
+        self.sort_column = column
+        self.sort_ascending = ascending
+
+        keyed, self._missing = self._get_sort_keys(self._all_order)
+
+        keyed.sort(key=lambda item: item[0])
+
+        self._sort_keys = [value for value, data_id in keyed]
+        self._sorted_ids = [data_id for value, data_id in keyed]
+        self._set_sorted_order()
+
+    def _get_sort_keys(self, ids):
+        """Returns a list of (value, id) for ids with a value in the sort column, and a list of the other ids."""
+        keyed = []
+        missing = []
+
+        for data_id in ids:
+            value = self.get_value(data_id, self.sort_column)
+
+            if value is None or value != value:
+                missing.append(data_id)
+            else:
+                keyed.append((value, data_id))
+
+        return keyed, missing
 
-    def toggle_select(self):
+    def _set_sorted_order(self):
+        if self.sort_ascending:
+            self._all_order = self._sorted_ids + self._missing
+        else:
+            self._all_order = self._sorted_ids[::-1] + self._missing
+
+        self._update_order()
+
+    def _update_order(self):
+        if self.filter_ids is None:
+            self.order = self._all_order
+        else:
+            self.order = [data_id for data_id in self._all_order if data_id in self.filter_ids]
+
+        self._rows = None
+
+    def get_id(self, row):
+        return self.order[row]
+
+    def get_row(self, data_id):
+        """Returns the row of a data id, or None if it isn't in the list."""
+        if self._rows is None:
+            self._rows = {data_id : row for row, data_id in enumerate(self.order)}
+
+        return self._rows.get(data_id)
+
+    def get_value(self, data_id, column):
+        data = self._data[data_id]
+
+        if column == 0:
+            if data.short_filename is not None:
+                value = data.short_filename.lower()
+            else:
+                value = ''
+        elif column == 1:
+            value = data.rg
+        elif column == 2:
+            value = data.i0
+        else:
+            value = self._q_ranges[data_id][0]
+
+        return value
+
+    def get_text(self, row, column):
+        data_id = self.order[row]
+        data = self._data[data_id]
+
+        if column == 0:
+            text = data.short_filename if data.short_filename is not None else ''
+        elif column == 1:
+            text = '{:.2f}'.format(data.rg) if data.rg is not None else ''
+        elif column == 2:
+            text = '{:.4g}'.format(data.i0) if data.i0 is not None else ''
+        else:
+            qmin, qmax = self._q_ranges[data_id]
+
+            if qmin is not None:
+                text = '{:.4f} - {:.4f}'.format(qmin, qmax)
+            else:
+                text = ''
+
+        return text
+
+
+class SelectionModel(object):
+    """
+    The selected items of a :class:`DataListModel`. Selected ids are kept
+    in a set, and ranges and the selection order come from the model's row
+    index, so no operation scans every loaded item. Listeners are called
+    once after each change, however many items it touched.
+    """
+
+    def __init__(self, list_model):
+        self.list_model = list_model
+
+        self.selected = set()
+
+        #: Fixed end of shift click ranges.
+        self.anchor = None
+        #: Last item clicked, the moving end of ranges.
+        self.current = None
+
+        self._listeners = []
+
+    def __len__(self):
+        return len(self.selected)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def is_selected(self, data_id):
+        return data_id in self.selected
+
+    def select(self, ids, add=False):
+        """Selects the ids, replacing the current selection unless add is set."""
+        ids = list(ids)
+
+        if add:
+            self.selected.update(ids)
+        else:
+            self.selected = set(ids)
+
+        if len(ids) > 0:
+            self.anchor = ids[0]
+            self.current = ids[-1]
+
+        self._changed()
+
+    def deselect(self, ids):
+        self.selected.difference_update(ids)
+        self._changed()
+
+    def toggle(self, data_id):
+        if data_id in self.selected:
+            self.selected.discard(data_id)
+        else:
+            self.selected.add(data_id)
+
+        self.anchor = data_id
+        self.current = data_id
+
+        self._changed()
+
+    def select_range(self, data_id, add=False):
+        """
+        Selects the rows between the anchor and data_id, inclusive. The
+        anchor stays put, so repeated shift clicks resize the range.
+        """
+        anchor_row = None
+
+        if self.anchor is not None:
+            anchor_row = self.list_model.get_row(self.anchor)
 
-        if self.selected:
-            self.selected = False
-            self.SetBackgroundColour(wx.Colour(250,250,250))
+        row = self.list_model.get_row(data_id)
+
+        if row is None:
+            return
+
+        if anchor_row is None:
+            anchor_row = row
+            self.anchor = data_id
+
+        first = min(anchor_row, row)
+        last = max(anchor_row, row)
+
+        ids = self.list_model.order[first:last+1]
+
+        if add:
+            self.selected.update(ids)
+        else:
+            self.selected = set(ids)
+
+        self.current = data_id
+
+        self._changed()
+
+    def select_all(self):
+        self.selected = set(self.list_model.order)
+        self._changed()
+
+    def clear(self):
+        self.selected = set()
+        self._changed()
+
+    def remove(self, ids):
+        """Forgets ids that were removed from the list model."""
+        ids = set(ids)
+
+        self.selected.difference_update(ids)
+
+        if self.anchor in ids:
+            self.anchor = None
+        if self.current in ids:
+            self.current = None
+
+        self._changed()
+
+    def get_selected_ids(self):
+        """Returns the selected ids in list order."""
+        rows = sorted(self.list_model.get_row(data_id) for data_id in self.selected)
+
+        return [self.list_model.get_id(row) for row in rows]
+
+    def _changed(self):
+        for callback in self._listeners:
+            callback()
+
+
+class DataListCtrl(wx.ListCtrl):
+    """
+    Virtual list control that shows the rows of a :class:`DataListModel`.
+    Selected rows are drawn from a :class:`SelectionModel`, the control's
+    own selection isn't used.
+    """
+
+    def __init__(self, parent, model, selection, *args, **kwargs):
+
+        wx.ListCtrl.__init__(self, parent, *args, style=wx.LC_REPORT|wx.LC_VIRTUAL
+            |wx.BORDER_SUNKEN, **kwargs)
+
+        self.model = model
+        self.selection = selection
+
+        self.selected_attr = wx.ItemAttr()
+        self.selected_attr.SetBackgroundColour(wx.SystemSettings.GetColour(
+            wx.SYS_COLOUR_HIGHLIGHT))
+        self.selected_attr.SetTextColour(wx.SystemSettings.GetColour(
+            wx.SYS_COLOUR_HIGHLIGHTTEXT))
+
+        for column, (label, width) in enumerate(zip(model.columns, (200, 70, 80, 130))):
+            self.InsertColumn(column, label, width=width)
+
+        self.selection.add_listener(self._on_selection_changed)
+
+        self.Bind(wx.EVT_LIST_ITEM_SELECTED, self._on_native_select)
+
+    def OnGetItemText(self, item, column):
+        return self.model.get_text(item, column)
+
+    def OnGetItemAttr(self, item):
+        if self.selection.is_selected(self.model.get_id(item)):
+            attr = self.selected_attr
         else:
-            self.selected = True
+            attr = None
 
-            self.SetBackgroundColour(self.highlight_bkg_color)
+        return attr
 
+    def refresh_items(self):
+        """Updates the control after the model changed."""
+        self.SetItemCount(len(self.model))
+        self._clear_native_selection()
         self.Refresh()
+
+    def _on_selection_changed(self):
+        self._clear_native_selection()
+        self.Refresh()
+
+    def _on_native_select(self, evt):
+        # E.g. from a right click, or typing to find a row
+        wx.CallAfter(self._clear_native_selection)
+        evt.Skip()
+
+    def _clear_native_selection(self):
+        # Rows are highlighted from the selection model in OnGetItemAttr, so
+        # a native selection would be drawn on top of it at the wrong rows.
+        if self.GetSelectedItemCount() > 0:
+            self.SetItemState(-1, 0, wx.LIST_STATE_SELECTED)
+
+    def get_row_at(self, pos):
+        """Returns the row at a position in the control, or None."""
+        row, flags = self.HitTest(pos)
+
+        if row == wx.NOT_FOUND or not flags & wx.LIST_HITTEST_ONITEM:
+            row = None
+
+        return row
+
+    def show_sort(self, column, ascending):
+        if hasattr(self, 'ShowSortIndicator'):
+            self.ShowSortIndicator(column, ascending)
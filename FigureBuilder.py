@@ -0,0 +1,844 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the construction of the standard plots of scattering
+profiles. It doesn't depend on wx, so figures can be made without the GUI,
+e.g. by the batch renderer.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+from itertools import cycle
+import collections
+import copy
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import PlotRender
+import SASCalc
+
+
+#: The plot types a ProfilePlot can make.
+plot_types = ('loglin', 'loglog', 'dimkratky', 'guinier')
+
+
+class ProfilePlot(object):
+    """
+    Builds one of the standard plots of scattering profiles (log-lin,
+    log-log, dimensionless Kratky or Guinier) and applies the plot and line
+    settings to it. Used on its own, it draws on an Agg canvas. The GUI's
+    PlotTab uses it as a mixin with a wx canvas, creating self.fig and
+    self.canvas itself and then calling :meth:`_initialize_plot`.
+    """
+
+    def __init__(self, plot_type, plot_settings=None, line_settings=None,
+        figsize=(5,4), dpi=75):
+        """
+        :param str plot_type: One of :data:`plot_types`.
+        :param dict plot_settings: Plot settings that replace the defaults.
+        :param dict line_settings: Default line settings that replace the
+            defaults, e.g. show_error_bars.
+        """
+        if plot_type not in plot_types:
+            raise ValueError('Unknown plot type: {}'.format(plot_type))
+
+        self.plot_type = plot_type
+
+        self.fig = Figure(figsize, dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+
+        self._initialize_plot()
+
+        if line_settings is not None:
+            self.default_line_settings.update(line_settings)
+
+        if plot_settings is not None:
+            self.plot_settings.update(plot_settings)
+
+        self.apply_plot_settings()
+
+    def _initialize_plot(self):
+        self.subplot1 = None
+        self.subplot2 = None
+
+        if self.plot_type == 'loglin' or self.plot_type == 'loglog':
+            self.subplot1 = self.fig.add_subplot(1, 1, 1)
+            self.subplot1.set_xlabel('$q$ ($\AA^{-1}$)')
+            self.subplot1.set_ylabel('$I(q)$')
+
+            self.subplot1.set_yscale('log')
+
+            if self.plot_type == 'loglog':
+                self.subplot1.set_xscale('log')
+
+        elif self.plot_type == 'dimkratky':
+            self.subplot1 = self.fig.add_subplot(1, 1, 1)
+            self.subplot1.set_xlabel('$qR_g$')
+            self.subplot1.set_ylabel('$(qR_g)^2I(q)/I(0)$')
+
+        elif self.plot_type == 'guinier':
+            self.subplot1 = self.fig.add_subplot(2, 1, 1)
+            self.subplot1.set_ylabel('$I(q)$')
+            self.subplot1.set_yscale('log')
+
+            self.subplot2 = self.fig.add_subplot(212, sharex=self.subplot1)
+            self.subplot2.set_xlabel('$q^2$ ($\AA^{-2}$)')
+            self.subplot2.set_ylabel('$\Delta \ln (I(q))/\sigma (q)$')
+
+        elif self.plot_type == 'ift':
+            pass
+
+        elif self.plot_type == 'series':
+            pass
+
+        if (self.plot_type == 'loglin' or self.plot_type == 'loglog' or self.plot_type == 'dimkratky'
+            or self.plot_type == 'guinier'):
+            self.is_profile_plot = True
+        else:
+            self.is_profile_plot = False
+
+        if self.plot_type == 'ift':
+            self.is_ift_plot = True
+        else:
+            self.is_ift_plot = False
+
+        if self.plot_type == 'series':
+            self.is_series_plot = True
+        else:
+            self.is_series_plot = False
+
+
+        self.plot_settings = {
+            'norm_residuals'    : True,
+            'auto_limits'       : True,
+
+            'tick_position_x'   : 'in',
+            'major_ticks_x'     : True,
+            'minor_ticks_x'     : False,
+            'tick_position_y'   : 'in',
+            'major_ticks_y'     : True,
+            'minor_ticks_y'     : True,
+            'tick_position_x2'  : 'in',
+            'major_ticks_x2'    : True,
+            'minor_ticks_x2'    : False,
+            'tick_position_y2'  : 'in',
+            'major_ticks_y2'    : True,
+            'minor_ticks_y2'    : True,
+            'label_top'         : False,
+            'label_bottom'      : True,
+            'label_right'       : False,
+            'label_left'        : True,
+            'label_top2'        : False,
+            'label_bottom2'     : True,
+            'label_right2'      : False,
+            'label_left2'       : True,
+            'tick_x_font'       : 'Humor Sans',
+            'tick_y_font'       : 'Humor Sans',
+            'tick_x_size'       : 20,
+            'tick_y_size'       : 20,
+            'tick_x2_font'      : 'Humor Sans',
+            'tick_y2_font'      : 'Humor Sans',
+            'tick_x2_size'      : 20,
+            'tick_y2_size'      : 20,
+
+            'axis_left_on'      : True,
+            'axis_right_on'     : True,
+            'axis_top_on'       : True,
+            'axis_bottom_on'    : True,
+            'axis_left_on2'     : True,
+            'axis_right_on2'    : True,
+            'axis_top_on2'      : True,
+            'axis_bottom_on2'   : True,
+
+            'collection_rendering'  : True,
+            }
+
+        self.default_line_settings = {
+            'show_error_bars'       : False,
+            'default_line_style'    : 'None',
+            'default_marker_style'  : 'Auto',
+            'default_marker_cycler' : cycle(['o', 'v', 's', '^',  'D', '<', 'X', '>', 'p', '*', 'h']),
+            }
+
+        self.plotted_data = {}
+        self.line_settings = {}
+        self.guinier_fitters = {}
+
+        self.lod = PlotRender.LODManager()
+        self.canvas.mpl_connect('resize_event', self.lod.on_resize)
+
+        # Draws all the profiles with a few shared collections, so the number
+        # of artists doesn't grow with the number of profiles. Only used on
+        # single axes plots, and can't be changed once data is plotted.
+        if self.plot_settings['collection_rendering'] and self.subplot2 is None:
+            self.overlay = PlotRender.ProfileOverlay(self.subplot1)
+        else:
+            self.overlay = None
+
+        # Settings are applied by key, so changing one setting only updates
+        # the artists that depend on it. Everything starts out dirty.
+        self.settings_appliers = self._make_settings_appliers()
+        self._dirty_settings = set(self.plot_settings)
+
+        # Plots made without the GUI are always shown, see PlotTab
+        self.active = True
+
+    def request_redraw(self):
+        """
+        Called whenever the plot changes. There's nothing to do for plots
+        made without the GUI, as they are drawn when saved.
+        """
+        pass
+
+    def plot_data(self, data):
+        self.plot_data_list([data])
+
+    def plot_data_list(self, data_list):
+        """Plots a batch of data, autoscaling and redrawing once at the end."""
+        with self.lod.hold():
+            for data in data_list:
+                if self.is_profile_plot:
+                    self.plot_profile(data)
+                elif self.is_ift_plot:
+                    self.plot_ift(data)
+                elif self.is_series_plot:
+                    self.plot_series(data)
+
+            if self.plot_settings['auto_limits']:
+                self.do_auto_limits()
+
+        self.request_redraw()
+
+    def _get_profile_xy(self, data):
+        """Returns the plotted x, y and error of a profile, or None for each if it can't be plotted."""
+        q = data.q
+        i = data.i
+        err = data.err
+
+        if self.plot_type == 'loglin' or self.plot_type == 'loglog':
+            x = q
+            y = i
+            err = err
+
+        elif self.plot_type == 'dimkratky':
+            if data.rg is not None and data.i0 is not None:
+                x = q*data.rg
+                y = (q*data.rg)**2*i/data.i0
+                err = (q*data.rg)**2*err/data.i0
+
+            else:
+                x = None
+                y = None
+                err = None
+
+        elif self.plot_type == 'guinier':
+            x = q**2
+            y = i
+            err = err
+
+        return x, y, err
+
+    def plot_profile(self, data):
+        q = data.q
+
+        x, y, err = self._get_profile_xy(data)
+
+        if self.plot_type == 'guinier':
+
+            if data.guinier_qmin is not None and data.guinier_qmax is not None:
+                q_idx_min = SASCalc.find_closest_index(q, data.guinier_qmin)
+                q_idx_max = SASCalc.find_closest_index(q, data.guinier_qmax)
+
+                if data.rg is None or data.i0 is None:
+                    self._do_guinier_fit(data, q_idx_min, q_idx_max)
+
+            else:
+                q_idx_min = None
+                q_idx_max = None
+
+            if data.rg is not None and data.i0 is not None and q_idx_min is not None:
+                fit, residual = self._calc_guinier_fit(data, q_idx_min, q_idx_max)
+
+                data.q_idx_min = q_idx_min
+                data.q_idx_max = q_idx_max
+
+            else:
+                fit = None
+                residual = None
+
+
+        if x is not None:
+            if self.plot_type != 'guinier':
+                if self.overlay is not None:
+                    self.overlay.add_profile(data.id, x, y, err, label=data.short_filename)
+                    lod_setter = self.overlay.setter(data.id)
+                    lines1 = None
+                else:
+                    lines1 = self.subplot1.errorbar(x, y, err, label=data.short_filename)
+                    lod_setter = PlotRender.errorbar_setter(lines1, x, y, err)
+
+                lines2 = None
+                fitlines = None
+
+                self.lod.add_line(data.id, self.subplot1, x, y, lod_setter)
+            elif self.plot_type == 'guinier' and fit is not None:
+                lines1 = self.subplot1.errorbar(x[q_idx_min:q_idx_max+1], y[q_idx_min:q_idx_max+1], 
+                    err[q_idx_min:q_idx_max+1], zorder=1)
+                fitlines = self.subplot1.plot(x[q_idx_min:q_idx_max+1], fit, color='k', zorder=2)
+                lines2 = self.subplot2.plot(x[q_idx_min:q_idx_max+1], residual, 'o', zorder=2)
+                zero_line = self.subplot2.axhline(color='k', zorder=1)
+                
+            else:
+                lines1 = None
+                lines2 = None
+                fitlines = None
+                zero_line = None
+        else:
+            lines1 = None
+            lines2 = None
+            fitlines = None
+            zero_line = None
+
+        if x is not None and self.plot_type != 'guinier':
+            points = (x, y)
+        else:
+            points = None
+
+        self.plotted_data[data.id] = {'data': data, 'lines': (lines1, lines2, fitlines),
+            'points': points, 'zero_line': None, 'bounds': {}}
+
+        if self.plot_type == 'guinier':
+            self.plotted_data[data.id]['zero_line'] = zero_line
+
+            if lines1 is not None:
+                self._update_guinier_bounds(data.id)
+
+        elif x is not None:
+            self.plotted_data[data.id]['bounds'][self.subplot1] = _get_bounds(self.subplot1, x, y)
+
+        data.pin()
+
+        self.line_settings[data.id] = copy.copy(self.default_line_settings)
+        self.line_settings[data.id]['default_marker_cycler'] = self.default_line_settings['default_marker_cycler']
+
+        self.update_line_settings(data)
+
+    def get_legend_handles_labels(self):
+        """
+        Returns (handles, labels) for a legend of the main axes, including
+        the profiles drawn by the overlay, e.g. for
+        ``plot.subplot1.legend(*plot.get_legend_handles_labels())``.
+        """
+        handles, labels = self.subplot1.get_legend_handles_labels()
+
+        if self.overlay is not None:
+            overlay_handles, overlay_labels = self.overlay.get_legend_handles_labels()
+            handles = handles + overlay_handles
+            labels = labels + overlay_labels
+
+        return handles, labels
+
+    def save_figure(self, filename, **kwargs):
+        """Saves the figure, drawing every point of every profile."""
+        if len(self._dirty_settings) > 0:
+            self.apply_plot_settings()
+
+        with self.lod.full_resolution():
+            self.fig.savefig(filename, **kwargs)
+
+    def plot_ift(self, data):
+        pass
+
+    def plot_series(self, data):
+        pass
+
+    def _get_guinier_fitter(self, data):
+        if data.id not in self.guinier_fitters:
+            self.guinier_fitters[data.id] = SASCalc.GuinierFitter(data.q, data.i, data.err)
+
+        return self.guinier_fitters[data.id]
+
+    def _do_guinier_fit(self, data, q_idx_min, q_idx_max):
+        fitter = self._get_guinier_fitter(data)
+        results = fitter.fit(q_idx_min, q_idx_max)
+
+        if not np.isnan(results['rg']):
+            data.rg = results['rg']
+            data.rg_err = results['rg_err']
+            data.i0 = results['i0']
+            data.i0_err = results['i0_err']
+            data.guinier_qmin = float(data.q[q_idx_min])
+            data.guinier_qmax = float(data.q[q_idx_max])
+
+        return results
+
+    def _calc_guinier_fit(self, data, q_idx_min, q_idx_max):
+        """Calculates the fit and residual for just the points in the fit range."""
+        fitter = self._get_guinier_fitter(data)
+
+        fit, residual = fitter.calc_fit(q_idx_min, q_idx_max, data.rg, data.i0,
+            self.plot_settings['norm_residuals'])
+
+        data.guinier_fit = fit
+        data.guinier_residual = residual
+
+        return fit, residual
+
+    def update_guinier_range(self, data_id, qmin, qmax, redraw=True):
+        """
+        Refits the Guinier range of a plotted profile and updates the plotted
+        points, fit, and residuals. Only the points in the new range are
+        recalculated, so this is fast enough to call while dragging the range.
+        Returns the fit results.
+
+        :param bool redraw: Whether to request a redraw. Dragging the range
+            blits the changed artists instead.
+        """
+        plotted = self.plotted_data[data_id]
+        data = plotted['data']
+
+        q_idx_min = SASCalc.find_closest_index(data.q, qmin)
+        q_idx_max = SASCalc.find_closest_index(data.q, qmax)
+
+        if q_idx_max < q_idx_min:
+            q_idx_min, q_idx_max = q_idx_max, q_idx_min
+
+        results = self._do_guinier_fit(data, q_idx_min, q_idx_max)
+
+        lines1, lines2, fitlines = plotted['lines']
+
+        if np.isnan(results['rg']) or lines1 is None:
+            return results
+
+        data.q_idx_min = q_idx_min
+        data.q_idx_max = q_idx_max
+
+        fit, residual = self._calc_guinier_fit(data, q_idx_min, q_idx_max)
+
+        window = slice(q_idx_min, q_idx_max+1)
+        x = data.q[window]**2
+        y = data.i[window]
+        err = data.err[window]
+
+        line, caps, bars = lines1
+        line.set_data(x, y)
+
+        if self.line_settings[data_id]['show_error_bars']:
+            PlotRender.set_errorbar_data(caps, bars, x, y, err)
+
+        fitlines[0].set_data(x, fit)
+        lines2[0].set_data(x, residual)
+
+        self._update_guinier_bounds(data_id)
+
+        if redraw:
+            self.request_redraw()
+
+        return results
+
+    def _update_guinier_bounds(self, data_id):
+        plotted = self.plotted_data[data_id]
+        lines1, lines2, fitlines = plotted['lines']
+
+        x, y = lines1[0].get_data()
+        plotted['bounds'][self.subplot1] = _get_bounds(self.subplot1, x, y)
+
+        # The zero line of the residuals is always in the limits
+        x, y = lines2[0].get_data()
+        plotted['bounds'][self.subplot2] = _get_bounds(self.subplot2, np.append(x, x[:1]),
+            np.append(y, 0))
+
+    def update_data_list(self, data_list):
+        """
+        Updates plotted profiles after their Rg or I0 changed, e.g. from a
+        new Guinier range. Guinier plots set those values themselves, so only
+        the other plots change.
+        """
+        if self.plot_type == 'guinier' or not self.is_profile_plot:
+            return
+
+        changed = False
+
+        with self.lod.hold():
+            for data in data_list:
+                if data.id not in self.plotted_data:
+                    continue
+
+                changed = True
+
+                plotted = self.plotted_data[data.id]
+                lines1 = plotted['lines'][0]
+
+                x, y, err = self._get_profile_xy(data)
+
+                if x is None or plotted['points'] is None:
+                    # Nothing plotted to update, or nothing to plot any more.
+                    # The style is copied over rather than reapplied from the
+                    # line settings, which would take the next marker, and
+                    # kept while the profile can't be plotted.
+                    line_settings = self.line_settings[data.id]
+                    style = self._get_profile_style(data.id)
+
+                    if style is None:
+                        style = plotted.get('style')
+
+                    self.remove_data_list([data.id])
+                    self.plot_profile(data)
+
+                    self.line_settings[data.id] = line_settings
+
+                    if style is not None:
+                        if self.plotted_data[data.id]['points'] is not None:
+                            self._set_profile_style(data.id, style)
+                        else:
+                            self.plotted_data[data.id]['style'] = style
+
+                    continue
+
+                if self.overlay is not None:
+                    self.overlay.set_data(data.id, x, y, err)
+                    lod_setter = self.overlay.setter(data.id)
+                else:
+                    lod_setter = PlotRender.errorbar_setter(lines1, x, y, err)
+
+                self.lod.add_line(data.id, self.subplot1, x, y, lod_setter)
+
+                plotted['points'] = (x, y)
+                plotted['bounds'][self.subplot1] = _get_bounds(self.subplot1, x, y)
+
+            if changed and self.plot_settings['auto_limits']:
+                self.do_auto_limits()
+
+        if changed:
+            self.request_redraw()
+
+    def _get_profile_style(self, data_id):
+        """Returns the style of a plotted profile, or None if it isn't drawn."""
+        if self.overlay is not None and self.overlay.has_profile(data_id):
+            return self.overlay.get_style(data_id)
+
+        lines1 = self.plotted_data[data_id]['lines'][0]
+
+        if lines1 is None:
+            return None
+
+        line, ec, el = lines1
+
+        style = {
+            'color'             : line.get_color(),
+            'linestyle'         : line.get_linestyle(),
+            'marker'            : line.get_marker(),
+            'show_error_bars'   : any(each.get_visible() for each in ec + el),
+            'visible'           : line.get_visible(),
+            }
+
+        return style
+
+    def _set_profile_style(self, data_id, style):
+        if self.overlay is not None and self.overlay.has_profile(data_id):
+            self.overlay.set_style(data_id, **style)
+            return
+
+        lines1 = self.plotted_data[data_id]['lines'][0]
+
+        if lines1 is None:
+            return
+
+        line, ec, el = lines1
+
+        line.set_color(style['color'])
+        line.set_linestyle(style['linestyle'])
+        line.set_marker(style['marker'])
+        line.set_visible(style['visible'])
+
+        for each in ec + el:
+            each.set_color(style['color'])
+            each.set_visible(style['visible'] and style['show_error_bars'])
+
+    def remove_data_list(self, data_ids):
+        """
+        Removes plotted data, and everything the plot keeps for it. The limits
+        are updated from the cached bounds of the remaining data, so the
+        remaining artists don't have to be read again.
+        """
+        removed = False
+
+        for data_id in data_ids:
+            plotted = self.plotted_data.pop(data_id, None)
+
+            if plotted is None:
+                continue
+
+            removed = True
+
+            lines1, lines2, fitlines = plotted['lines']
+
+            if lines1 is not None:
+                lines1.remove()
+
+            for artist in (lines2 or []) + (fitlines or []) + [plotted['zero_line']]:
+                if artist is not None:
+                    artist.remove()
+
+            if self.overlay is not None:
+                self.overlay.remove_profile(data_id)
+
+            self.lod.remove_line(data_id)
+
+            self.line_settings.pop(data_id, None)
+            self.guinier_fitters.pop(data_id, None)
+
+            data = plotted['data']
+
+            if self.plot_type == 'guinier':
+                data.guinier_fit = None
+                data.guinier_residual = None
+
+            data.unpin()
+
+        if removed:
+            if self.plot_settings['auto_limits']:
+                self.do_auto_limits()
+
+            self.request_redraw()
+
+    def do_auto_limits(self):
+        """
+        Autoscales to the cached bounds of each plotted profile, which is much
+        faster than relim over every plotted point.
+        """
+        if self.plot_type != 'guinier':
+            plots = [self.subplot1]
+        elif self.plot_type == 'guinier':
+            plots = [self.subplot1, self.subplot2]
+
+        for plot in plots:
+            plot.set_autoscale_on(True)
+
+            bounds = [plotted['bounds'][plot] for plotted in self.plotted_data.values()
+                if plotted['bounds'].get(plot) is not None]
+
+            if len(bounds) > 0:
+                bounds = np.array(bounds)
+                corners = np.array([[bounds[:, 0].min(), bounds[:, 2].min()],
+                    [bounds[:, 1].max(), bounds[:, 3].max()]])
+
+                plot.dataLim.update_from_data_xy(corners, ignore=True)
+                plot.ignore_existing_data_limits = False
+
+                plot.autoscale_view()
+
+        self.request_redraw()
+
+    def change_plot_settings(self, settings):
+
+        for key, value in settings.items():
+            if self.plot_settings.get(key) != value:
+                self.plot_settings[key] = value
+                self._dirty_settings.add(key)
+
+        if self.active and len(self._dirty_settings) > 0:
+            self.apply_plot_settings()
+
+    def update_line_settings(self, data):
+
+        line_settings = self.line_settings[data.id]
+
+        if self.overlay is not None and self.overlay.has_profile(data.id):
+            if line_settings['default_marker_style'] != 'Auto':
+                marker = line_settings['default_marker_style']
+            else:
+                marker = next(line_settings['default_marker_cycler'])
+
+            self.overlay.set_style(data.id, linestyle=line_settings['default_line_style'],
+                marker=marker, show_error_bars=line_settings['show_error_bars'])
+
+        lines1 = self.plotted_data[data.id]['lines'][0]
+
+        if lines1 is not None:
+            line, ec, el = lines1
+
+            for each in ec:
+                each.set_visible(line_settings['show_error_bars'])
+            for each in el:
+                each.set_visible(line_settings['show_error_bars'])
+
+            line.set_linestyle(line_settings['default_line_style'])
+
+            if line_settings['default_marker_style'] != 'Auto':
+                line.set_marker(line_settings['default_marker_style'])
+            else:
+                line.set_marker(next(line_settings['default_marker_cycler']))
+
+        self.request_redraw()
+
+    def update_plot_settings(self):
+        """Applies all of the plot settings."""
+        self._dirty_settings.update(self.plot_settings)
+        self.apply_plot_settings()
+
+    def apply_plot_settings(self):
+        """
+        Applies the plot settings that changed since they were last applied.
+        Each applier runs at most once, however many of its settings changed,
+        and the plot is drawn once on the next idle event.
+        """
+        to_apply = []
+
+        for key in self._dirty_settings:
+            for applier in self.settings_appliers.get(key, ()):
+                if applier not in to_apply:
+                    to_apply.append(applier)
+
+        self._dirty_settings.clear()
+
+        for func, args in to_apply:
+            func(*args)
+
+        if len(to_apply) > 0:
+            self.request_redraw()
+
+    def _make_settings_appliers(self):
+        """Maps each plot setting to the (function, args) appliers that use it."""
+        appliers = collections.defaultdict(list)
+
+        sides = ('left', 'right', 'top', 'bottom')
+
+        for ax, suffix in ((self.subplot1, ''), (self.subplot2, '2')):
+            if ax is None:
+                continue
+
+            spine_applier = (self._set_spines, (ax, suffix))
+
+            for side in sides:
+                appliers['axis_{}_on{}'.format(side, suffix)].append(spine_applier)
+
+            for axis in ('x', 'y'):
+                tick_applier = (self._set_tick_visibility, (ax, axis, suffix))
+
+                for key in ('major_ticks_', 'minor_ticks_', 'tick_position_'):
+                    appliers[key+axis+suffix].append(tick_applier)
+
+                for side in sides:
+                    appliers['axis_{}_on{}'.format(side, suffix)].append(tick_applier)
+                    appliers['label_{}{}'.format(side, suffix)].append(tick_applier)
+
+                appliers['tick_{}{}_size'.format(axis, suffix)].append((self._set_tick_size,
+                    (ax, axis, suffix)))
+                appliers['tick_{}{}_font'.format(axis, suffix)].append((self._set_tick_font,
+                    (ax, axis, suffix)))
+
+        return appliers
+
+    def set_ticks_settings(self):
+        for ax, suffix in ((self.subplot1, ''), (self.subplot2, '2')):
+            if ax is not None:
+                for axis in ('x', 'y'):
+                    self._set_tick_visibility(ax, axis, suffix)
+                    self._set_tick_size(ax, axis, suffix)
+                    self._set_tick_font(ax, axis, suffix)
+
+    def set_axes_settings(self):
+        for ax, suffix in ((self.subplot1, ''), (self.subplot2, '2')):
+            if ax is not None:
+                self._set_spines(ax, suffix)
+
+    def _set_tick_visibility(self, ax, axis, suffix):
+        sides = {}
+        labels = {}
+
+        for side in ('bottom', 'top', 'left', 'right'):
+            axis_on = self.plot_settings['axis_{}_on{}'.format(side, suffix)]
+
+            sides[side] = axis_on
+            labels['label'+side] = axis_on and self.plot_settings['label_{}{}'.format(side, suffix)]
+
+        major = self.plot_settings['major_ticks_'+axis+suffix]
+        minor = self.plot_settings['minor_ticks_'+axis+suffix]
+        direction = self.plot_settings['tick_position_'+axis+suffix]
+
+        ticks_off = {'left': False, 'right': False, 'top': False, 'bottom': False,
+            'labelleft': False, 'labelright': False, 'labeltop': False, 'labelbottom': False}
+
+        if major and minor:
+            ax.tick_params(which='both', direction=direction, axis=axis, **sides, **labels)
+
+        elif major:
+            ax.tick_params(which='major', direction=direction, axis=axis, **sides, **labels)
+            ax.tick_params(which='minor', axis=axis, **ticks_off)
+
+        elif minor:
+            ax.tick_params(which='minor', direction=direction, axis=axis, **sides, **labels)
+            ax.tick_params(which='major', axis=axis, **ticks_off)
+
+        else:
+            ax.tick_params(which='both', axis=axis, **ticks_off)
+
+    def _set_tick_size(self, ax, axis, suffix):
+        ax.tick_params(which='both', axis=axis,
+            labelsize=self.plot_settings['tick_{}{}_size'.format(axis, suffix)])
+
+    def _set_tick_font(self, ax, axis, suffix):
+        font = self.plot_settings['tick_{}{}_font'.format(axis, suffix)]
+
+        if axis == 'x':
+            tick_labels = ax.get_xticklabels(which='both')
+        else:
+            tick_labels = ax.get_yticklabels(which='both')
+
+        for tick in tick_labels:
+            tick.set_fontname(font)
+
+    def _set_spines(self, ax, suffix):
+        for side in ('left', 'right', 'top', 'bottom'):
+            if self.plot_settings['axis_{}_on{}'.format(side, suffix)]:
+                ax.spines[side].set_color('black')
+            else:
+                ax.spines[side].set_color('none')
+
+
+def _get_bounds(ax, x, y):
+    """
+    Returns (xmin, xmax, ymin, ymax) of the finite points, leaving out
+    non-positive values on log axes, or None if there are no such points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    valid = np.isfinite(x) & np.isfinite(y)
+
+    if ax.get_xscale() == 'log':
+        valid = valid & (x > 0)
+    if ax.get_yscale() == 'log':
+        valid = valid & (y > 0)
+
+    if not np.any(valid):
+        return None
+
+    x = x[valid]
+    y = y[valid]
+
+    return (x.min(), x.max(), y.min(), y.max())
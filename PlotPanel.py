@@ -28,8 +28,7 @@ including averaging, subtracting, and merging.
 if __name__ == "__main__" and __package__ is None:
     __package__ = "SASPub"
 
-from itertools import cycle
-import copy
+import collections
 
 import numpy as np
 import wx
@@ -41,12 +40,17 @@ from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
 from matplotlib.backends.backend_wxagg import NavigationToolbar2WxAgg
 from matplotlib.figure import Figure
 import matplotlib.colors as mplcol
+import matplotlib.lines as mlines
+import matplotlib.text as mtext
+import matplotlib.transforms as mtransforms
 
 mpl.rcParams['backend'] = 'WxAgg'
 # mpl.rcParams['font.family'] = ['fantasy']
 # mpl.rcParams['font.fantasy'] = ['xkcd']
 
 import Data
+import FigureBuilder
+import PlotRender
 
 
 class PlotPanel(wx.Panel):
@@ -61,6 +65,8 @@ class PlotPanel(wx.Panel):
         self.Layout()
 
     def _initialize(self):
+        self.top_window = self.GetParent()
+
         self.plots = []
         self.profile_plotted = False
         self.ift_plotted = False
@@ -270,24 +276,31 @@ class PlotPanel(wx.Panel):
                 profile_plots.append(plot)
             elif plot.is_ift_plot:
                 ift_plots.append(plot)
-            elif plot_is_series_plot:
+            elif plot.is_series_plot:
                 series_plots.append(plot)
 
-        for item in data:
-            if isinstance(item, Data.ProfileData):
-                for plot in profile_plots:
-                    plot.plot_data(item)
+        profiles = [item for item in data if isinstance(item, Data.ProfileData)]
+        ifts = [item for item in data if isinstance(item, Data.IFTData)]
+        series = [item for item in data if isinstance(item, Data.SeriesData)]
 
-            elif isinstance(item, Data.IFTData):
-                for plot in ift_plots:
-                    plot.plot_data(item)
+        # Each tab plots its whole batch with one autoscale and one draw. Tabs
+        # that aren't showing just queue the data until they are selected.
+        for plot_list, data_list in ((profile_plots, profiles), (ift_plots, ifts),
+            (series_plots, series)):
+            if len(data_list) > 0:
+                for plot in plot_list:
+                    plot.plot_data_list(data_list)
 
-            elif isinstance(item, Data.SeriesData):
-                for plot in series_plots:
-                    plot.plot_data(item)
+        self._update_active_plot()
 
-    def _on_remove(self, data):
-        pass
+    def remove_data(self, data_ids):
+        self._on_remove(data_ids)
+        self.Refresh()
+
+    def _on_remove(self, data_ids):
+        for i in range(self.plot_notebook.GetPageCount()):
+            plot = self.plot_notebook.GetPage(i)
+            plot.remove_data_list(data_ids)
 
     def _add_plot(self, plot_type):
 
@@ -350,17 +363,136 @@ class PlotPanel(wx.Panel):
                     else:
                         item_vals[2](str(value))
 
+    def select_data(self, data_id):
+        """Selects the data in the data panel, e.g. when it is clicked on in a plot."""
+        self.top_window.data_panel.select_item(data_id)
+
+    def update_data(self, data_list):
+        """
+        Updates the plots and the data panel after the metadata of data
+        changed, e.g. a new Guinier range.
+        """
+        for i in range(self.plot_notebook.GetPageCount()):
+            plot = self.plot_notebook.GetPage(i)
+            plot.update_data_list(data_list)
+
+        self.top_window.data_panel.update_items(data_list)
+
     def _on_plot_change(self, evt):
+        self._update_active_plot()
         self._update_settings_from_plot()
 
+    def _update_active_plot(self):
+        """
+        Marks the current page as the only active plot tab, which builds
+        and draws anything that was queued while it was hidden.
+        """
+        current_plot_tab = self.plot_notebook.GetCurrentPage()
+
+        for i in range(self.plot_notebook.GetPageCount()):
+            plot = self.plot_notebook.GetPage(i)
+
+            if plot is not current_plot_tab:
+                plot.set_active(False)
+
+        if current_plot_tab is not None:
+            current_plot_tab.set_active(True)
+
+
+class CachedFigureCanvas(FigureCanvasWxAgg):
+    """
+    Canvas that keeps the bitmaps of its last few renders, keyed on the
+    canvas size, DPI, axes limits and a version counter. Drawing a figure
+    that matches a cached render, such as when switching back to a tab or
+    resizing a pane back to an earlier size, just repaints the cached
+    bitmap. Anything that changes what is plotted must call
+    :meth:`invalidate_cache`.
+
+    Functions in post_draw_callbacks are called after every draw, cached or
+    not, to draw overlays like a cursor on top. The Agg buffer is restored
+    to match a cached render first, so they can blit onto it. Overlays
+    blitted on top are never cached, because blit copies a cached bitmap
+    before drawing on it.
+    """
+
+    #: Number of renders kept per canvas.
+    cache_size = 4
 
-class PlotTab(wx.Panel):
+    def __init__(self, *args, **kwargs):
+        FigureCanvasWxAgg.__init__(self, *args, **kwargs)
+
+        self.render_version = 0
+        self._render_cache = collections.OrderedDict()
+
+        self.post_draw_callbacks = []
+
+    def invalidate_cache(self):
+        self.render_version = self.render_version + 1
+        self._render_cache.clear()
+
+    def draw(self, drawDC=None):
+        key = self._get_cache_key()
+
+        cached = self._render_cache.get(key)
+
+        if cached is not None:
+            self._render_cache.move_to_end(key)
+
+            bitmap, region = cached
+
+            self.restore_region(region)
+
+            self.bitmap = bitmap
+            self._isDrawn = True
+            self.gui_repaint(drawDC=drawDC)
+
+        else:
+            FigureCanvasWxAgg.draw(self, drawDC=drawDC)
+
+            self._render_cache[key] = (self.bitmap, self.copy_from_bbox(self.figure.bbox))
+
+            while len(self._render_cache) > self.cache_size:
+                self._render_cache.popitem(last=False)
+
+        for callback in self.post_draw_callbacks:
+            callback()
+
+    def draw_uncached(self, drawDC=None):
+        """Renders the figure, even if there is a matching cached render."""
+        self._render_cache.pop(self._get_cache_key(), None)
+        self.draw(drawDC=drawDC)
+
+    def blit(self, bbox=None):
+        # A partial blit draws into the current bitmap, which mustn't change
+        # the cached copy.
+        if bbox is not None and any(self.bitmap is bitmap for bitmap, region
+            in self._render_cache.values()):
+            self.bitmap = self.bitmap.GetSubBitmap(wx.Rect(0, 0, self.bitmap.GetWidth(),
+                self.bitmap.GetHeight()))
+
+        FigureCanvasWxAgg.blit(self, bbox)
+
+    def _get_cache_key(self):
+        width, height = self.figure.bbox.size
+
+        limits = tuple(tuple(ax.get_xlim()) + tuple(ax.get_ylim()) for ax in self.figure.axes)
+
+        return (int(width), int(height), self.figure.dpi, self.render_version, limits)
+
+
+class PlotTab(wx.Panel, FigureBuilder.ProfilePlot):
+    """
+    A plot notebook tab. The plot itself is built by
+    :class:`FigureBuilder.ProfilePlot`, this adds the wx canvas, deferred
+    drawing, and the mouse interaction.
+    """
 
     def __init__(self, parent, plot_type, *args, **kwargs):
 
         wx.Panel.__init__(self, parent, *args, **kwargs)
 
         self.plot_type = plot_type
+        self.plot_panel = parent.GetParent()
 
         self._create_layout()
         self._initialize()
@@ -368,516 +500,463 @@ class PlotTab(wx.Panel):
 
     def _create_layout(self):
         self.fig = Figure((5,4), 75)
-        self.canvas = FigureCanvasWxAgg(self, -1, self.fig)
+        self.canvas = CachedFigureCanvas(self, -1, self.fig)
 
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self.canvas, proportion=1, flag=wx.ALL|wx.EXPAND, border=5)
 
         self.SetSizer(sizer)
 
-        self.cid = self.canvas.mpl_connect('draw_event', self.ax_redraw)
+        self.Bind(wx.EVT_IDLE, self._on_idle)
 
     def _initialize(self):
 
-        self.subplot1 = None
-        self.subplot2 = None
-
-        if self.plot_type == 'loglin' or self.plot_type == 'loglog':
-            self.subplot1 = self.fig.add_subplot(1, 1, 1)
-            self.subplot1.set_xlabel('$q$ ($\AA^{-1}$)')
-            self.subplot1.set_ylabel('$I(q)$')
-
-            self.subplot1.set_yscale('log')
-
-            if self.plot_type == 'loglog':
-                self.subplot1.set_xscale('log')
+        self._redraw_pending = False
 
-        elif self.plot_type == 'dimkratky':
-            self.subplot1 = self.fig.add_subplot(1, 1, 1)
-            self.subplot1.set_xlabel('$qR_g$')
-            self.subplot1.set_ylabel('$(qR_g)^2I(q)/I(0)$')
+        self._initialize_plot()
 
-        elif self.plot_type == 'guinier':
-            self.subplot1 = self.fig.add_subplot(2, 1, 1)
-            self.subplot1.set_ylabel('$I(q)$')
-            self.subplot1.set_yscale('log')
+        # Hidden tabs queue their data and settings changes, and only build
+        # artists and draw once they are shown or exported.
+        self.active = False
+        self._pending_data = []
 
-            self.subplot2 = self.fig.add_subplot(212, sharex=self.subplot1)
-            self.subplot2.set_xlabel('$q^2$ ($\AA^{-2}$)')
-            self.subplot2.set_ylabel('$\Delta \ln (I(q))/\sigma (q)$')
+        self.plot_settings['show_cursor_readout'] = True
 
-        elif self.plot_type == 'ift':
-            pass
-
-        elif self.plot_type == 'series':
-            pass
+        self.readout_labels = {
+            'loglin'    : (('q', 'I'),),
+            'loglog'    : (('q', 'I'),),
+            'dimkratky' : (('qRg', '(qRg)^2 I/I(0)'),),
+            'guinier'   : (('q^2', 'I'), ('q^2', 'Residual')),
+            }
 
-        if (self.plot_type == 'loglin' or self.plot_type == 'loglog' or self.plot_type == 'dimkratky'
-            or self.plot_type == 'guinier'):
-            self.is_profile_plot = True
+        # Cursor readout and Guinier range selectors are redrawn on top of a
+        # cached background, so mouse motion doesn't draw the whole figure.
+        self.blit = PlotRender.BlitManager(self.canvas, self.canvas.draw_uncached)
+        self.canvas.post_draw_callbacks.append(self.blit.draw_overlay)
+
+        self.cursors = {}
+        self._create_cursors()
+
+        self.guinier_range_target = None
+        self.guinier_selectors = []
+        self.selector_pick_radius = 5
+        self._drag_selector = None
+        self._drag_artists = []
+
+        # Hover and click find the nearest plotted point from an index of the
+        # drawn points in display coordinates, rebuilt after zooms, resizes
+        # and data changes.
+        self.point_index = PlotRender.PointIndex()
+        self._point_index_stale = True
+        self.pick_radius = 6
+        self.hover_id = None
+
+        self.highlight_line = mlines.Line2D([], [], linewidth=2.5, marker='o',
+            markersize=3, color='k', alpha=0.6)
+        self.highlight_point = mlines.Line2D([], [], linestyle='None', marker='o',
+            markersize=9, markerfacecolor='none', markeredgecolor='r', markeredgewidth=1.5)
+
+        for artist in (self.highlight_line, self.highlight_point):
+            self._init_overlay_artist(artist, self.subplot1)
+            artist.set_visible(False)
+
+        for ax in (self.subplot1, self.subplot2):
+            if ax is not None:
+                ax.callbacks.connect('xlim_changed', self._invalidate_point_index)
+                ax.callbacks.connect('ylim_changed', self._invalidate_point_index)
+
+        self.canvas.mpl_connect('resize_event', self._invalidate_point_index)
+
+        self.canvas.mpl_connect('motion_notify_event', self._on_motion)
+        self.canvas.mpl_connect('button_press_event', self._on_press)
+        self.canvas.mpl_connect('button_release_event', self._on_release)
+        self.canvas.mpl_connect('axes_leave_event', self._on_axes_leave)
+
+    def set_active(self, active):
+        """
+        Sets whether the tab is the one being shown. Activating the tab
+        applies any queued data and settings changes.
+        """
+        self.active = active
+
+        if active:
+            self.flush_pending()
+
+    def flush_pending(self):
+        """Applies queued settings changes and plots queued data."""
+        if len(self._dirty_settings) > 0:
+            self.apply_plot_settings()
+
+        if len(self._pending_data) > 0:
+            data_list = self._pending_data
+            self._pending_data = []
+
+            self._plot_data_list(data_list)
+
+            # Plotted data is pinned by the plot
+            for data in data_list:
+                data.unpin()
+
+    def request_redraw(self):
+        """
+        Marks the plot as needing to be drawn. However many changes are made,
+        the canvas is only drawn once, on the next idle event.
+        """
+        self.canvas.invalidate_cache()
+        self._point_index_stale = True
+        self._redraw_pending = True
+
+        # Changes made from a timer or CallAfter while the app is idle
+        # wouldn't get another idle event until the next input event
+        wx.WakeUpIdle()
+
+    def _on_idle(self, evt):
+        if self._redraw_pending and self.active:
+            self._redraw_pending = False
+            self.canvas.draw()
+
+        evt.Skip()
+
+    def plot_data_list(self, data_list):
+        """
+        Plots a batch of data, autoscaling and redrawing once at the end. If
+        the tab isn't showing, the data is queued until it is.
+        """
+        if self.active:
+            self._plot_data_list(data_list)
         else:
-            self.is_profile_plot = False
+            # Keeps the arrays from being evicted before the tab is shown
+            for data in data_list:
+                data.pin()
 
-        if self.plot_type == 'ift':
-            self.is_ift_plot = True
-        else:
-            self.is_ift_plot = False
+            self._pending_data.extend(data_list)
 
-        if self.plot_type == 'series':
-            self.is_series_plot = True
-        else:
-            self.is_series_plot = False
-
-
-        self.plot_settings = {
-            'norm_residuals'    : True,
-            'auto_limits'       : True,
-
-            'tick_position_x'   : 'in',
-            'major_ticks_x'     : True,
-            'minor_ticks_x'     : False,
-            'tick_position_y'   : 'in',
-            'major_ticks_y'     : True,
-            'minor_ticks_y'     : True,
-            'tick_position_x2'  : 'in',
-            'major_ticks_x2'    : True,
-            'minor_ticks_x2'    : False,
-            'tick_position_y2'  : 'in',
-            'major_ticks_y2'    : True,
-            'minor_ticks_y2'    : True,
-            'label_top'         : False,
-            'label_bottom'      : True,
-            'label_right'       : False,
-            'label_left'        : True,
-            'label_top2'        : False,
-            'label_bottom2'     : True,
-            'label_right2'      : False,
-            'label_left2'       : True,
-            'tick_x_font'       : 'Humor Sans',
-            'tick_y_font'       : 'Humor Sans',
-            'tick_x_size'       : 20,
-            'tick_y_size'       : 20,
-            'tick_x2_font'      : 'Humor Sans',
-            'tick_y2_font'      : 'Humor Sans',
-            'tick_x2_size'      : 20,
-            'tick_y2_size'      : 20,
-
-            'axis_left_on'      : True,
-            'axis_right_on'     : True,
-            'axis_top_on'       : True,
-            'axis_bottom_on'    : True,
-            'axis_left_on2'     : True,
-            'axis_right_on2'    : True,
-            'axis_top_on2'      : True,
-            'axis_bottom_on2'   : True,
-            }
+    def _plot_data_list(self, data_list):
+        FigureBuilder.ProfilePlot.plot_data_list(self, data_list)
 
-        self.default_line_settings = {
-            'show_error_bars'       : False,
-            'default_line_style'    : 'None',
-            'default_marker_style'  : 'Auto',
-            'default_marker_cycler' : cycle(['o', 'v', 's', '^',  'D', '<', 'X', '>', 'p', '*', 'h']),
-            }
-
-        self.plotted_data = {}
-        self.line_settings = {}
+        if self.plot_type == 'guinier' and self.guinier_range_target not in self.plotted_data:
+            self._reset_guinier_range_target()
 
-        self.update_plot_settings()
+        self.request_redraw()
 
-    def ax_redraw(self, widget=None):
-        self.canvas.mpl_disconnect(self.cid)
-        self.canvas.draw()
-        self.cid = self.canvas.mpl_connect('draw_event', self.ax_redraw)
+    def remove_data_list(self, data_ids):
+        """Removes plotted and queued data."""
+        data_ids = set(data_ids)
 
-    def plot_data(self, data):
-        if self.is_profile_plot:
-            self.plot_profile(data)
-        elif self.is_ift_plot:
-            self.plot_ift(data)
-        elif self.is_series_plot:
-            self.plot_series(data)
+        pending_data = []
 
-    def plot_profile(self, data):
-        q = data.q
-        i = data.i
-        err = data.err
+        for data in self._pending_data:
+            if data.id in data_ids:
+                data.unpin()
+            else:
+                pending_data.append(data)
 
-        if self.plot_type == 'loglin' or self.plot_type == 'loglog':
-            x = q
-            y = i
-            err = err
+        self._pending_data = pending_data
 
-        elif self.plot_type == 'dimkratky':
-            if data.rg is not None and data.i0 is not None:
-                x = q*data.rg
-                y = (q*data.rg)**2*i/data.i0
-                err = (q*data.rg)**2*err/data.i0
+        if self._drag_selector is not None and self.guinier_range_target in data_ids:
+            self._drag_selector = None
 
-            else:
-                x = None
-                y = None
-                err = None
+            for artist in self._drag_artists:
+                self.blit.remove_artist(artist)
 
-        elif self.plot_type == 'guinier':
-            x = q**2
-            y = i
-            err = err
+            self._drag_artists = []
 
-            if data.rg is not None and data.i0 is not None and data.guinier_qmin is not None and data.guinier_qmax is not None:
-                fit, residual = self._calc_guinier_fit(data)
+        if self.hover_id in data_ids:
+            self.hover_id = None
 
-                find_closest = lambda a,l:min(l,key=lambda x:abs(x-a))
-                closest_qmin = find_closest(data.guinier_qmin, q)
-                closest_qmax = find_closest(data.guinier_qmax, q)
+            for artist in (self.highlight_line, self.highlight_point):
+                artist.set_visible(False)
 
-                q_idx_min = np.where(q == closest_qmin)[0][0]
-                q_idx_max = np.where(q == closest_qmax)[0][0]
+        FigureBuilder.ProfilePlot.remove_data_list(self, data_ids)
 
-                data.q_idx_min = q_idx_min
-                data.q_idx_max = q_idx_max
+        if self.plot_type == 'guinier' and self.guinier_range_target in data_ids:
+            self._reset_guinier_range_target()
 
-            else:
-                fit = None
-                residual = None
-
-
-        if x is not None:
-            if self.plot_type != 'guinier':
-                lines1 = self.subplot1.errorbar(x, y, err)
-                lines2 = None
-                fitlines = None
-            elif self.plot_type == 'guinier' and fit is not None:
-                lines1 = self.subplot1.errorbar(x[q_idx_min:q_idx_max+1], y[q_idx_min:q_idx_max+1], 
-                    err[q_idx_min:q_idx_max+1], zorder=1)
-                fitlines = self.subplot1.plot(x[q_idx_min:q_idx_max+1], fit[q_idx_min:q_idx_max+1], color='k', zorder=2)
-                lines2 = self.subplot2.plot(x[q_idx_min:q_idx_max+1], residual[q_idx_min:q_idx_max+1], 'o', zorder=2)
-                zero_line = self.subplot2.axhline(color='k', zorder=1)
-                
-            else:
-                lines1 = None
-                lines2 = None
-                fitlines = None
+    def _reset_guinier_range_target(self):
+        # Moves the range selectors to the first profile with a Guinier fit
+        for data_id, plotted in self.plotted_data.items():
+            if plotted['lines'][0] is not None:
+                self.set_guinier_range_target(data_id)
+                break
         else:
-            lines1 = None
-            lines2 = None
-            fitlines = None
+            self.guinier_range_target = None
+            self._update_guinier_selectors()
 
-        self.plotted_data[data.id] = {'data': data, 'lines': (lines1, lines2, fitlines)}
+    def save_figure(self, filename, **kwargs):
+        """Saves the figure, drawing every point of every profile."""
+        self.flush_pending()
 
-        self.line_settings[data.id] = copy.copy(self.default_line_settings)
-        self.line_settings[data.id]['default_marker_cycler'] = self.default_line_settings['default_marker_cycler']
+        FigureBuilder.ProfilePlot.save_figure(self, filename, **kwargs)
 
-        self.update_line_settings(data)
+    def set_guinier_range_target(self, data_id):
+        """Shows draggable selectors for the Guinier range of a plotted profile."""
+        self.guinier_range_target = data_id
 
-        if self.plot_settings['auto_limits']:
-            self.do_auto_limits()
+        if len(self.guinier_selectors) == 0:
+            for ax in (self.subplot1, self.subplot2):
+                if ax is None:
+                    continue
 
-    def plot_ift(self, data):
-        pass
+                trans = mtransforms.blended_transform_factory(ax.transData, ax.transAxes)
 
-    def plot_series(self, data):
-        pass
+                for end in (0, 1):
+                    selector = mlines.Line2D([0, 0], [0, 1], color='0.3',
+                        linestyle='--', linewidth=1.5, transform=trans)
+                    self._init_overlay_artist(selector, ax)
 
-    def _calc_guinier_fit(self, data):
-        fit = data.i0*np.exp(-data.rg**2*data.q**2/3)
+                    self.guinier_selectors.append((end, selector))
 
-        residual = data.i - fit
+        self._update_guinier_selectors()
+        self.blit.update()
 
-        if self.plot_settings['norm_residuals']:
-            residual = residual/data.err
+    def _update_guinier_selectors(self):
+        data = None
 
-        data.guinier_fit = fit
-        data.guinier_residual = residual
+        if self.guinier_range_target in self.plotted_data:
+            data = self.plotted_data[self.guinier_range_target]['data']
 
-        return fit, residual
+        for end, selector in self.guinier_selectors:
+            if data is not None and data.q_idx_min is not None:
+                if end == 0:
+                    x = data.q[data.q_idx_min]**2
+                else:
+                    x = data.q[data.q_idx_max]**2
 
-    def do_auto_limits(self):
+                selector.set_xdata([x, x])
+                selector.set_visible(True)
+            else:
+                selector.set_visible(False)
 
-        if self.plot_type != 'guinier':
-            plots = [self.subplot1]
-        elif self.plot_type == 'guinier':
-            plots = [self.subplot1, self.subplot2]
+    def _create_cursors(self):
+        for ax, labels in zip((self.subplot1, self.subplot2),
+            self.readout_labels.get(self.plot_type, ())):
+            if ax is None:
+                continue
 
-        for plot in plots:
-            plot.set_autoscale_on(True)
+            vline = mlines.Line2D([0, 0], [0, 1], color='0.5', linewidth=0.75,
+                transform=ax.transAxes)
+            hline = mlines.Line2D([0, 1], [0, 0], color='0.5', linewidth=0.75,
+                transform=ax.transAxes)
+            readout = mtext.Text(0.98, 0.97, '', ha='right', va='top', fontsize='small',
+                transform=ax.transAxes, bbox={'facecolor': 'white', 'alpha': 0.7,
+                'edgecolor': 'none'})
 
-            oldx = plot.get_xlim()
-            oldy = plot.get_ylim()
+            for artist in (vline, hline, readout):
+                self._init_overlay_artist(artist, ax)
+                artist.set_visible(False)
 
-            plot.relim()
-            plot.autoscale_view()
+            self.cursors[ax] = (vline, hline, readout, labels)
 
-            newx = plot.get_xlim()
-            newy = plot.get_ylim()
+    def _init_overlay_artist(self, artist, ax):
+        # Overlay artists aren't added to the axes, so they don't affect the
+        # autoscaling and aren't exported. Only the blit manager draws them.
+        artist.set_figure(self.fig)
+        artist.set_clip_box(ax.bbox)
+        artist.set_zorder(10)
 
-        self.canvas.draw()
+        self.blit.add_artist(artist)
 
-    def change_plot_settings(self, settings):
+    def pick(self, x, y):
+        """
+        Returns (data_id, index) for the plotted point nearest the display
+        coordinates x, y, where index is the point's index in the data's q
+        array, or None if no point is within the pick radius.
+        """
+        if self._point_index_stale:
+            self._build_point_index()
 
-        for key, value in settings.items():
-            self.plot_settings[key] = value
+        result = self.point_index.query(x, y, self.pick_radius)
 
-        self.update_plot_settings()
+        if result is None:
+            return None
 
-    def update_line_settings(self, data):
+        (data_id, ax), index, dist = result
 
-        line_settings = self.line_settings[data.id]
+        return data_id, index
 
-        lines1 = self.plotted_data[data.id]['lines'][0]
+    def _get_pick_points(self, data_id):
+        """Returns a list of (ax, x, y, indices) for the drawn points of a profile."""
+        plotted = self.plotted_data[data_id]
+        data = plotted['data']
+        lines1, lines2, fitlines = plotted['lines']
 
-        if lines1 is not None:
-            line, ec, el = lines1
+        pick_points = []
 
-            for each in ec:
-                each.set_visible(line_settings['show_error_bars'])
-            for each in el:
-                each.set_visible(line_settings['show_error_bars'])
+        if plotted['points'] is not None:
+            x, y = plotted['points']
 
-            line.set_linestyle(line_settings['default_line_style'])
+            # Only the points drawn after decimation can be picked
+            indices = self.lod.get_indices(data_id)
+            pick_points.append((self.subplot1, x[indices], y[indices], indices))
 
-            if line_settings['default_marker_style'] != 'Auto':
-                line.set_marker(line_settings['default_marker_style'])
-            else:
-                line.set_marker(next(line_settings['default_marker_cycler']))
+        elif lines1 is not None and data.q_idx_min is not None:
+            x, y = lines1[0].get_data()
+            indices = np.arange(len(x)) + data.q_idx_min
+            pick_points.append((self.subplot1, x, y, indices))
 
-    def update_plot_settings(self):
+            if lines2 is not None:
+                x, y = lines2[0].get_data()
+                pick_points.append((self.subplot2, x, y, indices[:len(x)]))
 
-        self.set_axes_settings()
-        self.set_ticks_settings()
+        return pick_points
 
-        self.canvas.draw()
+    def _build_point_index(self):
+        entries = []
 
-    def set_ticks_settings(self):
+        for data_id in self.plotted_data:
+            for ax, x, y, indices in self._get_pick_points(data_id):
+                xy = ax.transData.transform(np.column_stack((x, y)))
 
-        axes = {}
-        axes2 = {}
-        axeslabel = {}
-        axeslabel2 = {}
+                x0, y0, x1, y1 = ax.bbox.extents
+                inside = (xy[:, 0] >= x0) & (xy[:, 0] <= x1) & (xy[:, 1] >= y0) & (xy[:, 1] <= y1)
 
-        if self.plot_settings['axis_bottom_on']:
-            axes['bottom'] = True
-        else:
-            axes['bottom'] = False
+                entries.append(((data_id, ax), xy[inside], indices[inside]))
 
-        if self.plot_settings['axis_top_on']:
-            axes['top'] = True
-        else:
-            axes['top'] = False
+        self.point_index.build(entries)
+        self._point_index_stale = False
 
-        if self.plot_settings['axis_left_on']:
-            axes['left'] = True
-        else:
-            axes['left'] = False
+    def _invalidate_point_index(self, *args):
+        self._point_index_stale = True
 
-        if self.plot_settings['axis_right_on']:
-            axes['right'] = True
-        else:
-            axes['right'] = False
+    def _update_hover(self, event):
+        hit = None
 
-        if self.plot_settings['axis_bottom_on2']:
-            axes2['bottom'] = True
-        else:
-            axes2['bottom'] = False
+        if event is not None and event.inaxes is not None and self._drag_selector is None:
+            hit = self.pick(event.x, event.y)
 
-        if self.plot_settings['axis_top_on2']:
-            axes2['top'] = True
-        else:
-            axes2['top'] = False
+        if hit is None:
+            self.hover_id = None
 
-        if self.plot_settings['axis_left_on2']:
-            axes2['left'] = True
-        else:
-            axes2['left'] = False
+            for artist in (self.highlight_line, self.highlight_point):
+                artist.set_visible(False)
 
-        if self.plot_settings['axis_right_on2']:
-            axes2['right'] = True
-        else:
-            axes2['right'] = False
+            return
 
+        data_id, index = hit
+        self.hover_id = data_id
 
-        if self.plot_settings['axis_bottom_on'] and self.plot_settings['label_bottom']:
-            axeslabel['labelbottom'] = True
-        else:
-            axeslabel['labelbottom'] = False
+        for ax, x, y, indices in self._get_pick_points(data_id):
+            if ax is event.inaxes:
+                point = np.searchsorted(indices, index)
 
-        if self.plot_settings['axis_top_on'] and self.plot_settings['label_top']:
-            axeslabel['labeltop'] = True
-        else:
-            axeslabel['labeltop'] = False
+                for artist in (self.highlight_line, self.highlight_point):
+                    artist.set_transform(ax.transData)
+                    artist.set_clip_box(ax.bbox)
+                    artist.set_visible(True)
 
-        if self.plot_settings['axis_left_on'] and self.plot_settings['label_left']:
-            axeslabel['labelleft'] = True
-        else:
-            axeslabel['labelleft'] = False
+                self.highlight_line.set_data(x, y)
+                self.highlight_point.set_data([x[point]], [y[point]])
 
-        if self.plot_settings['axis_right_on'] and self.plot_settings['label_right']:
-            axeslabel['labelright'] = True
-        else:
-            axeslabel['labelright'] = False
+        data = self.plotted_data[data_id]['data']
 
-        if self.plot_settings['axis_bottom_on2'] and self.plot_settings['label_bottom2']:
-            axeslabel2['labelbottom'] = True
-        else:
-            axeslabel2['labelbottom'] = False
+        if event.inaxes in self.cursors:
+            readout = self.cursors[event.inaxes][2]
+            readout.set_text('{}\n{}, q = {:.4g}'.format(readout.get_text(),
+                data.short_filename, data.q[index]))
 
-        if self.plot_settings['axis_top_on2'] and self.plot_settings['label_top2']:
-            axeslabel2['labeltop'] = True
-        else:
-            axeslabel2['labeltop'] = False
+    def _on_motion(self, event):
+        if self._drag_selector is not None:
+            self._drag_guinier_selector(event)
 
-        if self.plot_settings['axis_left_on2'] and self.plot_settings['label_left2']:
-            axeslabel2['labelleft'] = True
-        else:
-            axeslabel2['labelleft'] = False
+        self._update_cursors(event)
+        self._update_hover(event)
 
-        if self.plot_settings['axis_right_on2'] and self.plot_settings['label_right2']:
-            axeslabel2['labelright'] = True
-        else:
-            axeslabel2['labelright'] = False
+        self.blit.update()
 
-        if self.subplot1 is not None:
-            if self.plot_settings['major_ticks_x'] and self.plot_settings['minor_ticks_x']:
-                self.subplot1.tick_params(which='both', direction=self.plot_settings['tick_position_x'], axis='x',
-                    **axes, **axeslabel)
+    def _on_axes_leave(self, event):
+        self._update_cursors(None)
+        self._update_hover(None)
+        self.blit.update()
 
-            elif self.plot_settings['major_ticks_x']:
-                self.subplot1.tick_params(which='major', direction=self.plot_settings['tick_position_x'], axis='x',
-                    **axes, **axeslabel)
-                self.subplot1.tick_params(which='minor', axis='x', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+    def _update_cursors(self, event):
+        for ax, (vline, hline, readout, labels) in self.cursors.items():
+            if (event is not None and event.inaxes is ax and event.xdata is not None
+                and self.plot_settings['show_cursor_readout']):
+                x, y = ax.transAxes.inverted().transform((event.x, event.y))
 
-            elif self.plot_settings['minor_ticks_x']:
-                self.subplot1.tick_params(which='minor', direction=self.plot_settings['tick_position_x'], axis='x',
-                    **axes, **axeslabel)
-                self.subplot1.tick_params(which='major', axis='x', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+                vline.set_xdata([x, x])
+                hline.set_ydata([y, y])
+                readout.set_text('{} = {:.4g}, {} = {:.4g}'.format(labels[0],
+                    event.xdata, labels[1], event.ydata))
 
+                visible = True
             else:
-                self.subplot1.tick_params(which='both', axis='x', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
-                
-
-            if self.plot_settings['major_ticks_y'] and self.plot_settings['minor_ticks_y']:
-                self.subplot1.tick_params(which='both', direction=self.plot_settings['tick_position_y'], axis='y',
-                    **axes, **axeslabel)
-
-            elif self.plot_settings['major_ticks_y']:
-                self.subplot1.tick_params(which='major', direction=self.plot_settings['tick_position_y'], axis='y',
-                    **axes, **axeslabel)
-                self.subplot1.tick_params(which='minor', axis='y', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
-
-            elif self.plot_settings['minor_ticks_y']:
-                self.subplot1.tick_params(which='minor', direction=self.plot_settings['tick_position_y'], axis='y',
-                    **axes, **axeslabel)
-                self.subplot1.tick_params(which='major', axis='y', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+                visible = False
 
-            else:
-                self.subplot1.tick_params(which='both', axis='y', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+            for artist in (vline, hline, readout):
+                artist.set_visible(visible)
 
-            self.subplot1.tick_params(which='both', axis='x', labelsize=self.plot_settings['tick_x_size'])
-            self.subplot1.tick_params(which='both', axis='y', labelsize=self.plot_settings['tick_y_size'])
+    def _on_press(self, event):
+        if event.button != 1 or event.inaxes is None:
+            return
 
-            for tick in self.subplot1.get_xticklabels(which='both'):
-                tick.set_fontname(self.plot_settings['tick_x_font'])
+        for end, selector in self.guinier_selectors:
+            if selector.get_visible() and self.guinier_range_target in self.plotted_data:
+                x = selector.get_xdata()[0]
+                display_x = event.inaxes.transData.transform((x, 0))[0]
 
-            for tick in self.subplot1.get_yticklabels(which='both'):
-                tick.set_fontname(self.plot_settings['tick_y_font'])
+                if abs(display_x - event.x) <= self.selector_pick_radius:
+                    self._start_guinier_drag(end)
+                    return
 
+        hit = self.pick(event.x, event.y)
 
-        if self.subplot2 is not None:
-            if self.plot_settings['major_ticks_x2'] and self.plot_settings['minor_ticks_x2']:
-                self.subplot2.tick_params(which='both', direction=self.plot_settings['tick_position_x2'], axis='x',
-                    **axes2, **axeslabel2)
+        if hit is not None:
+            data_id = hit[0]
 
-            elif self.plot_settings['major_ticks_x2']:
-                self.subplot2.tick_params(which='major', direction=self.plot_settings['tick_position_x2'], axis='x',
-                    **axes2, **axeslabel2)
-                self.subplot2.tick_params(which='minor', axis='x', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+            if self.plot_type == 'guinier' and data_id != self.guinier_range_target:
+                self.set_guinier_range_target(data_id)
 
-            elif self.plot_settings['minor_ticks_x2']:
-                self.subplot2.tick_params(which='minor', direction=self.plot_settings['tick_position_x2'], axis='x',
-                    **axes2, **axeslabel2)
-                self.subplot2.tick_params(which='major', axis='x', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+            self.plot_panel.select_data(data_id)
 
-            else:
-                self.subplot2.tick_params(which='both', axis='x', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
-                
-
-            if self.plot_settings['major_ticks_y2'] and self.plot_settings['minor_ticks_y2']:
-                self.subplot2.tick_params(which='both', direction=self.plot_settings['tick_position_y2'], axis='y',
-                    **axes2, **axeslabel2)
-
-            elif self.plot_settings['major_ticks_y2']:
-                self.subplot2.tick_params(which='major', direction=self.plot_settings['tick_position_y2'], axis='y',
-                    **axes2, **axeslabel2)
-                self.subplot2.tick_params(which='minor', axis='y', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
-
-            elif self.plot_settings['minor_ticks_y2']:
-                self.subplot2.tick_params(which='minor', direction=self.plot_settings['tick_position_y2'], axis='y',
-                    **axes2, **axeslabel2)
-                self.subplot2.tick_params(which='major', axis='y', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+    def _start_guinier_drag(self, end):
+        self._drag_selector = end
 
-            else:
-                self.subplot2.tick_params(which='both', axis='y', left=False, right=False, top=False, bottom=False,
-                    labelleft=False, labelright=False, labeltop=False, labelbottom=False)
+        lines1, lines2, fitlines = self.plotted_data[self.guinier_range_target]['lines']
 
-            self.subplot2.tick_params(which='both', axis='x', labelsize=self.plot_settings['tick_x2_size'])
-            self.subplot2.tick_params(which='both', axis='y', labelsize=self.plot_settings['tick_y2_size'])
+        line, caps, bars = lines1
+        self._drag_artists = [line] + list(caps) + list(bars) + list(fitlines) + list(lines2)
 
-            for tick in self.subplot2.get_xticklabels(which='both'):
-                tick.set_fontname(self.plot_settings['tick_x2_font'])
+        # The background is redrawn once without the dragged profile, which
+        # is then blitted along with the selectors.
+        for artist in self._drag_artists:
+            self.blit.add_artist(artist)
 
-            for tick in self.subplot2.get_yticklabels(which='both'):
-                tick.set_fontname(self.plot_settings['tick_y2_font'])
+        self.blit.invalidate()
+        self.blit.update()
 
-    def set_axes_settings(self):
+    def _drag_guinier_selector(self, event):
+        if event.inaxes not in self.cursors or event.xdata is None:
+            return
 
-        if self.subplot1 is not None:
-            if self.plot_settings['axis_left_on']:
-                self.subplot1.spines['left'].set_color('black')
-            else:
-                self.subplot1.spines['left'].set_color('none')
+        data = self.plotted_data[self.guinier_range_target]['data']
 
-            if self.plot_settings['axis_right_on']:
-                self.subplot1.spines['right'].set_color('black')
-            else:
-                self.subplot1.spines['right'].set_color('none')
+        q = np.sqrt(max(event.xdata, 0))
+        qmin = data.q[data.q_idx_min]
+        qmax = data.q[data.q_idx_max]
 
-            if self.plot_settings['axis_top_on']:
-                self.subplot1.spines['top'].set_color('black')
-            else:
-                self.subplot1.spines['top'].set_color('none')
+        if self._drag_selector == 0:
+            qmin = q
+        else:
+            qmax = q
 
-            if self.plot_settings['axis_bottom_on']:
-                self.subplot1.spines['bottom'].set_color('black')
-            else:
-                self.subplot1.spines['bottom'].set_color('none')
+        self.update_guinier_range(self.guinier_range_target, qmin, qmax, redraw=False)
+        self._update_guinier_selectors()
 
-        if self.subplot2 is not None:
-            if self.plot_settings['axis_left_on2']:
-                self.subplot2.spines['left'].set_color('black')
-            else:
-                self.subplot2.spines['left'].set_color('none')
+    def _on_release(self, event):
+        if self._drag_selector is None:
+            return
 
-            if self.plot_settings['axis_right_on2']:
-                self.subplot2.spines['right'].set_color('black')
-            else:
-                self.subplot2.spines['right'].set_color('none')
+        self._drag_selector = None
 
-            if self.plot_settings['axis_top_on2']:
-                self.subplot2.spines['top'].set_color('black')
-            else:
-                self.subplot2.spines['top'].set_color('none')
+        for artist in self._drag_artists:
+            self.blit.remove_artist(artist)
 
-            if self.plot_settings['axis_bottom_on2']:
-                self.subplot2.spines['bottom'].set_color('black')
-            else:
-                self.subplot2.spines['bottom'].set_color('none')
+        self._drag_artists = []
+
+        self.plot_panel.update_data([self.plotted_data[self.guinier_range_target]['data']])
+
+        if self.plot_settings['auto_limits']:
+            self.do_auto_limits()
+
+        self.request_redraw()
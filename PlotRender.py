@@ -0,0 +1,706 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the matplotlib helpers that keep plots of many dense
+profiles fast to draw. It doesn't depend on wx.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+import collections
+import contextlib
+
+import numpy as np
+import matplotlib.artist as martist
+import matplotlib.collections as mcollections
+import matplotlib.colors as mcolors
+import matplotlib.lines as mlines
+
+
+def minmax_decimate(x, y, xmin, xmax, nbins, log_x=False):
+    """
+    Returns the indices of the points to draw for the part of a line between
+    xmin and xmax, when the axis is nbins pixels wide. For each pixel column
+    the points with the smallest and largest y are kept, so the drawn line
+    has the same extent as the full line. If there are only a few points
+    per pixel, all the points in the range are returned. x must be sorted.
+    One point beyond each end of the range is included, so the line runs to
+    the edge of the axis.
+    """
+    npts = len(x)
+
+    start = max(int(np.searchsorted(x, xmin, side='left')) - 1, 0)
+    stop = min(int(np.searchsorted(x, xmax, side='right')) + 1, npts)
+
+    if stop - start <= 2*nbins + 2:
+        return np.arange(start, stop)
+
+    vis_x = x[start:stop]
+    vis_y = y[start:stop]
+
+    if log_x:
+        vis_x = np.log(np.clip(vis_x, np.finfo(float).tiny, None))
+        lo = np.log(max(xmin, np.finfo(float).tiny))
+        hi = np.log(max(xmax, np.finfo(float).tiny))
+    else:
+        lo = xmin
+        hi = xmax
+
+    if hi <= lo:
+        return np.array([start, stop-1])
+
+    bins = np.clip(((vis_x - lo)/(hi - lo)*nbins).astype(np.intp), -1, nbins)
+
+    # Within each bin, sort by y so the first and last entries are the min and max
+    order = np.lexsort((vis_y, bins))
+    sorted_bins = bins[order]
+
+    group_starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_bins)) + 1))
+    group_ends = np.concatenate((group_starts[1:], [len(order)])) - 1
+
+    keep = np.concatenate((order[group_starts], order[group_ends], [0, len(vis_x)-1]))
+    keep = np.unique(keep)
+
+    return keep + start
+
+
+class LODManager(object):
+    """
+    Level of detail layer between the data and the plotted artists. Each
+    registered line is drawn with a min/max decimated copy of its data,
+    sized to the width of the axes in pixels. When the x limits or the
+    canvas size change, only the visible range is decimated again, and once
+    zoomed in far enough the full data is drawn.
+
+    Lines are registered with a setter, which is called with the indices of
+    the points to draw, or None to draw all of them.
+    """
+
+    def __init__(self, points_per_pixel=1):
+        self.points_per_pixel = points_per_pixel
+        self.enabled = True
+
+        self._lines = {}
+        self._axes = {}
+
+        self._held = 0
+        self._held_axes = set()
+
+    def add_line(self, key, ax, x, y, setter):
+        if ax not in self._axes:
+            cid = ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+            self._axes[ax] = cid
+
+        self._lines[key] = {'ax': ax, 'x': np.asarray(x), 'y': np.asarray(y),
+            'setter': setter, 'idx': None}
+
+        self._update_line(self._lines[key], full_range=True)
+
+    def remove_line(self, key):
+        entry = self._lines.pop(key, None)
+
+        if entry is not None:
+            ax = entry['ax']
+
+            if not any(each['ax'] is ax for each in self._lines.values()):
+                ax.callbacks.disconnect(self._axes.pop(ax))
+
+    def get_indices(self, key):
+        """Returns the indices of the points currently drawn for a line."""
+        entry = self._lines[key]
+
+        if entry['idx'] is None:
+            return np.arange(len(entry['x']))
+
+        return entry['idx']
+
+    def update(self, ax=None):
+        """Decimates the lines again, for all axes or just ax."""
+        for entry in self._lines.values():
+            if ax is None or entry['ax'] is ax:
+                self._update_line(entry)
+
+    def on_resize(self, event=None):
+        self.update()
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        Defers decimating for x limit changes until the end of the context,
+        e.g. while adding a batch of lines that autoscale the axes each time.
+        """
+        self._held = self._held + 1
+
+        try:
+            yield
+        finally:
+            self._held = self._held - 1
+
+            if self._held == 0:
+                held_axes = self._held_axes
+                self._held_axes = set()
+
+                for ax in held_axes:
+                    self.update(ax)
+
+    @contextlib.contextmanager
+    def full_resolution(self):
+        """Draws every line with all its points while in the context, e.g. for exports."""
+        enabled = self.enabled
+        self.enabled = False
+        self.update()
+
+        try:
+            yield
+        finally:
+            self.enabled = enabled
+            self.update()
+
+    def _on_xlim_changed(self, ax):
+        if self._held > 0:
+            self._held_axes.add(ax)
+        else:
+            self.update(ax)
+
+    def _update_line(self, entry, full_range=False):
+        x = entry['x']
+        y = entry['y']
+
+        if self.enabled and len(x) > 0:
+            ax = entry['ax']
+
+            if full_range:
+                xmin = x[0]
+                xmax = x[-1]
+            else:
+                xmin, xmax = sorted(ax.get_xlim())
+
+            nbins = max(int(ax.get_window_extent().width*self.points_per_pixel), 1)
+
+            idx = minmax_decimate(x, y, xmin, xmax, nbins, ax.get_xscale() == 'log')
+
+        else:
+            idx = None
+
+        if idx is not None and len(idx) == len(x):
+            idx = None
+
+        if idx is None and entry['idx'] is None and not full_range:
+            return
+
+        entry['idx'] = idx
+        entry['setter'](idx)
+
+
+def errorbar_setter(container, x, y, err):
+    """
+    Returns an LODManager setter that draws the given points of an errorbar
+    container.
+    """
+    line, caps, bars = container
+
+    def setter(idx):
+        if idx is None:
+            plot_x = x
+            plot_y = y
+            plot_err = err
+        else:
+            plot_x = x[idx]
+            plot_y = y[idx]
+            plot_err = err[idx]
+
+        line.set_data(plot_x, plot_y)
+
+        if any(bar.get_visible() for bar in bars):
+            set_errorbar_data(caps, bars, plot_x, plot_y, plot_err)
+
+    return setter
+
+def set_errorbar_data(caps, bars, x, y, err):
+    """Updates the caps and bar collections of an errorbar container."""
+    segments = np.stack((np.column_stack((x, y-err)), np.column_stack((x, y+err))), axis=1)
+
+    for barline in bars:
+        barline.set_segments(segments)
+
+    if len(caps) == 2:
+        caps[0].set_data(x, y-err)
+        caps[1].set_data(x, y+err)
+
+
+class ProfileOverlay(martist.Artist):
+    """
+    Draws many profiles on one axes with a few shared artists instead of
+    one errorbar container per profile: one LineCollection for the lines,
+    one marker only line per marker shape and color, and an error bar
+    LineCollection that is only built when some profile shows its error
+    bars. Per-profile styles are set as per-segment and per-point
+    properties. The artists are rebuilt lazily, at most once per draw.
+
+    Markers are grouped into lines rather than a PathCollection because Agg
+    draws line markers from one cached stamp, which is much faster than
+    drawing a path per point.
+
+    The collections aren't seen by Axes.relim, so use get_datalim when
+    autoscaling, or by Axes.legend, so use get_legend_handles_labels for
+    the legend.
+    """
+
+    def __init__(self, ax, markersize=6, linewidth=1.5):
+        martist.Artist.__init__(self)
+
+        self.ax = ax
+        self.markersize = markersize
+        self.linewidth = linewidth
+
+        self.set_figure(ax.figure)
+        self.set_zorder(2)
+
+        self._profiles = collections.OrderedDict()
+        self._collections = []
+        self._stale_data = True
+
+        ax.add_artist(self)
+
+    def add_profile(self, key, x, y, err=None, color=None, label=None):
+        """
+        Adds a profile. If color isn't given the next color of the axes'
+        property cycle is used, the same as for a line plotted on the axes.
+        """
+        if color is None:
+            color = self.ax._get_lines.get_next_color()
+
+        self._profiles[key] = {'x': np.asarray(x), 'y': np.asarray(y),
+            'err': None if err is None else np.asarray(err), 'idx': None,
+            'color': mcolors.to_rgba(color), 'linestyle': 'None', 'marker': 'o',
+            'show_error_bars': False, 'visible': True, 'label': label}
+
+        self._mark_stale()
+
+    def set_data(self, key, x, y, err=None):
+        """Replaces the points of a profile, keeping its style."""
+        profile = self._profiles[key]
+
+        profile['x'] = np.asarray(x)
+        profile['y'] = np.asarray(y)
+        profile['err'] = None if err is None else np.asarray(err)
+        profile['idx'] = None
+
+        self._mark_stale()
+
+    def remove_profile(self, key):
+        if self._profiles.pop(key, None) is not None:
+            self._mark_stale()
+
+    def has_profile(self, key):
+        return key in self._profiles
+
+    def set_style(self, key, **kwargs):
+        """
+        Sets the style of one profile. Keywords are color, linestyle, marker,
+        show_error_bars, and visible.
+        """
+        profile = self._profiles[key]
+
+        for name, value in kwargs.items():
+            if name == 'color':
+                value = mcolors.to_rgba(value)
+
+            profile[name] = value
+
+        self._mark_stale()
+
+    def get_color(self, key):
+        return self._profiles[key]['color']
+
+    def get_style(self, key):
+        """Returns the style of one profile, with the keywords of :meth:`set_style`."""
+        profile = self._profiles[key]
+
+        return {name : profile[name] for name in ('color', 'linestyle', 'marker',
+            'show_error_bars', 'visible')}
+
+    def get_legend_handles_labels(self):
+        """
+        Returns (handles, labels) for the visible profiles with a label, as
+        Axes.get_legend_handles_labels does. The handles are proxy lines
+        styled like each profile.
+        """
+        handles = []
+        labels = []
+
+        for profile in self._profiles.values():
+            label = profile['label']
+
+            if not profile['visible'] or label is None or label.startswith('_'):
+                continue
+
+            handles.append(mlines.Line2D([], [], color=profile['color'],
+                linestyle=profile['linestyle'], marker=profile['marker'],
+                markersize=self.markersize, linewidth=self.linewidth))
+            labels.append(label)
+
+        return handles, labels
+
+    def setter(self, key):
+        """Returns an LODManager setter for a profile."""
+        def set_indices(idx):
+            self._profiles[key]['idx'] = idx
+            self._mark_stale()
+
+        return set_indices
+
+    def get_datalim(self):
+        """Returns (xmin, xmax, ymin, ymax) of all the visible profiles, or None."""
+        bounds = []
+
+        for profile in self._profiles.values():
+            if profile['visible'] and len(profile['x']) > 0:
+                x = profile['x']
+                y = profile['y']
+
+                if self.ax.get_yscale() == 'log':
+                    y = y[y > 0]
+
+                if len(y) > 0:
+                    bounds.append((np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y)))
+
+        if len(bounds) == 0:
+            return None
+
+        bounds = np.array(bounds)
+
+        return (bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 2].min(),
+            bounds[:, 3].max())
+
+    def get_children(self):
+        return list(self._collections)
+
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+
+        if self._stale_data:
+            self._rebuild()
+
+        for collection in self._collections:
+            collection.draw(renderer)
+
+        self.stale = False
+
+    def _mark_stale(self):
+        self._stale_data = True
+        self.stale = True
+
+    def _get_points(self, profile):
+        if profile['idx'] is None:
+            return profile['x'], profile['y'], profile['err']
+
+        idx = profile['idx']
+        err = profile['err'][idx] if profile['err'] is not None else None
+
+        return profile['x'][idx], profile['y'][idx], err
+
+    def _rebuild(self):
+        self._collections = []
+
+        line_segments = []
+        line_colors = []
+        line_styles = []
+
+        marker_x = collections.OrderedDict()
+        marker_y = collections.OrderedDict()
+
+        err_segments = []
+        err_colors = []
+
+        for profile in self._profiles.values():
+            if not profile['visible']:
+                continue
+
+            x, y, err = self._get_points(profile)
+
+            if profile['linestyle'] not in ('None', 'none', '', ' ', None):
+                line_segments.append(np.column_stack((x, y)))
+                line_colors.append(profile['color'])
+                line_styles.append(profile['linestyle'])
+
+            marker = profile['marker']
+            if marker not in ('None', 'none', '', ' ', None):
+                marker_key = (marker, profile['color'])
+                marker_x.setdefault(marker_key, []).append(x)
+                marker_y.setdefault(marker_key, []).append(y)
+
+            if profile['show_error_bars'] and err is not None:
+                err_segments.append(np.stack((np.column_stack((x, y-err)),
+                    np.column_stack((x, y+err))), axis=1))
+                err_colors.append(np.tile(profile['color'], (len(x), 1)))
+
+        if len(err_segments) > 0:
+            err_collection = mcollections.LineCollection(np.concatenate(err_segments),
+                colors=np.concatenate(err_colors), linewidths=self.linewidth)
+            self._add_collection(err_collection)
+
+        if len(line_segments) > 0:
+            line_collection = mcollections.LineCollection(line_segments,
+                colors=line_colors, linestyles=line_styles, linewidths=self.linewidth)
+            self._add_collection(line_collection)
+
+        for marker_key in marker_x:
+            marker, color = marker_key
+
+            marker_line = mlines.Line2D(np.concatenate(marker_x[marker_key]),
+                np.concatenate(marker_y[marker_key]), linestyle='None',
+                marker=marker, markersize=self.markersize, color=color,
+                markerfacecolor=color, markeredgecolor=color)
+            self._add_collection(marker_line)
+
+        self._stale_data = False
+
+    def _add_collection(self, collection):
+        collection.set_figure(self.figure)
+        collection.set_transform(self.ax.transData)
+        collection.set_clip_box(self.ax.bbox)
+        collection.set_clip_path(self.ax.patch)
+        collection.set_zorder(self.get_zorder())
+
+        self._collections.append(collection)
+
+
+class BlitManager(object):
+    """
+    Redraws a few animated artists, such as a cursor or range selectors, on
+    top of a cached background of the rest of the figure, instead of
+    drawing the whole figure. The artists can be left out of the axes, so
+    they aren't autoscaled or exported, as long as their figure, transform
+    and clipping are set. The background is saved after every full
+    draw, and is discarded when the canvas is resized or the axes limits
+    change. Needs a canvas that supports copy_from_bbox and blit, such as
+    the Agg based canvases.
+
+    Full draws don't include the animated artists, so a canvas that keeps
+    its renders never caches them. Call :meth:`draw_overlay` after each
+    full draw to show them.
+
+    :param draw_func: Called to do a full draw when there is no valid
+        background. Defaults to the canvas draw method.
+    """
+
+    def __init__(self, canvas, draw_func=None):
+        self.canvas = canvas
+
+        if draw_func is None:
+            draw_func = canvas.draw
+
+        self.draw_func = draw_func
+
+        self.background = None
+        self._background_key = None
+
+        self._artists = []
+
+        canvas.mpl_connect('draw_event', self._on_draw)
+        canvas.mpl_connect('resize_event', self._on_resize)
+
+    def add_artist(self, artist):
+        if artist not in self._artists:
+            artist.set_animated(True)
+            self._artists.append(artist)
+
+    def remove_artist(self, artist, animated=False):
+        if artist in self._artists:
+            self._artists.remove(artist)
+            artist.set_animated(animated)
+
+    def invalidate(self):
+        self.background = None
+
+    def update(self):
+        """Redraws the animated artists and shows them on the canvas."""
+        if self.background is None or self._background_key != self._get_key():
+            # The canvas calls draw_overlay once the draw is done
+            self.draw_func()
+            return
+
+        self.canvas.restore_region(self.background)
+        self._draw_animated()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def _on_draw(self, event):
+        # Exports are drawn at their own size and dpi, and shouldn't show the
+        # animated artists.
+        if event.canvas.is_saving():
+            self.background = None
+            return
+
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._background_key = self._get_key()
+
+    def draw_overlay(self):
+        """
+        Draws the animated artists over the figure that was just drawn, and
+        shows them on the canvas. The canvas' own render is left without them.
+        """
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._background_key = self._get_key()
+
+        self._draw_animated()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def _on_resize(self, event):
+        self.background = None
+
+    def _draw_animated(self):
+        figure = self.canvas.figure
+
+        for artist in sorted(self._artists, key=lambda artist: artist.get_zorder()):
+            if artist.get_visible():
+                figure.draw_artist(artist)
+
+    def _get_key(self):
+        figure = self.canvas.figure
+
+        limits = tuple(tuple(ax.get_xlim()) + tuple(ax.get_ylim()) for ax in figure.axes)
+
+        return (tuple(figure.bbox.bounds), limits)
+
+
+class PointIndex(object):
+    """
+    Uniform grid of square cells over points in display coordinates, for
+    finding the plotted point nearest the mouse among many lines. Building
+    sorts the points by cell once, and a query only looks at the points in
+    the cells within the search radius.
+    """
+
+    def __init__(self, cell_size=8):
+        self.cell_size = cell_size
+
+        self.clear()
+
+    def clear(self):
+        self._keys = []
+        self._cells = np.empty(0, dtype=np.int64)
+        self._x = np.empty(0)
+        self._y = np.empty(0)
+        self._owners = np.empty(0, dtype=np.intp)
+        self._indices = np.empty(0, dtype=np.intp)
+
+        self._cx_min = 0
+        self._cy_min = 0
+        self._nx = 0
+        self._ny = 0
+
+    def build(self, entries):
+        """
+        Indexes the points of many lines.
+
+        :param entries: An iterable of (key, xy, indices), where xy is an
+            (N, 2) array of display coordinates and indices is the index of
+            each point in its line's data, or None for 0 to N-1.
+        """
+        self.clear()
+
+        xs = []
+        ys = []
+        owners = []
+        all_indices = []
+
+        for key, xy, indices in entries:
+            xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+
+            if indices is None:
+                indices = np.arange(len(xy))
+
+            finite = np.isfinite(xy[:, 0]) & np.isfinite(xy[:, 1])
+
+            xs.append(xy[finite, 0])
+            ys.append(xy[finite, 1])
+            all_indices.append(np.asarray(indices)[finite])
+            owners.append(np.full(np.count_nonzero(finite), len(self._keys), dtype=np.intp))
+
+            self._keys.append(key)
+
+        if len(xs) == 0 or sum(len(x) for x in xs) == 0:
+            return
+
+        x = np.concatenate(xs)
+        y = np.concatenate(ys)
+
+        cx = np.floor(x/self.cell_size).astype(np.int64)
+        cy = np.floor(y/self.cell_size).astype(np.int64)
+
+        self._cx_min = cx.min()
+        self._cy_min = cy.min()
+        self._nx = int(cx.max() - self._cx_min + 1)
+        self._ny = int(cy.max() - self._cy_min + 1)
+
+        cells = (cx - self._cx_min)*self._ny + (cy - self._cy_min)
+
+        order = np.argsort(cells, kind='stable')
+
+        self._cells = cells[order]
+        self._x = x[order]
+        self._y = y[order]
+        self._owners = np.concatenate(owners)[order]
+        self._indices = np.concatenate(all_indices)[order]
+
+    def query(self, x, y, radius):
+        """
+        Returns (key, index, distance) for the indexed point nearest (x, y)
+        within radius, or None if there isn't one.
+        """
+        if self._cells.size == 0:
+            return None
+
+        cx_start = max(int(np.floor((x - radius)/self.cell_size)) - self._cx_min, 0)
+        cx_stop = min(int(np.floor((x + radius)/self.cell_size)) - self._cx_min, self._nx - 1)
+        cy_start = max(int(np.floor((y - radius)/self.cell_size)) - self._cy_min, 0)
+        cy_stop = min(int(np.floor((y + radius)/self.cell_size)) - self._cy_min, self._ny - 1)
+
+        if cx_start > cx_stop or cy_start > cy_stop:
+            return None
+
+        # For each column of cells, the cells in the y range are contiguous
+        columns = np.arange(cx_start, cx_stop + 1)*self._ny
+        starts = np.searchsorted(self._cells, columns + cy_start, side='left')
+        stops = np.searchsorted(self._cells, columns + cy_stop, side='right')
+
+        candidates = np.concatenate([np.arange(start, stop) for start, stop
+            in zip(starts, stops)])
+
+        if candidates.size == 0:
+            return None
+
+        dist2 = (self._x[candidates] - x)**2 + (self._y[candidates] - y)**2
+
+        best = int(np.argmin(dist2))
+
+        if dist2[best] > radius**2:
+            return None
+
+        point = candidates[best]
+
+        return (self._keys[self._owners[point]], int(self._indices[point]),
+            float(np.sqrt(dist2[best])))
@@ -0,0 +1,311 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the on disk cache of parsed data files, so that reopening
+a file doesn't have to parse the text again.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+import os
+import sys
+import time
+import json
+import hashlib
+
+import numpy as np
+
+import Data
+
+
+def default_cache_dir():
+    """Returns the platform appropriate user cache directory for SASPub."""
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        cache_dir = os.path.join(base, 'SASPub', 'Cache')
+    elif sys.platform == 'darwin':
+        cache_dir = os.path.expanduser('~/Library/Caches/SASPub')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+        cache_dir = os.path.join(base, 'saspub')
+
+    return cache_dir
+
+def hash_file(filename):
+    file_hash = hashlib.blake2b(digest_size=16)
+
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def hash_bytes(raw):
+    """Returns the same hash as :func:`hash_file`, for file contents already read."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class ParseCache(object):
+    """
+    Stores parsed profiles as one ``.npy`` array file plus one ``.json``
+    index file per source file. Entries are checked against the size and
+    mtime of the source file, and against its content hash if it was
+    modified too close to when it was cached for the mtime to tell. Once the
+    cache grows past ``max_size`` bytes the least recently used entries are
+    evicted, down to ``evict_fraction`` of it. Hits are returned with arrays
+    memory mapped from the cache. Arrays are stored in their own dtype, so
+    float32 profiles stay float32.
+    """
+
+    version = 4
+
+    #: Fraction of max_size the cache is evicted down to, so eviction, which
+    #: lists the whole cache, doesn't run on every put.
+    evict_fraction = 0.9
+
+    #: Files modified within this many ns of being cached are also checked
+    #: by hash, as a later write might not change the mtime. 2 s covers the
+    #: coarsest common filesystem timestamps (FAT).
+    mtime_granularity = 2*10**9
+
+    array_attrs = ('q', 'i', 'err', 'fit_q', 'fit_i', 'fit_err')
+
+    def __init__(self, cache_dir, max_size=500*1024**2):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        self._total_size = None
+
+    def get(self, filename):
+        """
+        Returns the cached data for filename, or None if there is no valid
+        entry for the file as it currently is on disk.
+        """
+        base = self._entry_base(filename)
+        index_file = base + '.json'
+
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+
+            stat = os.stat(filename)
+        except (OSError, ValueError):
+            return None
+
+        if (index.get('version') != self.version or index['path'] != os.path.abspath(filename)
+            or index['size'] != stat.st_size or index['mtime'] != stat.st_mtime_ns):
+            return None
+
+        if (index['mtime'] >= index['cached'] - self.mtime_granularity
+            and index['hash'] != hash_file(filename)):
+            return None
+
+        try:
+            buf = np.load(base + '.npy', mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        arrays = {}
+
+        for entry in index['layout']:
+            attr, start, stop, dtype = entry
+            arrays[attr] = buf[start:stop].view(np.dtype(dtype))
+
+        for attr, alias in index['aliases']:
+            arrays[attr] = arrays[alias]
+
+        data = Data.ProfileData(arrays['q'], arrays['i'], arrays['err'],
+            arrays.get('fit_q'), arrays.get('fit_i'), arrays.get('fit_err'))
+        data.set_metadata(index['metadata'])
+
+        # Keeps the most recently used entries from being evicted
+        try:
+            os.utime(index_file)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, filename, data, file_hash=None):
+        """
+        Adds the parsed data for filename to the cache.
+
+        :param str file_hash: The :func:`hash_file` hash of the file, if it
+            was already computed while loading it.
+        """
+        if not isinstance(data, Data.ProfileData):
+            return
+
+        try:
+            cached = time.time_ns()
+            stat = os.stat(filename)
+
+            if file_hash is None:
+                file_hash = hash_file(filename)
+        except OSError:
+            return
+
+        originals = []
+        arrays = []
+        layout = []
+        aliases = []
+        offset = 0
+
+        for attr in self.array_attrs:
+            array = getattr(data, attr)
+
+            if array is None:
+                continue
+
+            for prev_attr, prev_array in originals:
+                if prev_array is array:
+                    aliases.append((attr, prev_attr))
+                    break
+            else:
+                originals.append((attr, array))
+
+                # Byte offsets, padded so each array is aligned for its dtype
+                array = np.ascontiguousarray(array).ravel()
+                raw = array.view(np.uint8)
+                layout.append((attr, offset, offset+raw.size, array.dtype.str))
+
+                padding = -raw.size % 8
+                arrays.append(raw)
+                arrays.append(np.zeros(padding, dtype=np.uint8))
+                offset = offset + raw.size + padding
+
+        buf = np.concatenate(arrays)
+
+        index = {
+            'version'   : self.version,
+            'path'      : os.path.abspath(filename),
+            'size'      : stat.st_size,
+            'mtime'     : stat.st_mtime_ns,
+            'hash'      : file_hash,
+            'cached'    : cached,
+            'layout'    : layout,
+            'aliases'   : aliases,
+            'metadata'  : data.get_metadata(),
+            }
+
+        base = self._entry_base(filename)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            old_size = self._entry_size(base)
+
+            # The index is written last, so a partly written entry is never
+            # read back.
+            with open(base + '.npy.tmp', 'wb') as f:
+                np.save(f, buf)
+            os.replace(base + '.npy.tmp', base + '.npy')
+
+            with open(base + '.json.tmp', 'w') as f:
+                json.dump(index, f)
+            os.replace(base + '.json.tmp', base + '.json')
+
+        except (OSError, TypeError, ValueError):
+            self._remove_entry(base)
+            return
+
+        if self._total_size is not None:
+            self._total_size = self._total_size - old_size + self._entry_size(base)
+
+        self._evict()
+
+    def clear(self):
+        for base in self._list_entries():
+            self._remove_entry(base)
+
+        self._total_size = 0
+
+    def _evict(self):
+        if self._total_size is None:
+            self._total_size = sum(self._entry_size(base) for base in self._list_entries())
+
+        if self._total_size <= self.max_size:
+            return
+
+        entries = []
+
+        for base in self._list_entries():
+            try:
+                last_used = os.path.getmtime(base + '.json')
+            except OSError:
+                last_used = 0
+
+            entries.append((last_used, base))
+
+        entries.sort()
+
+        target_size = self.max_size*self.evict_fraction
+
+        for last_used, base in entries:
+            if self._total_size <= target_size:
+                break
+
+            size = self._entry_size(base)
+
+            if self._remove_entry(base):
+                self._total_size = self._total_size - size
+
+    def _entry_base(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+
+        return os.path.join(self.cache_dir, key)
+
+    def _list_entries(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            names = []
+
+        return [os.path.join(self.cache_dir, name[:-5]) for name in names
+            if name.endswith('.json')]
+
+    def _entry_size(self, base):
+        size = 0
+
+        for ext in ('.json', '.npy'):
+            try:
+                size = size + os.path.getsize(base + ext)
+            except OSError:
+                pass
+
+        return size
+
+    def _remove_entry(self, base):
+        removed = True
+
+        for ext in ('.json', '.npy', '.json.tmp', '.npy.tmp'):
+            try:
+                os.remove(base + ext)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Windows won't remove a file that is still memory mapped
+                removed = False
+
+        return removed
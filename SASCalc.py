@@ -0,0 +1,365 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the analysis calculations done on scattering profiles,
+such as Guinier fits.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+import os
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+
+
+def find_closest_index(q, value):
+    """Returns the index of the point in the sorted array q closest to value."""
+    idx = int(np.searchsorted(q, value))
+
+    if idx >= len(q):
+        idx = len(q) - 1
+    elif idx > 0 and abs(q[idx-1] - value) <= abs(q[idx] - value):
+        idx = idx - 1
+
+    return idx
+
+
+class GuinierFitter(object):
+    """
+    Weighted least squares fits of ln(I) vs. q^2 over any range of a
+    profile. Cumulative sums of the weighted fit terms are computed once, so
+    each fit only takes a few subtractions, no matter how many points are in
+    the range. Points with non-positive intensity or error are ignored.
+    """
+
+    def __init__(self, q, i, err):
+        self.q = np.asarray(q, dtype=float)
+        self.i = np.asarray(i, dtype=float)
+        self.err = np.asarray(err, dtype=float)
+
+        x = self.q**2
+
+        valid = (self.i > 0) & (self.err > 0) & np.isfinite(self.i) & np.isfinite(self.err)
+        self._valid = valid
+
+        y = np.zeros_like(x)
+        w = np.zeros_like(x)
+
+        y[valid] = np.log(self.i[valid])
+        # The error of ln(I) is err/I
+        w[valid] = (self.i[valid]/self.err[valid])**2
+
+        self._sums = {}
+
+        for key, values in (('n', valid.astype(float)), ('w', w), ('wx', w*x),
+            ('wxx', w*x*x), ('wy', w*y), ('wxy', w*x*y), ('wyy', w*y*y)):
+            sums = np.zeros(len(x)+1)
+            np.cumsum(values, out=sums[1:])
+            self._sums[key] = sums
+
+    def fit(self, idx_min, idx_max):
+        """
+        Fits the points from idx_min to idx_max, inclusive. Returns a dict
+        with rg, rg_err, i0, i0_err, chi2 (reduced) and npts. Values that
+        can't be determined are NaN. Unlike :meth:`fit_many`, chi2 is
+        calculated from the residuals of the points in the range.
+        """
+        results = self.fit_many(np.array([idx_min]), np.array([idx_max]))
+
+        results = {key : float(value[0]) for key, value in results.items()}
+        results['npts'] = int(results['npts'])
+
+        if not np.isnan(results['rg']):
+            results['chi2'] = self.calc_chi2(idx_min, idx_max, results['rg'], results['i0'])
+
+        return results
+
+    def calc_chi2(self, idx_min, idx_max, rg, i0):
+        """Returns the reduced chi squared of a fit over the points from idx_min to idx_max."""
+        window = slice(idx_min, idx_max+1)
+        valid = self._valid[window]
+
+        x = self.q[window][valid]**2
+        i = self.i[window][valid]
+        err = self.err[window][valid]
+
+        residual = (np.log(i) - np.log(i0) + rg**2*x/3)*i/err
+
+        if len(x) <= 2:
+            return np.nan
+
+        return float(np.sum(residual**2)/(len(x)-2))
+
+    def fit_range(self, qmin, qmax):
+        """Fits between the points closest to qmin and qmax."""
+        idx_min = find_closest_index(self.q, qmin)
+        idx_max = find_closest_index(self.q, qmax)
+
+        return self.fit(idx_min, idx_max)
+
+    def fit_many(self, idx_min, idx_max):
+        """
+        Fits many ranges at once. idx_min and idx_max are arrays of the
+        inclusive range limits, and each value in the returned dict is an
+        array with one entry per range.
+
+        chi2 is expanded in the cumulative sums, which loses precision to
+        cancellation for very good fits. It is clamped at zero, and its
+        error is about machine precision times the weighted sum of ln(I)^2
+        in the range, which is plenty for ranking windows. Use :meth:`fit` or :meth:`calc_chi2`
+        for an accurate value.
+        """
+        idx_min = np.asarray(idx_min, dtype=np.intp)
+        idx_max = np.asarray(idx_max, dtype=np.intp) + 1
+
+        sums = {key : values[idx_max] - values[idx_min] for key, values in self._sums.items()}
+
+        n = sums['n']
+        s = sums['w']
+        sx = sums['wx']
+        sxx = sums['wxx']
+        sy = sums['wy']
+        sxy = sums['wxy']
+        syy = sums['wyy']
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = s*sxx - sx**2
+
+            slope = (s*sxy - sx*sy)/delta
+            intercept = (sxx*sy - sx*sxy)/delta
+
+            slope_err = np.sqrt(s/delta)
+            intercept_err = np.sqrt(sxx/delta)
+
+            # Weighted sum of the squared residuals, expanded in the sums.
+            # Can come out slightly negative from cancellation, see above.
+            chi2 = (syy - 2*slope*sxy - 2*intercept*sy + slope**2*sxx
+                + 2*slope*intercept*sx + intercept**2*s)
+            chi2 = np.maximum(chi2, 0)/(n-2)
+
+            rg = np.sqrt(-3*slope)
+            rg_err = 3*slope_err/(2*rg)
+
+            i0 = np.exp(intercept)
+            i0_err = i0*intercept_err
+
+        bad = (n < 2) | ~(delta > 0) | ~(slope < 0)
+
+        results = {'rg' : rg, 'rg_err' : rg_err, 'i0' : i0, 'i0_err' : i0_err,
+            'chi2' : chi2, 'npts' : n.astype(int)}
+
+        for key in ('rg', 'rg_err', 'i0', 'i0_err', 'chi2'):
+            results[key] = np.where(bad, np.nan, results[key])
+
+        return results
+
+    def calc_fit(self, idx_min, idx_max, rg, i0, norm_residuals=True):
+        """
+        Returns the fit curve and residuals for just the points from idx_min
+        to idx_max, inclusive.
+        """
+        window = slice(idx_min, idx_max+1)
+
+        q = self.q[window]
+
+        fit = i0*np.exp(-rg**2*q**2/3)
+        residual = self.i[window] - fit
+
+        if norm_residuals:
+            residual = residual/self.err[window]
+
+        return fit, residual
+
+
+def autorg(q, i, err, min_points=10, max_windows=20000):
+    """
+    Automatically finds a Guinier range for a profile. Every candidate
+    (qmin, qmax) window in the low q part of the profile is fit at once, and
+    windows are scored on how well they satisfy the qmin*Rg and qmax*Rg
+    limits, the relative Rg error, the fit quality, and the number of points.
+
+    :returns: A dict with rg, rg_err, i0, i0_err, qmin, qmax, idx_min,
+        idx_max and score for the best window, or None if no window gives a
+        valid fit.
+    """
+    fitter = GuinierFitter(q, i, err)
+    q = fitter.q
+
+    valid_idx = np.nonzero((fitter.i > 0) & (fitter.err > 0))[0]
+
+    if valid_idx.size < min_points:
+        return None
+
+    first = valid_idx[0]
+
+    # The Guinier region is at low q, so only search the first half of the data
+    last = first + max((valid_idx[-1] - first)//2, min_points)
+    last = min(last, len(q)-1)
+
+    npts = last - first + 1
+    max_start = first + max(npts//3, 1)
+
+    starts = np.arange(first, max_start)
+    ends = np.arange(first+min_points-1, last+1)
+
+    # Thin out the grid of windows for long profiles
+    total = starts.size*ends.size
+    if total > max_windows:
+        stride = int(np.ceil(np.sqrt(float(total)/max_windows)))
+        starts = starts[::stride]
+        ends = ends[::stride]
+
+    idx_min, idx_max = np.meshgrid(starts, ends, indexing='ij')
+    keep = idx_max - idx_min + 1 >= min_points
+
+    idx_min = idx_min[keep]
+    idx_max = idx_max[keep]
+
+    if idx_min.size == 0:
+        return None
+
+    results = fitter.fit_many(idx_min, idx_max)
+
+    rg = results['rg']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        qmin_rg = q[idx_min]*rg
+        qmax_rg = q[idx_max]*rg
+        rel_err = results['rg_err']/rg
+
+        ok = (np.isfinite(rg) & np.isfinite(results['i0']) & (qmin_rg <= 1.0)
+            & (qmax_rg <= 1.35) & (rel_err < 0.5) & (results['npts'] >= min_points))
+
+    if not np.any(ok):
+        return None
+
+    rg = rg[ok]
+    qmin_rg = qmin_rg[ok]
+    qmax_rg = qmax_rg[ok]
+    rel_err = rel_err[ok]
+    chi2 = results['chi2'][ok]
+    npts = results['npts'][ok]
+    idx_min = idx_min[ok]
+    idx_max = idx_max[ok]
+
+    qmax_score = 1 - np.abs(qmax_rg - 1.3)/1.3
+    qmin_score = 1 - qmin_rg
+    err_score = 1 - rel_err/0.5
+    fit_score = 1/(1 + np.abs(np.log(np.maximum(chi2, 1e-12))))
+    npts_score = npts/float(npts.max())
+
+    score = (0.3*qmax_score + 0.1*qmin_score + 0.2*err_score + 0.2*fit_score
+        + 0.2*npts_score)
+
+    best = int(np.argmax(score))
+
+    best_results = {
+        'rg'        : float(rg[best]),
+        'rg_err'    : float(results['rg_err'][ok][best]),
+        'i0'        : float(results['i0'][ok][best]),
+        'i0_err'    : float(results['i0_err'][ok][best]),
+        'qmin'      : float(q[idx_min[best]]),
+        'qmax'      : float(q[idx_max[best]]),
+        'idx_min'   : int(idx_min[best]),
+        'idx_max'   : int(idx_max[best]),
+        'score'     : float(score[best]),
+        }
+
+    return best_results
+
+def autorg_profiles(profiles, workers=None, executor=None):
+    """
+    Runs :func:`autorg` on many profiles, spread across worker processes for
+    large batches, and sets the Rg, I0, their errors and the Guinier range of
+    each profile where a range was found. Returns the list of results, with
+    None for profiles where no range was found.
+
+    :param int workers: Number of worker processes. None uses one per CPU,
+        0 or 1 runs everything in the calling process.
+    :param executor: An existing concurrent.futures executor to run on
+        instead of starting a new worker pool.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    workers = min(workers, len(profiles))
+
+    if executor is not None and len(profiles) > 1:
+        all_results = _autorg_map(executor, profiles, max(workers, 1))
+
+    elif workers > 1 and len(profiles) >= parallel_min_profiles:
+        with new_process_pool(workers) as executor:
+            all_results = _autorg_map(executor, profiles, workers)
+
+    else:
+        all_results = [autorg(data.q, data.i, data.err) for data in profiles]
+
+    for data, results in zip(profiles, all_results):
+        set_autorg_results(data, results)
+
+    return all_results
+
+def set_autorg_results(data, results):
+    """Sets the Rg, I0, their errors and the Guinier range of data from :func:`autorg` results, if any."""
+    if results is not None:
+        data.rg = results['rg']
+        data.rg_err = results['rg_err']
+        data.i0 = results['i0']
+        data.i0_err = results['i0_err']
+        data.guinier_qmin = results['qmin']
+        data.guinier_qmax = results['qmax']
+
+def _autorg_map(executor, profiles, workers):
+    chunksize = max(len(profiles)//(workers*4), 1)
+    args = [(data.q, data.i, data.err) for data in profiles]
+
+    return list(executor.map(_autorg_worker, args, chunksize=chunksize))
+
+def _autorg_worker(args):
+    return autorg(*args)
+
+def new_process_pool(workers, initializer=None, initargs=()):
+    """
+    Starts a pool of worker processes. The workers aren't forked from the
+    calling process, which may be the multithreaded GUI: a fork only copies
+    the calling thread, so a lock another thread held at the time would
+    stay locked in the workers.
+    """
+    if process_start_method in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context(process_start_method)
+    else:
+        context = multiprocessing.get_context('spawn')
+
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=context,
+        initializer=initializer, initargs=initargs)
+
+
+#: Smaller batches than this run autorg in the calling process.
+parallel_min_profiles = 64
+
+#: Start method of worker pools, where the platform has it. Otherwise
+#: workers are spawned.
+process_start_method = 'forkserver'
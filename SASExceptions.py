@@ -0,0 +1,53 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the exceptions raised while loading and processing data.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+
+class UnrecognizedDataFormat(Exception):
+
+    def __init__(self, value):
+        self.parameter = value
+
+    def __str__(self):
+        return repr(self.parameter)
+
+class DataNotCompatible(Exception):
+
+    def __init__(self, value):
+        self.parameter = value
+
+    def __str__(self):
+        return repr(self.parameter)
+
+class InvalidQuery(Exception):
+
+    def __init__(self, value):
+        self.parameter = value
+
+    def __str__(self):
+        return repr(self.parameter)
@@ -31,119 +31,621 @@ if __name__ == "__main__" and __package__ is None:
 import os.path
 import re
 import json
+import collections
+import functools
+from multiprocessing import shared_memory, resource_tracker
 
 import numpy as np
 
 import Data
+import SASExceptions
+import SASCache
+import SASCalc
+
+def load_files(filenames, workers=None, stack=False):
+    """
+    Loads a list of files, returning the loaded data objects in the same
+    order as the filenames. Files that can't be loaded are skipped.
+
+    :param list filenames: The files to load.
+    :param int workers: Number of worker processes to load with. If None,
+        the module level ``load_workers`` setting is used. 0 or 1 loads
+        everything in the calling process.
+    :param bool stack: If True and the loaded files are all profiles on the
+        same q grid, a :class:`Data.ProfileStack` is returned instead of a
+        list.
+
+    Files with a valid entry in ``parse_cache`` are read from the cache
+    instead of being parsed. Set ``parse_cache`` to None to turn it off.
+    """
+    loaded_data = _load_chunk(filenames, workers)
+
+    if (stack and len(loaded_data) > 0
+        and all(isinstance(data, Data.ProfileData) for data in loaded_data)
+        and Data.share_q_grid(loaded_data)):
+        loaded_data = Data.ProfileStack.from_profiles(loaded_data)
 
-def load_files(filenames):
-    loaded_data = []
+    return loaded_data
+
+def iter_load_files(filenames, chunk_size=64, workers=None, cancel=None,
+    find_rg=False):
+    """
+    Loads a list of files in chunks, yielding (chunk_filenames, loaded_data)
+    for each chunk in order, so the data can be used while the rest of the
+    files load. Files that can't be loaded are skipped. One worker pool is
+    used for all the chunks.
+
+    :param int chunk_size: Number of files per chunk.
+    :param int workers: As for :func:`load_files`.
+    :param cancel: A threading.Event. Once it is set, no more chunks are
+        loaded.
+    :param bool find_rg: If True, :func:`SASCalc.autorg` is run on profiles
+        without an Rg or Guinier range, in the same workers that load them.
+    """
+    workers = _get_num_workers(workers, len(filenames))
+
+    executor = None
+
+    if workers > 1:
+        resource_tracker.ensure_running()
+        executor = _new_load_pool(workers)
+
+    try:
+        for start in range(0, len(filenames), chunk_size):
+            if cancel is not None and cancel.is_set():
+                break
+
+            chunk = filenames[start:start+chunk_size]
+
+            yield chunk, _load_chunk(chunk, workers, executor, find_rg)
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def _load_chunk(filenames, workers=None, executor=None, find_rg=False):
+    loaded_data = [None]*len(filenames)
+
+    if parse_cache is not None:
+        for j, filename in enumerate(filenames):
+            data = parse_cache.get(filename)
+
+            if data is not None:
+                data.filename = filename
+                data.short_filename = os.path.basename(filename)
+                loaded_data[j] = data
+
+    to_load = [j for j in range(len(filenames)) if loaded_data[j] is None]
+    to_load_names = [filenames[j] for j in to_load]
+
+    if executor is None:
+        workers = _get_num_workers(workers, len(to_load_names))
+
+    with_hash = parse_cache is not None
+
+    parallel = executor is not None or workers > 1
+
+    if parallel:
+        new_data = _load_files_parallel(to_load_names, workers, executor, with_hash, find_rg)
+    elif with_hash:
+        new_data = [_load_file_hashed(filename) + (None,) for filename in to_load_names]
+    else:
+        new_data = [(_load_file(filename), None, None) for filename in to_load_names]
+
+    for j, (data, file_hash, rg_results) in zip(to_load, new_data):
+        loaded_data[j] = data
+
+        if parse_cache is not None and data is not None:
+            parse_cache.put(filenames[j], data, file_hash)
+
+        # Set after caching, so the cache only holds what was read from the file
+        SASCalc.set_autorg_results(data, rg_results)
+
+    if find_rg:
+        # Cached files and files loaded in this process weren't searched in a worker
+        searched = set(to_load) if parallel else set()
+
+        needs_rg = [data for j, data in enumerate(loaded_data)
+            if j not in searched and _needs_rg(data)]
+
+        if len(needs_rg) > 0:
+            SASCalc.autorg_profiles(needs_rg, workers, executor)
+
+    loaded_data = [data for data in loaded_data if data is not None]
+
+    # Lets the arrays be evicted under memory pressure and reloaded later
+    for data in loaded_data:
+        data.set_source(functools.partial(_load_file_cached, data.filename))
+
+    return loaded_data
 
-    for filename in filenames:
-        ext = os.path.splitext(filename)
+def scan_files(filenames, workers=None):
+    """
+    Reads the metadata (Rg, I0, Guinier range, header parameters) of a list
+    of files without parsing the data, for browsing large directories.
+    Returns data objects in the same order as the filenames, whose arrays
+    are loaded when first accessed. Formats without a scan function are
+    loaded in full. Files that can't be read are skipped.
 
-        if ext in text_types:
-            data = load_text(filename)
-        elif ext in series_types:
-            data = load_series(filename)
+    :param int workers: As for :func:`load_files`. Scanned stubs don't hold
+        any arrays, so they are cheap to send back from the workers.
+    """
+    workers = _get_num_workers(workers, len(filenames))
+
+    if workers > 1:
+        chunksize = max(len(filenames)//(workers*4), 1)
+
+        with _new_load_pool(workers) as executor:
+            scanned_data = list(executor.map(_scan_file, filenames, chunksize=chunksize))
+
+    else:
+        scanned_data = [_scan_file(filename) for filename in filenames]
+
+    return [data for data in scanned_data if data is not None]
+
+def _scan_file(filename):
+    loader = find_loader(filename)
+
+    if loader is None:
+        return None
+
+    try:
+        if loader.scan is not None:
+            data = loader.scan(filename)
         else:
-            data = load_text(filename)
+            data = _load_file_cached(filename)
 
-        if data is None:
-            if ext in text_types:
-                data = load_series(filename)
-            elif ext in series_types:
-                data = load_text(filename)
-            else:
-                data = load_series(filename)
+    except (SASExceptions.UnrecognizedDataFormat, ValueError, OSError):
+        data = None
+
+    if data is not None:
+        data.filename = filename
+        data.short_filename = os.path.basename(filename)
+
+    return data
+
+def _load_file_cached(filename):
+    data = None
+
+    if parse_cache is not None:
+        data = parse_cache.get(filename)
+
+    if data is None and parse_cache is not None:
+        data, file_hash = _load_file_hashed(filename)
 
         if data is not None:
-            data.filename = filename
-            data.short_filename = os.path.basename(filename)
-            loaded_data.append(data)
+            parse_cache.put(filename, data, file_hash)
+
+    elif data is None:
+        data = _load_file(filename)
+
+    if data is not None:
+        data.filename = filename
+        data.short_filename = os.path.basename(filename)
+
+    return data
+
+def _load_file(filename, head=None):
+    loader = find_loader(filename, head=head)
+
+    if loader is None:
+        return None
+
+    try:
+        data = _run_loader(loader, filename)
+    except SASExceptions.UnrecognizedDataFormat:
+        data = None
+
+    if data is not None:
+        data.filename = filename
+        data.short_filename = os.path.basename(filename)
+
+    return data
+
+def _load_file_hashed(filename):
+    """
+    Loads a file and returns (data, file_hash) for the parse cache. The
+    file is read once to both hash it and pick its loader, so caching the
+    result doesn't read the file again.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            raw = f.read()
+    except OSError:
+        return None, None
+
+    data = _load_file(filename, raw[:sniff_size])
+
+    return data, SASCache.hash_bytes(raw)
+
+def _get_num_workers(workers, num_files):
+    if workers is None:
+        workers = load_workers
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if num_files < parallel_min_files:
+        workers = 1
+
+    return max(min(workers, num_files), 1)
+
+def _load_files_parallel(filenames, workers, executor=None, with_hash=False,
+    find_rg=False):
+    """
+    Returns a list of (data, file_hash, rg_results), where file_hash is None
+    unless with_hash is set and rg_results is None unless find_rg is set and
+    :func:`SASCalc.autorg` found a Guinier range.
+    """
+    if len(filenames) == 0:
+        return []
+
+    chunksize = max(len(filenames)//(workers*4), 1)
+
+    load_func = functools.partial(_load_file_shared, with_hash=with_hash,
+        find_rg=find_rg)
+
+    if executor is not None:
+        results = list(executor.map(load_func, filenames, chunksize=chunksize))
+
+    else:
+        # Workers have to share the parent's tracker, otherwise each one thinks
+        # the blocks it created leaked when they're unlinked here.
+        resource_tracker.ensure_running()
+
+        with _new_load_pool(workers) as executor:
+            results = list(executor.map(load_func, filenames, chunksize=chunksize))
+
+    loaded_data = []
+
+    try:
+        for j, result in enumerate(results):
+            results[j] = None
+
+            if result is not None:
+                loaded_data.append((_unpack_shared(result), result[3], result[4]))
+            else:
+                loaded_data.append((None, None, None))
+
+    finally:
+        # Blocks that weren't unpacked would otherwise never be freed
+        for result in results:
+            _discard_shared(result)
 
     return loaded_data
 
+def _new_load_pool(workers):
+    # Workers start without the loaders registered after import
+    return SASCalc.new_process_pool(workers, _set_loaders, (list(_loaders),))
+
+def _set_loaders(loaders):
+    _loaders[:] = loaders
+
+def _load_file_shared(filename, with_hash=False, find_rg=False):
+    """
+    Loads a file in a worker process. The data arrays are copied into a
+    single shared memory block and stripped from the data object, so only
+    the block name and layout get pickled back to the parent process.
+    Errors are caught here, so one bad file doesn't stop the whole batch,
+    and the file is skipped. If find_rg is set, autorg is run on the
+    profile here too, and its results are returned separately so they
+    aren't cached as part of the file.
+    """
+    file_hash = None
+    rg_results = None
+
+    try:
+        if with_hash:
+            data, file_hash = _load_file_hashed(filename)
+        else:
+            data = _load_file(filename)
+    except Exception:
+        return None
+
+    if data is None:
+        return None
+
+    if find_rg and _needs_rg(data):
+        try:
+            rg_results = SASCalc.autorg(data.q, data.i, data.err)
+        except Exception:
+            rg_results = None
+
+    arrays = []
+    layout = []
+    nbytes = 0
+
+    for attr in _shared_array_attrs:
+        array = getattr(data, attr)
+
+        if array is None:
+            continue
+
+        array = np.ascontiguousarray(array)
+
+        for prev_attr, prev_array in arrays:
+            if prev_array is array:
+                layout.append((attr, prev_attr))
+                break
+        else:
+            layout.append((attr, nbytes, array.shape, array.dtype.str))
+            arrays.append((attr, array))
+            nbytes = nbytes + array.nbytes
+
+        setattr(data, attr, None)
+
+    if nbytes == 0:
+        return data, None, layout, file_hash, rg_results
+
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+
+    try:
+        for attr, array in arrays:
+            offset = [each[1] for each in layout if each[0] == attr][0]
+            shared = np.ndarray(array.shape, array.dtype, buffer=shm.buf, offset=offset)
+            shared[...] = array
+            del shared
+
+    except Exception:
+        shm.close()
+        shm.unlink()
+        return None
+
+    name = shm.name
+    shm.close()
+
+    return data, name, layout, file_hash, rg_results
+
+def _needs_rg(data):
+    return (isinstance(data, Data.ProfileData) and (data.rg is None or data.i0 is None)
+        and data.guinier_qmin is None)
+
+def _discard_shared(result):
+    if result is None or result[1] is None:
+        return
+
+    try:
+        shm = shared_memory.SharedMemory(name=result[1])
+    except FileNotFoundError:
+        return
+
+    shm.close()
+    shm.unlink()
+
+def _unpack_shared(result):
+    if result is None:
+        return None
+
+    data, name, layout = result[:3]
+
+    if name is not None:
+        shm = shared_memory.SharedMemory(name=name)
+
+        try:
+            for entry in layout:
+                if len(entry) == 4:
+                    attr, offset, shape, dtype = entry
+                    shared = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf, offset=offset)
+                    setattr(data, attr, shared.copy())
+                    del shared
+
+            for entry in layout:
+                if len(entry) == 2:
+                    setattr(data, entry[0], getattr(data, entry[1]))
+
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return data
+
+def register_loader(name, load_func, extensions=(), sniff=None, data_type='text',
+    scan=None):
+    """
+    Registers a loader for a file format. Loaders registered later take
+    precedence over earlier ones for the same extension.
+
+    :param str name: A unique name for the format. Registering a name again
+        replaces the existing loader.
+    :param load_func: Function that takes a filename and returns the loaded
+        data object, or None if the file doesn't contain data in the format.
+    :param list extensions: File extensions (including the dot) used by
+        the format.
+    :param sniff: Function that takes the first ``sniff_size`` bytes of a
+        file and returns True if the file looks like it is in the format. If
+        None, files are only matched by extension.
+    :param str data_type: 'text' for profiles, or 'series'.
+    :param scan: Optional function that takes a filename and returns a data
+        object with just the metadata read and arrays that load on first
+        use. Used by :func:`scan_files`.
+
+    The functions are sent to the worker processes files are loaded in, so
+    they have to be picklable, e.g. module level functions.
+    """
+    unregister_loader(name)
+
+    extensions = tuple(ext.lower() for ext in extensions)
+
+    _loaders.insert(0, Loader(name, load_func, extensions, sniff, data_type, scan))
+
+def unregister_loader(name):
+    _loaders[:] = [loader for loader in _loaders if loader.name != name]
+
+def find_loader(filename, data_type=None, head=None):
+    """
+    Picks the loader for a file from its extension and a sniff of the start
+    of the file. Loaders with a matching extension are checked first, then
+    the rest of the loaders by their sniff alone. Returns None if no loader
+    recognizes the file.
+
+    :param bytes head: The start of the file, if it has already been read.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+
+    if head is None:
+        try:
+            with open(filename, 'rb') as f:
+                head = f.read(sniff_size)
+        except OSError:
+            return None
+
+    loaders = [loader for loader in _loaders if data_type is None
+        or loader.data_type == data_type]
+
+    for loader in loaders:
+        if ext in loader.extensions and (loader.sniff is None or loader.sniff(head)):
+            return loader
+
+    for loader in loaders:
+        if ext not in loader.extensions and loader.sniff is not None and loader.sniff(head):
+            return loader
+
+    return None
+
 def load_text(filename):
-    ext = os.path.splitext(filename)
+    loader = find_loader(filename, 'text')
 
-    loaders = text_loaders.keys()
+    if loader is not None:
+        data = _run_loader(loader, filename)
+    else:
+        data = None
 
-    loaded = False
+    return data
 
-    if ext in loaders:
-        loaders.insert(0, loaders.pop(loaders.index(ext)))
-        
+def load_series(filename):
+    loader = find_loader(filename, 'series')
 
-    for ftype in loaders:
-        data = text_loaders[ftype](filename)
+    if loader is not None:
+        data = _run_loader(loader, filename)
+    else:
+        data = None
 
-        if data is not None:
-            break
+    return data
+
+def _run_loader(loader, filename):
+    """
+    Loads a file with a loader. Errors from a file the loader can't parse,
+    such as bad numbers or text that can't be decoded, are raised as
+    UnrecognizedDataFormat.
+    """
+    try:
+        data = loader.load(filename)
+    except SASExceptions.UnrecognizedDataFormat:
+        raise
+    except (ValueError, IndexError, KeyError, TypeError, OSError) as e:
+        raise SASExceptions.UnrecognizedDataFormat('Could not read {}: {}'.format(
+            filename, e))
 
     return data
 
 def load_dat_file(filename):
     ''' Loads a .dat format file '''
 
-    iq_pattern = re.compile('\s*\d*[.]\d*[+eE-]*\d+\s+-?\d*[.]\d*[+eE-]*\d+\s+\d*[.]\d*[+eE-]*\d+\s*')
-
-    i = []
-    q = []
-    err = []
-
-    with open(filename, 'rU') as f:
+    with open(filename, 'r') as f:
         lines = f.readlines()
 
     if len(lines) == 0:
         raise SASExceptions.UnrecognizedDataFormat('No data could be retrieved from the file.')
 
-    comment = ''
-    line = lines[0]
-    j=0
-    while line.split() and line.split()[0].strip()[0] == '#':
-        comment = comment+line
-        j = j+1
-        line = lines[j]
+    comment_end = _find_comment_end(lines)
+    comment = ''.join(lines[:comment_end])
+
+    header_start = _find_header_start(lines)
 
     parameters = {'filename' : os.path.split(filename)[1]}
 
     if comment.find('model_intensity') > -1:
         #FoXS file with a fit! has four data columns
         is_foxs_fit=True
-        imodel = []
     else:
         is_foxs_fit = False
 
-    for line in lines:
-        iq_match = iq_pattern.match(line)
+    if header_start is not None:
+        data_lines = lines[comment_end:header_start]
+    else:
+        data_lines = lines[comment_end:]
 
-        if iq_match:
-            if not is_foxs_fit:
-                found = iq_match.group().split()
-                q.append(float(found[0]))
-                i.append(float(found[1]))
-                err.append(float(found[2]))
+    columns = _parse_data_block(data_lines, is_foxs_fit)
+
+    #Check to see if there is any header from RAW, and if so get that.
+    if header_start is not None:
+        header = lines[header_start+1:]
+    else:
+        header = []
+
+    hdict = _parse_header(header)
+
+    if columns is not None:
+        if hdict:
+            for each in hdict:
+                if each != 'filename':
+                    parameters[each] = hdict[each]
+
+        if is_foxs_fit:
+            q, i, imodel, err = columns
+            profile_data = Data.ProfileData(q, i, err, q, imodel)
+        else:
+            q, i, err = columns
+            profile_data = Data.ProfileData(q, i, err)
+
+    else:
+        profile_data = None
+
+    if profile_data is not None:
+        profile_data.parameters = parameters
+        _set_guinier_values(profile_data, parameters)
+
+    return profile_data
+
+def scan_dat_file(filename):
+    """
+    Reads just the comments and RAW header of a .dat file, without parsing
+    the data. The RAW header is found by reading backwards from the end of
+    the file. Returns a ProfileData stub that loads its arrays from the file
+    when they're first used.
+    """
+    comment = ''
+    in_comment = True
+    has_data = False
+
+    with open(filename, 'r') as f:
+        for line in f:
+            if iq_pattern.match(line):
+                has_data = True
+                break
+            elif in_comment and line.strip() and line.lstrip()[0] == '#':
+                comment = comment + line
             else:
-                found = line.split()
-                q.append(float(found[0]))
-                i.append(float(found[1]))
-                imodel.append(float(found[2]))
-                err.append(float(found[3]))
+                in_comment = False
 
+    # Otherwise the error would only come up when the arrays are first used
+    if not has_data:
+        raise SASExceptions.UnrecognizedDataFormat('No data could be retrieved from the file.')
 
-    #Check to see if there is any header from RAW, and if so get that.
-    header = []
-    for j in range(len(lines)):
-        if '### HEADER:' in lines[j]:
-            header = lines[j+1:]
+    is_foxs_fit = comment.find('model_intensity') > -1
+
+    parameters = {'filename' : os.path.split(filename)[1]}
+
+    hdict = _parse_header(_read_header_from_end(filename))
 
+    if hdict:
+        for each in hdict:
+            if each != 'filename':
+                parameters[each] = hdict[each]
+
+    profile_data = Data.ProfileData.stub(functools.partial(_load_file_cached,
+        filename), is_foxs_fit)
+
+    profile_data.parameters = parameters
+    _set_guinier_values(profile_data, parameters)
+
+    return profile_data
+
+def _parse_header(header):
     hdict = None
 
     if len(header)>0:
-        hdr_str = ''
-        for each_line in header:
-            hdr_str=hdr_str+each_line.lstrip('#')
+        hdr_str = ''.join([each_line.lstrip('#') for each_line in header])
         try:
             hdict = dict(json.loads(hdr_str))
             # print 'Loading RAW info/analysis...'
@@ -151,59 +653,212 @@ def load_dat_file(filename):
             # print 'Unable to load header/analysis information. Maybe the file was not generated by RAW or was generated by an old version of RAW?'
             hdict = {}
 
-    if len(i) > 0:
-        i = np.array(i)
-        q = np.array(q)
-        err = np.array(err)
+    return hdict
 
-        if is_foxs_fit:
-            imodel = np.array(imodel)
+def _set_guinier_values(profile_data, parameters):
+    if 'analysis' in parameters:
+        if 'guinier' in parameters['analysis']:
+            guinier = parameters['analysis']['guinier']
 
-        if hdict:
-            for each in hdict:
-                if each != 'filename':
-                    parameters[each] = hdict[each]
+            if 'Rg' in guinier:
+                profile_data.rg = float(guinier['Rg'])
 
-        if is_foxs_fit:
-            profile_data = Data.ProfileData(q, i, err, q, imodel)
-        else:
-            profile_data = Data.ProfileData(q, i, err)
+            if 'I0' in guinier:
+                profile_data.i0 = float(guinier['I0'])
 
+            if 'qStart' in guinier:
+                profile_data.guinier_qmin = float(guinier['qStart'])
+
+            if 'qEnd' in guinier:
+                profile_data.guinier_qmax = float(guinier['qEnd'])
+
+            if 'Rg_err' in guinier:
+                profile_data.rg_err = float(guinier['Rg_err'])
+
+            if 'I0_err' in guinier:
+                profile_data.i0_err = float(guinier['I0_err'])
+
+def _read_header_from_end(filename, block_size=8192):
+    """
+    Returns the lines after the last ``### HEADER:`` line of a file, reading
+    backwards from the end. Stops at the first data line, since the header
+    always comes after the data.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+
+        tail = b''
+        checked = 0
+
+        while pos > 0:
+            step = min(block_size, pos)
+            pos = pos - step
+
+            f.seek(pos)
+            tail = f.read(step) + tail
+
+            idx = tail.rfind(b'### HEADER:')
+
+            if idx > -1:
+                header = tail[idx:].decode('utf-8', 'replace').splitlines(True)
+                return header[1:]
+
+            # The first line may be cut off unless we're at the start of the file
+            lines = tail.split(b'\n')
+            if pos > 0:
+                lines = lines[1:]
+
+            for line in lines[:len(lines)-checked]:
+                line = line.strip()
+
+                if line and not line.startswith(b'#'):
+                    return []
+
+            checked = len(lines)
+
+    return []
+
+def _find_comment_end(lines):
+    """
+    Returns the index of the first line after the leading block of comment
+    lines.
+    """
+    j = 0
+    nlines = len(lines)
+
+    while j < nlines:
+        line = lines[j].lstrip()
+
+        if not line or line[0] != '#':
+            break
+
+        j = j+1
+
+    return j
+
+def _find_header_start(lines):
+    """
+    Returns the index of the last ``### HEADER:`` line written by RAW, or
+    None if the file doesn't have one. The header is at the end of the file,
+    so we search backwards.
+    """
+    for j in range(len(lines)-1, -1, -1):
+        if '### HEADER:' in lines[j]:
+            return j
+
+    return None
+
+def _parse_data_block(lines, is_foxs_fit):
+    """
+    Parses the data block of a .dat file in one pass. Returns a tuple of
+    column arrays (q, i, err), or (q, i, imodel, err) for FoXS fit files, or
+    None if no data was found. Falls back to matching line by line if the
+    block isn't a clean numeric table.
+    """
+    data_lines = [line for line in lines if line.strip() and line.lstrip()[0] != '#']
+
+    # Skip any title lines before the data, like in ATSAS files
+    start = 0
+    while start < len(data_lines) and not iq_pattern.match(data_lines[start]):
+        start = start + 1
+
+    data_lines = data_lines[start:]
+
+    if is_foxs_fit:
+        ncols = 4
     else:
-        profile_data = None
+        ncols = 3
 
-    if profile_data is not None:
-        if 'analysis' in parameters:
-            if 'guinier' in parameters['analysis']:
-                guinier = parameters['analysis']['guinier']
+    data = None
 
-                if 'Rg' in guinier:
-                    profile_data.rg = float(guinier['Rg'])
-                
-                if 'I0' in guinier:
-                    profile_data.i0 = float(guinier['I0'])
+    if len(data_lines) > 0:
+        try:
+            data = np.loadtxt(data_lines, ndmin=2)
+        except ValueError:
+            data = None
 
-                if 'qStart' in guinier:
-                    profile_data.guinier_qmin = float(guinier['qStart'])
+    if data is not None and data.shape[1] >= ncols:
+        data = data[:, :ncols]
 
-                if 'qEnd' in guinier:
-                    profile_data.guinier_qmax = float(guinier['qEnd'])
+        # Match the rows the line by line pattern would accept
+        valid = np.all(np.isfinite(data), axis=1) & (data[:, 0] >= 0) & (data[:, 2] >= 0)
 
-                if 'Rg_err' in guinier:
-                    profile_data.rg_err = float(guinier['Rg_err'])
+        if not np.all(valid):
+            data = data[valid]
 
-                if 'I0_err' in guinier:
-                    profile_data.i0_err = float(guinier['I0_err'])
+    else:
+        data = _parse_data_lines(data_lines, is_foxs_fit)
 
-    return profile_data
+    if data is None or data.shape[0] == 0:
+        return None
+
+    return tuple(np.ascontiguousarray(data[:, j]) for j in range(ncols))
+
+def _parse_data_lines(lines, is_foxs_fit):
+    rows = []
+
+    for line in lines:
+        iq_match = iq_pattern.match(line)
+
+        if iq_match:
+            if not is_foxs_fit:
+                found = iq_match.group().split()
+                rows.append([float(val) for val in found[:3]])
+            else:
+                found = line.split()
+                rows.append([float(val) for val in found[:4]])
+
+    if len(rows) == 0:
+        return None
+
+    return np.array(rows)
+
+
+def _sniff_dat(head):
+    if b'\0' in head:
+        return False
+
+    lines = head.decode('latin-1').splitlines()
+
+    # The last line may be cut off by the sniff
+    if len(lines) > 1:
+        lines = lines[:-1]
+
+    for line in lines:
+        if iq_pattern.match(line):
+            return True
+
+    # A whole file without data, e.g. an empty one
+    if len(head) < sniff_size:
+        return False
+
+    # Otherwise the data may start after a comment block longer than the sniff
+    return all(not line.strip() or line.lstrip()[0] == '#' for line in lines)
+
+
+iq_pattern = re.compile(r'\s*\d*[.]\d*[+eE-]*\d+\s+-?\d*[.]\d*[+eE-]*\d+\s+\d*[.]\d*[+eE-]*\d+\s*')
+
+#: Number of worker processes load_files uses. None uses one per CPU, 0 or 1
+#: turns parallel loading off.
+load_workers = None
 
+#: Smaller batches than this load in the calling process, where starting
+#: the worker pool would cost more than it saves.
+parallel_min_files = 64
 
+#: Cache of parsed files, or None to always parse.
+parse_cache = SASCache.ParseCache(SASCache.default_cache_dir())
 
+_shared_array_attrs = ('q', 'i', 'err', 'fit_q', 'fit_i', 'fit_err')
 
+#: Number of bytes read from the start of a file to pick its loader.
+sniff_size = 512
 
-text_types = ['.txt', '.csv', '.dat', 'rad', '.int', '.fit']
-series_types = ['.sec']
+Loader = collections.namedtuple('Loader', ['name', 'load', 'extensions',
+    'sniff', 'data_type', 'scan'])
 
-text_loaders = {'.dat'  : load_dat_file,
-    }
+_loaders = []
 
+register_loader('dat', load_dat_file, ['.dat', '.txt', '.csv', '.int', '.fit', '.rad'],
+    _sniff_dat, scan=scan_dat_file)
@@ -0,0 +1,283 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains functions for processing batches of scattering profiles,
+such as putting them on a common q grid.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+import collections
+import threading
+
+import numpy as np
+
+import Data
+import SASExceptions
+
+
+def make_q_grid(qmin, qmax, npts, log=False):
+    """Returns a linearly or logarithmically spaced q grid."""
+    if log:
+        q = np.geomspace(qmin, qmax, npts)
+    else:
+        q = np.linspace(qmin, qmax, npts)
+
+    return q
+
+def regrid_profiles(profiles, q_target, method='interpolate'):
+    """
+    Resamples many profiles onto one q grid and returns them as a
+    :class:`Data.ProfileStack`. Profiles that share a source grid are
+    resampled together with one sparse weight matrix product, and the
+    weights for each source/target grid pair are cached. Target points
+    outside of a profile's q range are NaN.
+
+    :param profiles: A list of ProfileData, or a ProfileStack.
+    :param q_target: The q grid to resample onto, in increasing order.
+    :param str method: 'interpolate' for linear interpolation, or 'bin' to
+        average all the source points that fall in each target bin, which
+        reduces the number of points. Bins without any source points are
+        interpolated.
+    """
+    q_target = np.asarray(q_target, dtype=float)
+
+    if isinstance(profiles, Data.ProfileStack):
+        groups = [(profiles.q, profiles.i, profiles.err, list(range(len(profiles))))]
+        nprofiles = len(profiles)
+        columns = {key : getattr(profiles, key) for key in Data.ProfileStack.column_keys}
+        filenames = profiles.filenames
+
+    else:
+        nprofiles = len(profiles)
+        columns = {key : [getattr(data, key) for data in profiles]
+            for key in Data.ProfileStack.column_keys}
+        filenames = [data.filename if data.filename is not None else ''
+            for data in profiles]
+
+        grouped = collections.OrderedDict()
+
+        for j, data in enumerate(profiles):
+            q = data.q
+
+            for key in grouped:
+                if grouped[key][0] is q:
+                    break
+            else:
+                key = _grid_key(q)
+
+                if key not in grouped:
+                    grouped[key] = (q, [])
+
+            grouped[key][1].append(j)
+
+        groups = []
+
+        for q, rows in grouped.values():
+            i = np.stack([profiles[j].i for j in rows])
+            err = np.stack([profiles[j].err for j in rows])
+            groups.append((q, i, err, rows))
+
+    new_i = np.empty((nprofiles, q_target.size))
+    new_err = np.empty((nprofiles, q_target.size))
+
+    for q, i, err, rows in groups:
+        weights = get_regrid_weights(q, q_target, method)
+
+        group_i, group_err = weights.apply(i, err)
+
+        new_i[rows] = group_i
+        new_err[rows] = group_err
+
+    return Data.ProfileStack(q_target, new_i, new_err, filenames, **columns)
+
+def log_bin_profiles(profiles, npts):
+    """
+    Bins profiles onto a log spaced grid of npts points covering their
+    combined q range.
+    """
+    if isinstance(profiles, Data.ProfileStack):
+        q_grids = [profiles.q]
+    else:
+        q_grids = [data.q for data in profiles]
+
+    qmin = min(q[q > 0].min() for q in q_grids)
+    qmax = max(q.max() for q in q_grids)
+
+    q_target = make_q_grid(qmin, qmax, npts, log=True)
+
+    return regrid_profiles(profiles, q_target, 'bin')
+
+def get_regrid_weights(q_source, q_target, method='interpolate'):
+    """Returns the cached RegridWeights for a pair of grids."""
+    key = (_grid_key(q_source), _grid_key(q_target), method)
+
+    with _weight_cache_lock:
+        weights = _weight_cache.get(key)
+
+        if weights is not None:
+            _weight_cache.move_to_end(key)
+            return weights
+
+    if method == 'interpolate':
+        weights = _make_interp_weights(np.asarray(q_source, dtype=float), q_target)
+    elif method == 'bin':
+        weights = _make_bin_weights(np.asarray(q_source, dtype=float), q_target)
+    else:
+        raise ValueError('Unknown regrid method: {}'.format(method))
+
+    with _weight_cache_lock:
+        _weight_cache[key] = weights
+
+        while len(_weight_cache) > weight_cache_size:
+            _weight_cache.popitem(last=False)
+
+    return weights
+
+
+class RegridWeights(object):
+    """
+    Sparse (CSR layout) matrix that maps intensities on a source grid to a
+    target grid. Every target row has at least one entry, rows that can't be
+    filled are flagged in valid.
+    """
+
+    def __init__(self, indptr, indices, weights, valid):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.valid = valid
+
+    def apply(self, i, err):
+        """
+        Applies the weights to (N, nq_source) intensity and error arrays,
+        returning (N, nq_target) arrays. Errors are propagated in quadrature.
+        """
+        i = np.atleast_2d(i)
+        err = np.atleast_2d(err)
+
+        starts = self.indptr[:-1]
+
+        new_i = np.add.reduceat(i[:, self.indices]*self.weights, starts, axis=1)
+        new_err = np.sqrt(np.add.reduceat((err[:, self.indices]*self.weights)**2,
+            starts, axis=1))
+
+        new_i[:, ~self.valid] = np.nan
+        new_err[:, ~self.valid] = np.nan
+
+        return new_i, new_err
+
+
+def _grid_key(q):
+    q = np.asarray(q)
+
+    return (q.size, q.dtype.str, hash(q.tobytes()))
+
+def _make_interp_weights(q_source, q_target):
+    nsource = q_source.size
+
+    if nsource < 2:
+        raise SASExceptions.DataNotCompatible('Need at least two points to interpolate.')
+
+    left = np.searchsorted(q_source, q_target, side='right') - 1
+    left = np.clip(left, 0, nsource-2)
+
+    dq = q_source[left+1] - q_source[left]
+    frac = (q_target - q_source[left])/dq
+
+    valid = (q_target >= q_source[0]) & (q_target <= q_source[-1])
+
+    indices = np.empty(2*q_target.size, dtype=np.intp)
+    indices[0::2] = left
+    indices[1::2] = left + 1
+
+    weights = np.empty(2*q_target.size)
+    weights[0::2] = 1 - frac
+    weights[1::2] = frac
+    weights[np.repeat(~valid, 2)] = 0
+
+    indptr = np.arange(0, 2*q_target.size+1, 2)
+
+    return RegridWeights(indptr, indices, weights, valid)
+
+def _make_bin_weights(q_source, q_target):
+    ntarget = q_target.size
+
+    # Bin edges halfway between target points, in log space for log grids
+    if np.all(q_target > 0):
+        log_target = np.log(q_target)
+        mids = np.exp((log_target[1:] + log_target[:-1])/2)
+    else:
+        mids = (q_target[1:] + q_target[:-1])/2
+
+    if ntarget > 1:
+        first = q_target[0] - (mids[0] - q_target[0])
+        last = q_target[-1] + (q_target[-1] - mids[-1])
+    else:
+        first = -np.inf
+        last = np.inf
+
+    edges = np.concatenate(([first], mids, [last]))
+
+    bin_idx = np.searchsorted(edges, q_source, side='right') - 1
+    in_range = (bin_idx >= 0) & (bin_idx < ntarget)
+
+    source_idx = np.nonzero(in_range)[0]
+    bin_idx = bin_idx[in_range]
+
+    counts = np.bincount(bin_idx, minlength=ntarget)
+
+    interp = _make_interp_weights(q_source, q_target)
+
+    # Empty bins are filled by interpolation, with its two entries per row
+    row_sizes = np.where(counts > 0, counts, 2)
+
+    indptr = np.zeros(ntarget+1, dtype=np.intp)
+    indptr[1:] = np.cumsum(row_sizes)
+
+    indices = np.empty(indptr[-1], dtype=np.intp)
+    weights = np.empty(indptr[-1])
+
+    # Source points are in order, so each bin's points are contiguous
+    binned_pos = indptr[bin_idx] + (np.arange(bin_idx.size)
+        - np.searchsorted(bin_idx, bin_idx, side='left'))
+    indices[binned_pos] = source_idx
+    weights[binned_pos] = 1./counts[bin_idx]
+
+    empty = np.nonzero(counts == 0)[0]
+    empty_pos = np.concatenate((indptr[empty], indptr[empty]+1))
+    interp_pos = np.concatenate((interp.indptr[empty], interp.indptr[empty]+1))
+    indices[empty_pos] = interp.indices[interp_pos]
+    weights[empty_pos] = interp.weights[interp_pos]
+
+    valid = (counts > 0) | interp.valid
+
+    return RegridWeights(indptr, indices, weights, valid)
+
+
+#: Number of source/target grid pairs whose weights are kept.
+weight_cache_size = 64
+
+_weight_cache = collections.OrderedDict()
+_weight_cache_lock = threading.Lock()
@@ -28,11 +28,14 @@ including averaging, subtracting, and merging.
 if __name__ == "__main__" and __package__ is None:
     __package__ = "SASPub"
 
+import sys
 import threading
+import traceback
 
 import wx
 import wx.aui as aui
 import wx.lib.agw.aui as agwaui
+import wx.lib.dialogs
 
 import DataPanel
 import PlotPanel
@@ -121,6 +124,8 @@ class MyApp(wx.App):
     def OnInit(self):
         """Initializes the app. Calls the :class:`MainFrame`"""
 
+        sys.excepthook = self.ExceptionHook
+
         frame = MainFrame(title="SASPub", size=(1000, 600))
         frame.Show()
 
@@ -0,0 +1,306 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the command line batch renderer, which makes the standard
+plots of many profiles without the GUI, e.g.::
+
+    python SASPubBatch.py "data/*.dat" -o figures -f pdf -p loglin guinier
+
+By default each file gets its own figure for each plot type, with --combine
+all the files are plotted together. Figures are made in parallel worker
+processes. A JSON settings file can give any of the keys in
+``default_settings``, where plot_settings and line_settings are the same as
+the GUI's plot and line settings::
+
+    {
+        "plots"         : ["loglin", "dimkratky", "guinier"],
+        "format"        : "svg",
+        "figsize"       : [5, 4],
+        "dpi"           : 300,
+        "plot_settings" : {"tick_x_size" : 12, "tick_y_size" : 12},
+        "line_settings" : {"show_error_bars" : true}
+    }
+
+Command line options override the settings file.
+
+With --list, no figures are made. Instead the Rg, I0 and Guinier range of
+each file are read from its RAW header, without parsing the data, and
+printed as a tab separated table, e.g. to browse a large directory::
+
+    python SASPubBatch.py "archive/*.dat" --list > archive.tsv
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+import os
+import sys
+import copy
+import glob
+import json
+import argparse
+import concurrent.futures
+
+import FigureBuilder
+import SASCalc
+import SASFileIO
+
+
+#: Settings used for anything not in the settings file or on the command line.
+default_settings = {
+    'plots'         : ['loglin', 'dimkratky', 'guinier'],
+    'format'        : 'png',
+    'figsize'       : [5, 4],
+    'dpi'           : 150,
+    'combine'       : False,
+    'plot_settings' : {},
+    'line_settings' : {},
+    }
+
+#: Output formats the batch renderer can make.
+output_formats = ('png', 'pdf', 'svg')
+
+
+def main(argv=None):
+    parser = _make_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        settings = load_settings(args.settings)
+    except (OSError, ValueError) as e:
+        parser.error('Could not read settings file: {}'.format(e))
+
+    if args.plots is not None:
+        settings['plots'] = args.plots
+    if args.format is not None:
+        settings['format'] = args.format
+    if args.dpi is not None:
+        settings['dpi'] = args.dpi
+    if args.combine:
+        settings['combine'] = True
+
+    for plot_type in settings['plots']:
+        if plot_type not in FigureBuilder.plot_types:
+            parser.error('Unknown plot type: {}'.format(plot_type))
+
+    if settings['format'] not in output_formats:
+        parser.error('Unknown output format: {}'.format(settings['format']))
+
+    filenames = expand_globs(args.files)
+
+    if len(filenames) == 0:
+        parser.error('No files match {}'.format(' '.join(args.files)))
+
+    if args.list:
+        for row in list_metadata(filenames, args.workers):
+            print('\t'.join(row))
+
+        return 0
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = make_jobs(filenames, settings, args.output_dir, args.name)
+
+    failed = 0
+
+    for outputs, error in render_jobs(jobs, args.workers):
+        if error is None:
+            if not args.quiet:
+                for output in outputs:
+                    print(output)
+        else:
+            failed = failed + 1
+            sys.stderr.write('Failed to make {}: {}\n'.format(', '.join(outputs), error))
+
+    if failed > 0:
+        return 1
+
+    return 0
+
+def load_settings(filename=None):
+    """
+    Returns the batch settings, starting from ``default_settings`` and
+    updated with the settings in a JSON file, if given.
+    """
+    settings = copy.deepcopy(default_settings)
+
+    if filename is not None:
+        with open(filename, 'r') as f:
+            file_settings = json.load(f)
+
+        for key, value in file_settings.items():
+            if key not in settings:
+                raise ValueError('Unknown setting {}'.format(key))
+
+            if isinstance(settings[key], dict):
+                settings[key].update(value)
+            else:
+                settings[key] = value
+
+    return settings
+
+def expand_globs(patterns):
+    """
+    Returns the files matching a list of glob patterns, in order and without
+    duplicates.
+    """
+    filenames = []
+    seen = set()
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.expanduser(pattern)))
+
+        if len(matches) == 0 and os.path.isfile(pattern):
+            matches = [pattern]
+
+        for filename in matches:
+            if os.path.isfile(filename) and filename not in seen:
+                seen.add(filename)
+                filenames.append(filename)
+
+    return filenames
+
+def list_metadata(filenames, workers=None):
+    """
+    Returns rows of (file, rg, i0, guinier_qmin, guinier_qmax) strings for
+    the files, starting with a header row. Only the file headers are read.
+    """
+    rows = [('file', 'rg', 'i0', 'guinier_qmin', 'guinier_qmax')]
+
+    for data in SASFileIO.scan_files(filenames, workers):
+        values = [data.rg, data.i0, data.guinier_qmin, data.guinier_qmax]
+
+        rows.append(tuple([data.filename] + ['' if value is None else '{:.6g}'.format(value)
+            for value in values]))
+
+    return rows
+
+def make_jobs(filenames, settings, output_dir, name='combined'):
+    """
+    Splits the figures to make into jobs. Each job loads its files once and
+    makes every plot type for them: one job per file, or a single job for
+    all the files if settings['combine'] is set.
+    """
+    if settings['combine']:
+        groups = [(filenames, name)]
+    else:
+        groups = [([filename], os.path.splitext(os.path.basename(filename))[0])
+            for filename in filenames]
+
+    jobs = []
+
+    for group_files, base_name in groups:
+        outputs = [os.path.join(output_dir, '{}_{}.{}'.format(base_name, plot_type,
+            settings['format'])) for plot_type in settings['plots']]
+
+        jobs.append({
+            'filenames' : group_files,
+            'plots'     : list(settings['plots']),
+            'outputs'   : outputs,
+            'settings'  : settings,
+            })
+
+    return jobs
+
+def render_jobs(jobs, workers=None):
+    """
+    Renders the jobs, in worker processes if there is more than one job.
+    Yields (outputs, error) for each job in order, where error is None if
+    the figures were made.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    workers = min(workers, len(jobs))
+
+    if workers > 1:
+        chunksize = max(len(jobs)//(workers*4), 1)
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for result in executor.map(render_job, jobs, chunksize=chunksize):
+                yield result
+
+    else:
+        for job in jobs:
+            yield render_job(job)
+
+def render_job(job):
+    """Loads the files for a job and saves each of its figures."""
+    settings = job['settings']
+
+    try:
+        # Already running in a worker process, so don't start more
+        profiles = SASFileIO.load_files(job['filenames'], workers=0)
+
+        if len(profiles) == 0:
+            return job['outputs'], 'No profiles could be loaded'
+
+        for j, data in enumerate(profiles):
+            data.id = j
+
+        needs_rg = [data for data in profiles if (data.rg is None or data.i0 is None)
+            and data.guinier_qmin is None]
+
+        if len(needs_rg) > 0:
+            SASCalc.autorg_profiles(needs_rg, workers=0)
+
+        for plot_type, output in zip(job['plots'], job['outputs']):
+            plot = FigureBuilder.ProfilePlot(plot_type, settings['plot_settings'],
+                settings['line_settings'], settings['figsize'], settings['dpi'])
+
+            plot.plot_data_list(profiles)
+            plot.save_figure(output, format=settings['format'], dpi=settings['dpi'])
+
+    except Exception as e:
+        return job['outputs'], '{}: {}'.format(type(e).__name__, e)
+
+    return job['outputs'], None
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description='Makes the standard SASPub '
+        'plots of scattering profiles without the GUI.')
+
+    parser.add_argument('files', nargs='+', help='Files or glob patterns to plot.')
+    parser.add_argument('-o', '--output-dir', default='.', help='Directory to save '
+        'the figures in.')
+    parser.add_argument('-s', '--settings', help='JSON settings file.')
+    parser.add_argument('-p', '--plots', nargs='+', choices=FigureBuilder.plot_types,
+        help='Plot types to make.')
+    parser.add_argument('-f', '--format', choices=output_formats, help='Output format.')
+    parser.add_argument('--dpi', type=float, help='Output resolution.')
+    parser.add_argument('-c', '--combine', action='store_true', help='Plot all of '
+        'the files together, instead of one figure per file.')
+    parser.add_argument('-n', '--name', default='combined', help='Base name of the '
+        'figures made with --combine.')
+    parser.add_argument('-j', '--workers', type=int, help='Number of worker '
+        'processes, defaults to one per CPU.')
+    parser.add_argument('-q', '--quiet', action='store_true', help="Don't list "
+        "the figures made.")
+    parser.add_argument('-l', '--list', action='store_true', help="Don't make "
+        "figures, print the Rg, I0 and Guinier range from each file's header.")
+
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,576 @@
+'''
+Created on Sept 28, 2019
+
+@author: Jesse Hopkins
+
+#******************************************************************************
+# This file is part of SASPub.
+#
+#    SASPub is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SASPub is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with SASPub.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************************************************
+
+This file contains the search index over the loaded profiles' metadata, and
+the parser for filter queries such as::
+
+    rg > 30 and file ~ "buffer"
+    not (i0 < 0.1 or qmax <= 0.2)
+    sample 001
+
+Comparisons are ``field op value``, where op is one of ``> >= < <= = == !=``
+for values, or ``~ !~`` for substrings. Fields are ``file``, ``rg``,
+``rg_err``, ``i0``, ``i0_err``, ``guinier_qmin``, ``guinier_qmax``,
+``qmin``, ``qmax``, and the keys of the RAW header parameters. Nested keys
+can be given either by their full dotted path (``analysis.guinier.rg``) or
+by their last part. Field names are case insensitive. Bare words match
+profiles with a filename token that starts with the word, and terms next to
+each other are joined with ``and``.
+'''
+
+if __name__ == "__main__" and __package__ is None:
+    __package__ = "SASPub"
+
+import re
+import bisect
+import collections
+
+import SASExceptions
+
+
+def tokenize(text):
+    """Splits text into lower case alphanumeric tokens."""
+    return _word_re.findall(text.lower())
+
+def parse_query(text):
+    """
+    Parses a filter query into a tree of tuples, which
+    :meth:`DataIndex.evaluate` runs. An empty query gives None.
+
+    :raises SASExceptions.InvalidQuery: If the query can't be parsed.
+    """
+    parser = _QueryParser(text)
+
+    return parser.parse()
+
+
+class DataIndex(object):
+    """
+    In memory index of the metadata of loaded profiles. Numeric fields are
+    kept sorted, so comparisons are a binary search, and filenames are
+    indexed by token. Substring matches start from the results of the
+    longest previously matched substring of the same text, so a query that
+    is typed one character at a time only checks the files that matched
+    the last keystroke. Profiles are added and removed individually, the
+    index is never rebuilt.
+    """
+
+    def __init__(self):
+        self.ids = set()
+
+        self._filenames = {}
+        self._tokens = collections.defaultdict(set)
+        self._vocabulary = []
+
+        self._numeric = {}
+        self._text = {}
+
+        self._fields = {}
+
+        self._substring_cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, data_list):
+        for data in data_list:
+            data_id = data.id
+
+            if data_id in self.ids:
+                self._remove_one(data_id)
+
+            self.ids.add(data_id)
+
+            filename = (data.short_filename or data.filename or '').lower()
+            self._filenames[data_id] = filename
+
+            for token in set(tokenize(filename)):
+                if token not in self._tokens:
+                    bisect.insort(self._vocabulary, token)
+
+                self._tokens[token].add(data_id)
+
+            fields = _get_fields(data)
+            self._fields[data_id] = fields
+
+            for field, value in fields:
+                if isinstance(value, float):
+                    if field not in self._numeric:
+                        self._numeric[field] = _SortedValues()
+
+                    self._numeric[field].add(value, data_id)
+
+                else:
+                    values = self._text.setdefault(field, {})
+                    values.setdefault(value, set()).add(data_id)
+
+            for needle, matches in self._substring_cache.items():
+                if needle in filename:
+                    matches.add(data_id)
+
+    def remove(self, ids):
+        for data_id in ids:
+            if data_id in self.ids:
+                self._remove_one(data_id)
+
+    def update(self, data_list):
+        """Reindexes profiles whose metadata changed."""
+        self.add(data_list)
+
+    def get_fields(self):
+        """Returns the names of all the indexed fields."""
+        fields = set(self._numeric)
+        fields.update(self._text)
+        fields.add('file')
+
+        return sorted(fields)
+
+    def query(self, text):
+        """
+        Returns the set of ids matching a filter query, or all the ids for
+        an empty query.
+
+        :raises SASExceptions.InvalidQuery: If the query can't be parsed.
+        """
+        return self.evaluate(parse_query(text))
+
+    def evaluate(self, tree):
+        """Returns the set of ids matching a parsed query."""
+        if tree is None:
+            return set(self.ids)
+
+        kind = tree[0]
+
+        if kind == 'and':
+            result = self.evaluate(tree[1])
+
+            if len(result) > 0:
+                result = result & self.evaluate(tree[2])
+
+        elif kind == 'or':
+            result = self.evaluate(tree[1]) | self.evaluate(tree[2])
+
+        elif kind == 'not':
+            result = self.ids - self.evaluate(tree[1])
+
+        elif kind == 'word':
+            result = self.match_token_prefix(tree[1])
+
+        else:
+            result = self.match(*tree[1:])
+
+        return result
+
+    def match(self, field, op, value, quoted=False):
+        """
+        Returns the set of ids where ``field op value`` is true. Values are
+        compared as numbers unless quoted is set or they aren't numbers.
+        """
+        if op in ('!=', '!~'):
+            return self.ids - self.match(field, op[1] if op == '!~' else '=', value, quoted)
+
+        value = str(value).lower()
+
+        if field == 'file':
+            if op == '~':
+                result = self.match_substring(value)
+            elif op == '=':
+                result = {data_id for data_id in self._tokens.get(
+                    (tokenize(value) or [''])[0], ()) if self._filenames[data_id] == value}
+            else:
+                raise SASExceptions.InvalidQuery('Filenames can only be compared '
+                    'with =, !=, ~ or !~')
+
+            return result
+
+        number = None
+
+        if not quoted:
+            try:
+                number = float(value)
+            except ValueError:
+                pass
+
+        result = set()
+
+        if op == '~':
+            for text, ids in self._text.get(field, {}).items():
+                if value in text:
+                    result.update(ids)
+
+        elif number is not None:
+            if field in self._numeric:
+                result = self._numeric[field].compare(op, number)
+
+        elif op == '=':
+            result = set(self._text.get(field, {}).get(value, ()))
+
+        else:
+            raise SASExceptions.InvalidQuery('{} needs a number'.format(op))
+
+        return result
+
+    def match_token_prefix(self, prefix):
+        """Returns the ids with a filename token starting with prefix."""
+        result = set()
+
+        tokens = tokenize(prefix)
+
+        if len(tokens) == 0:
+            return set(self.ids)
+
+        for j, word in enumerate(tokens):
+            start = bisect.bisect_left(self._vocabulary, word)
+            matches = set()
+
+            for token in self._vocabulary[start:]:
+                if not token.startswith(word):
+                    break
+
+                matches.update(self._tokens[token])
+
+            result = matches if j == 0 else result & matches
+
+        return result
+
+    def match_substring(self, needle):
+        """Returns the ids whose filename contains needle."""
+        if needle == '':
+            return set(self.ids)
+
+        if needle in self._substring_cache:
+            self._substring_cache.move_to_end(needle)
+            return set(self._substring_cache[needle])
+
+        candidates = None
+
+        for cached in self._substring_cache:
+            if cached in needle and (candidates is None
+                or len(self._substring_cache[cached]) < len(candidates)):
+                candidates = self._substring_cache[cached]
+
+        if candidates is None:
+            candidates = self.ids
+
+        matches = {data_id for data_id in candidates if needle in self._filenames[data_id]}
+
+        self._substring_cache[needle] = matches
+
+        while len(self._substring_cache) > substring_cache_size:
+            self._substring_cache.popitem(last=False)
+
+        return set(matches)
+
+    def _remove_one(self, data_id):
+        self.ids.discard(data_id)
+
+        filename = self._filenames.pop(data_id)
+
+        for token in set(tokenize(filename)):
+            ids = self._tokens[token]
+            ids.discard(data_id)
+
+            if len(ids) == 0:
+                del self._tokens[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+
+        for field, value in self._fields.pop(data_id):
+            if isinstance(value, float):
+                self._numeric[field].remove(value, data_id)
+
+                if len(self._numeric[field]) == 0:
+                    del self._numeric[field]
+
+            else:
+                ids = self._text[field][value]
+                ids.discard(data_id)
+
+                if len(ids) == 0:
+                    del self._text[field][value]
+
+                    if len(self._text[field]) == 0:
+                        del self._text[field]
+
+        for matches in self._substring_cache.values():
+            matches.discard(data_id)
+
+
+class _SortedValues(object):
+    """
+    The values of one numeric field, sorted along with their ids. Ids with
+    the same value are kept sorted too, so any entry can be found by
+    bisecting.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, data_id):
+        idx = bisect.bisect_right(self.ids, data_id, *self._get_run(value))
+
+        self.values.insert(idx, value)
+        self.ids.insert(idx, data_id)
+
+    def remove(self, value, data_id):
+        idx = bisect.bisect_left(self.ids, data_id, *self._get_run(value))
+
+        del self.values[idx]
+        del self.ids[idx]
+
+    def _get_run(self, value):
+        """Returns the start and stop index of the entries equal to value."""
+        return (bisect.bisect_left(self.values, value),
+            bisect.bisect_right(self.values, value))
+
+    def compare(self, op, value):
+        if op == '>':
+            window = slice(bisect.bisect_right(self.values, value), None)
+        elif op == '>=':
+            window = slice(bisect.bisect_left(self.values, value), None)
+        elif op == '<':
+            window = slice(0, bisect.bisect_left(self.values, value))
+        elif op == '<=':
+            window = slice(0, bisect.bisect_right(self.values, value))
+        else:
+            window = slice(bisect.bisect_left(self.values, value),
+                bisect.bisect_right(self.values, value))
+
+        return set(self.ids[window])
+
+
+class _QueryParser(object):
+    """
+    Recursive descent parser for filter queries::
+
+        query      := or_expr
+        or_expr    := and_expr ('or' and_expr)*
+        and_expr   := not_expr (['and'] not_expr)*
+        not_expr   := 'not' not_expr | term
+        term       := '(' or_expr ')' | field op value | word
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self._lex(text)
+        self.pos = 0
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            return None
+
+        tree = self._parse_or()
+
+        if self.pos < len(self.tokens):
+            raise SASExceptions.InvalidQuery('Unexpected {}'.format(self.tokens[self.pos][1]))
+
+        return tree
+
+    def _lex(self, text):
+        tokens = []
+        pos = 0
+
+        text = text.strip()
+
+        while pos < len(text):
+            match = _token_re.match(text, pos)
+
+            if match is None or match.end() == pos:
+                raise SASExceptions.InvalidQuery('Could not read the query at {}'.format(text[pos:]))
+
+            kind = match.lastgroup
+            value = match.group(kind)
+
+            if kind == 'string':
+                value = value[1:-1]
+            elif kind == 'word' and value.lower() in ('and', 'or', 'not'):
+                kind = value.lower()
+
+            tokens.append((kind, value))
+            pos = match.end()
+
+        return tokens
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            kind = self.tokens[self.pos][0]
+        else:
+            kind = None
+
+        return kind
+
+    def _next(self):
+        if self.pos >= len(self.tokens):
+            raise SASExceptions.InvalidQuery('Unexpected end of the query')
+
+        token = self.tokens[self.pos]
+        self.pos = self.pos + 1
+
+        return token
+
+    def _parse_or(self):
+        tree = self._parse_and()
+
+        while self._peek() == 'or':
+            self._next()
+            tree = ('or', tree, self._parse_and())
+
+        return tree
+
+    def _parse_and(self):
+        tree = self._parse_not()
+
+        while self._peek() not in (None, 'or', 'close'):
+            if self._peek() == 'and':
+                self._next()
+
+            tree = ('and', tree, self._parse_not())
+
+        return tree
+
+    def _parse_not(self):
+        if self._peek() == 'not':
+            self._next()
+            return ('not', self._parse_not())
+
+        return self._parse_term()
+
+    def _parse_term(self):
+        kind, value = self._next()
+
+        if kind == 'open':
+            tree = self._parse_or()
+
+            if self._next()[0] != 'close':
+                raise SASExceptions.InvalidQuery('Expected )')
+
+        elif kind in ('word', 'string', 'number') and self._peek() == 'op':
+            op = self._next()[1]
+            value_kind, query_value = self._next()
+
+            if value_kind not in ('string', 'word', 'number'):
+                raise SASExceptions.InvalidQuery('Expected a value after {}'.format(op))
+
+            if op == '==':
+                op = '='
+
+            tree = ('cmp', _get_field_name(value), op, query_value, value_kind == 'string')
+
+        elif kind in ('word', 'string', 'number'):
+            tree = ('word', value)
+
+        else:
+            raise SASExceptions.InvalidQuery('Unexpected {}'.format(value))
+
+        return tree
+
+
+def _get_field_name(name):
+    name = name.lower()
+
+    return _field_aliases.get(name, name)
+
+def _get_fields(data):
+    """Returns the (field, value) pairs indexed for a profile."""
+    fields = []
+
+    for key in _data_fields[1:-2]:
+        _add_field(fields, key, getattr(data, key))
+
+    try:
+        q = data.q
+        _add_field(fields, 'qmin', q[0])
+        _add_field(fields, 'qmax', q[-1])
+    except (AttributeError, IndexError, TypeError):
+        pass
+
+    parameters = data.parameters if data.parameters is not None else {}
+
+    for path, value in _flatten(parameters):
+        if path == 'filename':
+            continue
+
+        _add_field(fields, path, value)
+
+        leaf = path.rsplit('.', 1)[-1]
+
+        if leaf != path and leaf not in _data_fields:
+            _add_field(fields, leaf, value)
+
+    return fields
+
+def _add_field(fields, field, value):
+    if value is None or isinstance(value, (dict, list, tuple)):
+        return
+
+    if isinstance(value, bool):
+        value = str(value).lower()
+    else:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = str(value).lower()
+        else:
+            # NaN can't be sorted, and never matches anything
+            if value != value:
+                return
+
+    fields.append((field, value))
+
+def _flatten(parameters, prefix=''):
+    for key, value in parameters.items():
+        path = prefix + str(key).lower()
+
+        if isinstance(value, dict):
+            for item in _flatten(value, path + '.'):
+                yield item
+        else:
+            yield path, value
+
+
+#: Number of substring matches kept to speed up the next, longer, substring.
+substring_cache_size = 32
+
+_data_fields = ('file', 'rg', 'rg_err', 'i0', 'i0_err', 'guinier_qmin',
+    'guinier_qmax', 'qmin', 'qmax')
+
+_word_re = re.compile(r'[a-z0-9]+')
+
+_token_re = re.compile(r'''\s*(?:
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\w.]))
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<op>>=|<=|!=|!~|==|=|<|>|~)
+    |(?P<open>\()
+    |(?P<close>\))
+    |(?P<word>[^\s()<>=!~"']+)
+    )\s*''', re.VERBOSE)
+
+_field_aliases = {
+    'filename'  : 'file',
+    'name'      : 'file',
+    'q_min'     : 'qmin',
+    'q_max'     : 'qmax',
+    }